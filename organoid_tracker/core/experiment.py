@@ -59,14 +59,15 @@ class Experiment:
         When update_splines is set to False, the zero point of all splines (if any) will not be updated. This makes
         moving the positions a lot faster. However, you should call splines.update_for_changed_positions yourself after
         moving all positions."""
+        positions = list(positions)
         affected_time_points = set()
         for position in positions:
             self._positions.detach_position(position)
-            self._links.remove_links_of_position(position)
             self._connections.remove_connections_of_position(position)
             self._position_data.remove_position(position)
 
             affected_time_points.add(position.time_point())
+        self._links.remove_links_of_positions(positions)
 
         # Update the data axes origins for all affected time points
         if update_splines:
@@ -168,6 +168,15 @@ class Gaussian:
         new_gaussian.mu_z += dz
         return new_gaussian
 
+    def scaled_xy(self, factor: float) -> "Gaussian":
+        """Returns a Gaussian for an image that has been resized in x and y by the given factor (so 0.5 for an image
+        that is half as wide and half as high). The z axis is left untouched. Positions are treated as pixel centers,
+        so a pixel that covers the two original pixels 0 and 1 is placed at the original position 0.5."""
+        return Gaussian(self.a,
+                        (self.mu_x + 0.5) * factor - 0.5, (self.mu_y + 0.5) * factor - 0.5, self.mu_z,
+                        self.cov_xx * factor ** 2, self.cov_yy * factor ** 2, self.cov_zz,
+                        self.cov_xy * factor ** 2, self.cov_xz * factor, self.cov_yz * factor)
+
     def __eq__(self, other: Any) -> bool:
         if isinstance(self, other.__class__):
             return self.__dict__ == other.__dict__
@@ -260,6 +260,25 @@ class Images:
             return False
         return True
 
+    def are_inside_image(self, positions: List[Position], time_point: TimePoint, *, margin_xy: int = 0,
+                         margin_z: int = 0) -> Optional[ndarray]:
+        """Array version of is_inside_image: returns a boolean array with for every position whether it is inside the
+        image of the given time point. The time points of the positions themselves are ignored, so you can also use this
+        method to check whether positions would fall inside the image of another time point. If there are no images
+        loaded, this returns None."""
+        image_size_zyx = self._image_loader.get_image_size_zyx()
+        if image_size_zyx is None:
+            return None
+        offset = self._offsets.of_time_point(time_point)
+        coords = numpy.array([(position.x, position.y, position.z) for position in positions],
+                             dtype=numpy.float64).reshape(-1, 3)
+        x = coords[:, 0] - offset.x
+        y = coords[:, 1] - offset.y
+        z = coords[:, 2] - offset.z
+        return (x >= margin_xy) & (x < image_size_zyx[2] - margin_xy) \
+            & (y >= margin_xy) & (y < image_size_zyx[1] - margin_xy) \
+            & (z >= margin_z) & (z < image_size_zyx[0] - margin_z)
+
     def get_image(self, time_point: TimePoint, image_channel: Optional[ImageChannel] = None) -> Optional[Image]:
         """Gets an image along with offset information, or None if there is no image available for that time point."""
         array = self.get_image_stack(time_point, image_channel)
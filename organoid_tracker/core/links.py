@@ -3,6 +3,7 @@ from typing import Optional, Dict, Iterable, List, Set, Union, Tuple, Any, Items
 
 from organoid_tracker.core import TimePoint, Color
 from organoid_tracker.core.position import Position
+from organoid_tracker.core.position_change_tracker import PositionChangeTracker
 from organoid_tracker.core.position_data import PositionData
 from organoid_tracker.core.typing import DataType
 
@@ -138,13 +139,35 @@ class Links:
     _tracks: List[LinkingTrack]
     _position_to_track: Dict[Position, LinkingTrack]
 
+    # Only used during remove_links_of_positions, for tracks that must still be removed from self._tracks
+    _removed_tracks: Optional[List[LinkingTrack]] = None
+
+    # If set, all positions with changed links are marked in here
+    _change_tracker: Optional[PositionChangeTracker] = None
+
+    # Increased on every change, see get_version
+    _version: int = 0
+
     def __init__(self):
         self._tracks = []
         self._position_to_track = dict()
 
+    def set_change_tracker(self, change_tracker: Optional[PositionChangeTracker]):
+        """Sets a change tracker, which will record all positions of which the links are changed from now on. This
+        includes the positions on both sides of an added or removed link. Set to None to stop recording."""
+        self._change_tracker = change_tracker
+
+    def get_version(self) -> int:
+        """Gets a number that is increased every time the links (or the order of the tracks) are changed. Useful to
+        find out whether calculations based on the links are still up to date."""
+        return self._version
+
     def add_links(self, links: "Links"):
         """Adds all links from the graph. Existing link are not removed. Changes may write through in the original
         links."""
+        self._version += 1
+        if self._change_tracker is not None:
+            self._change_tracker.mark_all_changed(links.find_all_positions())
         if self.has_links():
             for position1, position2 in links.find_all_links():
                 self.add_link(position1, position2)
@@ -154,6 +177,9 @@ class Links:
 
     def remove_all_links(self):
         """Removes all links in the experiment."""
+        self._version += 1
+        if self._change_tracker is not None:
+            self._change_tracker.mark_all_changed(self._position_to_track.keys())
         for track in self._tracks:  # Help the garbage collector by removing all the cyclic dependencies
             track._next_tracks.clear()
             track._previous_tracks.clear()
@@ -165,6 +191,10 @@ class Links:
         track = self._position_to_track.get(position)
         if track is None:
             return
+        self._version += 1
+        if self._change_tracker is not None:
+            self._change_tracker.mark_changed(position)
+            self._change_tracker.mark_all_changed(self.find_links_of(position))
 
         age = track.get_age(position)
         if len(track._positions_by_time_point) == 1:
@@ -173,7 +203,7 @@ class Links:
                 self._decouple_next_track(previous_track, next_track=track)
             for next_track in track._next_tracks:
                 self._decouple_previous_track(next_track, previous_track=track)
-            self._tracks.remove(track)
+            self._remove_track(track)
         elif age == 0:
             # Position is first position of the track
             # Remove links with previous tracks
@@ -206,6 +236,20 @@ class Links:
         # Remove from index
         del self._position_to_track[position]
 
+    def remove_links_of_positions(self, positions: Iterable[Position]):
+        """Removes all links from and to the given positions. If you have many positions, this is a lot faster than
+        calling remove_links_of_position for every position, as the list of tracks is only updated once."""
+        self._removed_tracks = list()
+        try:
+            for position in positions:
+                self.remove_links_of_position(position)
+        finally:
+            removed_track_ids = {id(track) for track in self._removed_tracks}
+            self._removed_tracks = None
+            self._version += 1
+            if len(removed_track_ids) > 0:
+                self._tracks[:] = [track for track in self._tracks if id(track) not in removed_track_ids]
+
     def replace_position(self, old_position: Position, position_new: Position):
         """Replaces one position with another. The old position is removed from the graph, the new one is added. All
         links will be moved over to the new position"""
@@ -215,6 +259,11 @@ class Links:
         # Update in track
         track = self._position_to_track.get(old_position)
         if track is not None:
+            self._version += 1
+            if self._change_tracker is not None:
+                self._change_tracker.mark_changed(old_position)
+                self._change_tracker.mark_changed(position_new)
+                self._change_tracker.mark_all_changed(self.find_links_of(old_position))
             track._positions_by_time_point[position_new.time_point_number() - track._min_time_point_number] = position_new
 
             # Update reference to track
@@ -282,6 +331,11 @@ class Links:
         if track1 is not None and track2 is not None and self.contains_link(position1, position2):
             return  # Already has that link, don't add a second link (this will corrupt the data structure)
 
+        self._version += 1
+        if self._change_tracker is not None:
+            self._change_tracker.mark_changed(position1)
+            self._change_tracker.mark_changed(position2)
+
         if track1 is not None and track2 is None:
             if track1.max_time_point_number() == position1.time_point_number() \
                     and not track1._next_tracks \
@@ -384,6 +438,10 @@ class Links:
         track2 = self._position_to_track.get(position2)
         if track1 is None or track2 is None:
             return  # No link exists
+        self._version += 1
+        if self._change_tracker is not None:
+            self._change_tracker.mark_changed(position1)
+            self._change_tracker.mark_changed(position2)
         if track1 == track2:
             # So positions are in the same track
 
@@ -452,7 +510,7 @@ class Links:
 
         # Safe to delete
         del self._position_to_track[track.find_first_position()]
-        self._tracks.remove(track)
+        self._remove_track(track)
 
     def contains_link(self, position1: Position, position2: Position) -> bool:
         """Returns True if the two given positions are linked to each other."""
@@ -517,6 +575,24 @@ class Links:
 
         return copy
 
+    def _index_of_track(self, track: LinkingTrack) -> int:
+        """Faster version of self._tracks.index(track). Searches by identity, starting at the end of the list, as tracks
+        that are being modified are usually the most recently added ones. Raises ValueError if the track is not found.
+        """
+        tracks = self._tracks
+        for index in range(len(tracks) - 1, -1, -1):
+            if tracks[index] is track:
+                return index
+        raise ValueError(f"{track} is not in the list")
+
+    def _remove_track(self, track: LinkingTrack):
+        """Removes the track from self._tracks. Within remove_links_of_positions, this is postponed until all positions
+        have been removed."""
+        if self._removed_tracks is not None:
+            self._removed_tracks.append(track)
+        else:
+            del self._tracks[self._index_of_track(track)]
+
     def _split_track(self, old_track: LinkingTrack, split_index: int) -> LinkingTrack:
         """Modifies the given track so that all positions after a certain time points are removed, and placed in a new
         track. So positions[0:split_index] will remain in this track, positions[split_index:] will be moved."""
@@ -538,7 +614,7 @@ class Links:
         old_track._next_tracks = [track_after_split]
 
         # Update indices for changed tracks
-        self._tracks.insert(self._tracks.index(old_track) + 1, track_after_split)
+        self._tracks.insert(self._index_of_track(old_track) + 1, track_after_split)
         for position_after_split in positions_after_split:
             self._position_to_track[position_after_split] = track_after_split
 
@@ -563,7 +639,7 @@ class Links:
 
         # Update registries
         first_track._lineage_data.update(second_track._lineage_data)
-        self._tracks.remove(second_track)
+        self._remove_track(second_track)
         for moved_position in second_track.positions():
             self._position_to_track[moved_position] = first_track
         first_track._next_tracks = second_track._next_tracks
@@ -621,6 +697,7 @@ class Links:
     def sort_tracks_by_x(self):
         """Sorts the tracks, which affects the order in which most find_ functions return data (like
         find_starting_tracks)."""
+        self._version += 1
         self._tracks.sort(key=lambda track: track.find_first_position().x)
 
     def find_all_tracks_in_time_point(self, time_point_number: int) -> Iterable[LinkingTrack]:
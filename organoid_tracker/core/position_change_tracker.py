@@ -0,0 +1,48 @@
+"""Used to record which positions were changed, so that calculations that depend on those positions (like the error
+checking) only need to be redone for those positions."""
+from typing import Set, Iterable
+
+from organoid_tracker.core.position import Position
+
+
+class PositionChangeTracker:
+    """Records which positions were added, removed or changed. Register it using the set_change_tracker methods of
+    Links, PositionCollection and PositionData. Those classes then mark all positions that are affected by a change. A
+    single tracker can be registered to multiple of those classes."""
+
+    _changed_positions: Set[Position]
+    _paused: bool
+
+    def __init__(self):
+        self._changed_positions = set()
+        self._paused = False
+
+    def mark_changed(self, position: Position):
+        """Marks a single position as changed."""
+        if not self._paused:
+            self._changed_positions.add(position)
+
+    def mark_all_changed(self, positions: Iterable[Position]):
+        """Marks all given positions as changed."""
+        if not self._paused:
+            self._changed_positions.update(positions)
+
+    def pause(self):
+        """Changes made after calling this method are not recorded, until resume() is called. Useful if you're making
+        changes that you know don't affect your calculations."""
+        self._paused = True
+
+    def resume(self):
+        """Records changes again, after pause() was called."""
+        self._paused = False
+
+    def has_changed_positions(self) -> bool:
+        """Returns True if any position was marked as changed since the last call to pop_changed_positions."""
+        return len(self._changed_positions) > 0
+
+    def pop_changed_positions(self) -> Set[Position]:
+        """Returns all positions that were marked as changed, and then forgets about them. Note that the returned
+        positions may no longer exist, as removals are recorded too."""
+        changed_positions = self._changed_positions
+        self._changed_positions = set()
+        return changed_positions
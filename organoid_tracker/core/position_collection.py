@@ -2,6 +2,7 @@ from typing import Dict, AbstractSet, Optional, Iterable, Set
 
 from organoid_tracker.core import TimePoint, min_none, max_none
 from organoid_tracker.core.position import Position
+from organoid_tracker.core.position_change_tracker import PositionChangeTracker
 
 
 class _PositionsAtTimePoint:
@@ -91,12 +92,19 @@ class PositionCollection:
     _min_time_point_number: Optional[int] = None
     _max_time_point_number: Optional[int] = None
 
+    # If set, all added, removed and moved positions are marked in here
+    _change_tracker: Optional[PositionChangeTracker] = None
+
     def __init__(self, positions: Iterable[Position] = ()):
         """Creates a new positions collection with the given positions already present."""
         self._all_positions = dict()
         for position in positions:
             self.add(position)
 
+    def set_change_tracker(self, change_tracker: Optional[PositionChangeTracker]):
+        """Sets a change tracker, which will record all positions that are added, removed or moved from now on. Set to
+        None to stop recording."""
+        self._change_tracker = change_tracker
 
     def of_time_point(self, time_point: TimePoint) -> AbstractSet[Position]:
         """Returns all positions for a given time point. Returns an empty set if that time point doesn't exist."""
@@ -108,6 +116,8 @@ class PositionCollection:
     def detach_all_for_time_point(self, time_point: TimePoint):
         """Removes all positions for a given time point, if any."""
         if time_point.time_point_number() in self._all_positions:
+            if self._change_tracker is not None:
+                self._change_tracker.mark_all_changed(self._all_positions[time_point.time_point_number()].positions())
             del self._all_positions[time_point.time_point_number()]
             self._recalculate_min_max_time_points()
 
@@ -116,6 +126,8 @@ class PositionCollection:
         time_point_number = position.time_point_number()
         if time_point_number is None:
             raise ValueError("Position does not have a time point, so it cannot be added")
+        if self._change_tracker is not None:
+            self._change_tracker.mark_changed(position)
 
         self._update_min_max_time_points_for_addition(time_point_number)
 
@@ -155,6 +167,9 @@ class PositionCollection:
             return  # Position was not in collection
         if positions_at_time_point.detach_position(old_position):
             positions_at_time_point.add_position(new_position)
+            if self._change_tracker is not None:
+                self._change_tracker.mark_changed(old_position)
+                self._change_tracker.mark_changed(new_position)
 
     def detach_position(self, position: Position):
         """Removes a position from a time point. Does nothing if the position is not in this collection."""
@@ -163,6 +178,8 @@ class PositionCollection:
             return
 
         if positions_at_time_point.detach_position(position):
+            if self._change_tracker is not None:
+                self._change_tracker.mark_changed(position)
 
             # Remove time point entirely if necessary
             if positions_at_time_point.is_empty():
@@ -202,6 +219,8 @@ class PositionCollection:
 
     def add_positions(self, other: "PositionCollection"):
         """Adds all positions and shapes of the other collection to this collection."""
+        if self._change_tracker is not None:
+            self._change_tracker.mark_all_changed(other)
         for time_point_number, other_positions in other._all_positions.items():
             if time_point_number in self._all_positions:
                 # Merge positions
@@ -1,6 +1,7 @@
 from typing import Dict, Optional, ItemsView, Iterable, Tuple, Union
 
 from organoid_tracker.core.position import Position
+from organoid_tracker.core.position_change_tracker import PositionChangeTracker
 from organoid_tracker.core.shape import ParticleShape
 from organoid_tracker.core.typing import DataType
 
@@ -12,10 +13,22 @@ PositionDataType = Union[DataType, ParticleShape]
 class PositionData:
     _position_data: Dict[str, Dict[Position, PositionDataType]]
 
+    # If set, all positions with changed data are marked in here
+    _change_tracker: Optional[PositionChangeTracker] = None
+
     def __init__(self):
         self._position_data = dict()
 
+    def set_change_tracker(self, change_tracker: Optional[PositionChangeTracker]):
+        """Sets a change tracker, which will record all positions of which the data is changed from now on. Set to
+        None to stop recording."""
+        self._change_tracker = change_tracker
+
     def merge_data(self, position_data: "PositionData"):
+        if self._change_tracker is not None:
+            for values in position_data._position_data.values():
+                self._change_tracker.mark_all_changed(values.keys())
+
         # Merge data
         for data_name, values in position_data._position_data.items():
             if data_name not in self._position_data:
@@ -25,6 +38,8 @@ class PositionData:
 
     def remove_position(self, position: Position):
         """Removes all data for the given position."""
+        if self._change_tracker is not None:
+            self._change_tracker.mark_changed(position)
         for data_set in self._position_data.values():
             if position in data_set:
                 del data_set[position]
@@ -32,6 +47,9 @@ class PositionData:
     def replace_position(self, old_position: Position, new_position: Position):
         """Replaces one position with another, such that all data associated with the old position becomes associated
          with tne nemw."""
+        if self._change_tracker is not None:
+            self._change_tracker.mark_changed(old_position)
+            self._change_tracker.mark_changed(new_position)
         for data_name, data_dict in self._position_data.items():
             if old_position in data_dict:
                 old_value = data_dict[old_position]
@@ -63,6 +81,8 @@ class PositionData:
             raise ValueError("The data_name 'id' is used to store the position itself.")
         if data_name.startswith("__"):
             raise ValueError(f"The data name {data_name} is not allowed: data names must not start with '__'.")
+        if self._change_tracker is not None:
+            self._change_tracker.mark_changed(position)
         data_of_positions = self._position_data.get(data_name)
         if data_of_positions is None:
             if value is None:
@@ -47,6 +47,14 @@ class Slicer3d:
             return new_image
         return image_3d[self._start[0]:self._end[0], self._start[1]:self._end[1], self._start[2]:self._end[2]]
 
+    def get_start_zyx(self) -> Tuple[int, int, int]:
+        """Gets the position in the big image of the first pixel of the slice (including padding)."""
+        return self._start
+
+    def get_end_zyx(self) -> Tuple[int, int, int]:
+        """Gets the position in the big image just after the last pixel of the slice (including padding)."""
+        return self._end
+
     def place_slice_in_volume(self, slice: ndarray, volume: ndarray):
         """Used to stitch an image back together. Places a slice (more precise: the area of interest of the slice)
         created using self.slice(..) back in an array of the same size as the array given to self.slice(..)."""
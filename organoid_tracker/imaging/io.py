@@ -3,7 +3,7 @@ import json
 import os
 from json import JSONEncoder
 from pathlib import Path
-from typing import List, Dict, Any, Iterable, Optional
+from typing import List, Dict, Any, Iterable, Optional, Set
 
 import numpy
 
@@ -494,5 +494,58 @@ def save_data_to_json(experiment: Experiment, json_file_name: str):
         os.remove(json_file_name_old)
 
 
+_SHARD_FILE_PREFIX = "time_point_"
+_SHARD_FILE_SUFFIX = ".json"
+
+
+def _get_shard_file_name(folder: str, time_point: TimePoint) -> str:
+    return os.path.join(folder, f"{_SHARD_FILE_PREFIX}{time_point.time_point_number():04}{_SHARD_FILE_SUFFIX}")
+
+
+def save_time_point_shard(experiment: Experiment, time_point: TimePoint, folder: str):
+    """Saves the positions and shapes of a single time point to a separate file in the given folder. Long-running
+    scripts can call this after every finished time point, so that a crash doesn't lose all results. The file is
+    first written under a temporary name, so a shard file is either complete or absent."""
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    positions = PositionCollection(experiment.positions.of_time_point(time_point))
+    encoded_positions = _encode_positions_and_shapes(positions, experiment.position_data)
+    encoded_positions.setdefault(str(time_point.time_point_number()), [])  # So that empty time points are recorded too
+    save_data = {"version": "v1", "positions": encoded_positions}
+
+    file_name = _get_shard_file_name(folder, time_point)
+    file_name_temp = file_name + ".TEMP"
+    with open(file_name_temp, 'w') as handle:
+        json.dump(save_data, handle, cls=_MyEncoder)
+    os.replace(file_name_temp, file_name)
+
+
+def find_time_points_with_shards(folder: str) -> Set[TimePoint]:
+    """Gets all time points for which a shard was written to the given folder using save_time_point_shard. Returns an
+    empty set if the folder doesn't exist."""
+    if not os.path.isdir(folder):
+        return set()
+    time_points = set()
+    for file_name in os.listdir(folder):
+        if not file_name.startswith(_SHARD_FILE_PREFIX) or not file_name.endswith(_SHARD_FILE_SUFFIX):
+            continue
+        try:
+            time_point_number = int(file_name[len(_SHARD_FILE_PREFIX):-len(_SHARD_FILE_SUFFIX)])
+        except ValueError:
+            continue  # Not one of our files
+        time_points.add(TimePoint(time_point_number))
+    return time_points
+
+
+def load_time_point_shards(experiment: Experiment, folder: str, min_time_point: int = 0, max_time_point: int = 5000):
+    """Loads all shards written by save_time_point_shard into the given experiment. Positions are added, shapes of
+    existing positions are overwritten."""
+    for time_point in find_time_points_with_shards(folder):
+        if time_point.time_point_number() < min_time_point or time_point.time_point_number() > max_time_point:
+            continue
+        with open(_get_shard_file_name(folder, time_point)) as handle:
+            data = json.load(handle)
+        _parse_shape_format(experiment, data["positions"], min_time_point, max_time_point)
+
+
 def _create_parent_directories(file_name: str):
     Path(file_name).parent.mkdir(parents=True, exist_ok=True)
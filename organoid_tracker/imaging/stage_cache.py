@@ -0,0 +1,90 @@
+"""Stores the results of the stages of a pipeline (like the possible links or the scores of all families) in a folder,
+so that a next run of the pipeline can reuse them. Every result is stored under a key, which must be calculated from
+everything that the result depends on. Use create_key for that. If a stage depends on an earlier stage, just include
+the key of that earlier stage.
+
+Note that the keys are only as good as the parts they are created from: if you change the contents of a file, but only
+the file name is used for the key, the old result will still be used."""
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Optional
+
+from organoid_tracker.core.experiment import Experiment
+from organoid_tracker.core.links import Links
+from organoid_tracker.core.score import ScoreCollection
+from organoid_tracker.imaging import io
+
+# Increase this number if the way that results are calculated changes, so that old results are no longer used
+_CACHE_VERSION = 1
+
+_MIN_TIME_POINT = -100000
+_MAX_TIME_POINT = 100000
+
+
+def create_key(*parts: Any) -> str:
+    """Creates a key from the given parts. All parts must be JSON-serializable, like strings, numbers, lists and dicts.
+    The same parts always give the same key."""
+    encoded = json.dumps([_CACHE_VERSION] + list(parts), sort_keys=True)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def hash_file(file_name: str) -> str:
+    """Returns a hash of the contents of the given file, for use in create_key."""
+    file_hash = hashlib.sha256()
+    with open(file_name, "rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def _get_file_name(folder: str, stage: str, key: str) -> str:
+    return os.path.join(folder, f"{stage}_{key}.{io.FILE_EXTENSION}")
+
+
+def _load(folder: str, stage: str, key: str) -> Optional[Experiment]:
+    file_name = _get_file_name(folder, stage, key)
+    if not os.path.exists(file_name):
+        return None
+    return io.load_data_file(file_name, min_time_point=_MIN_TIME_POINT, max_time_point=_MAX_TIME_POINT)
+
+
+def _save(folder: str, stage: str, key: str, experiment: Experiment):
+    """Saves the experiment. The file is first written under a temporary name, so that a cache file is either complete
+    or absent."""
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    file_name = _get_file_name(folder, stage, key)
+    file_name_temp = file_name + ".TEMP"
+    io.save_data_to_json(experiment, file_name_temp)
+    os.replace(file_name_temp, file_name)
+
+
+def load_links(folder: str, stage: str, key: str) -> Optional[Links]:
+    """Loads the links saved using save_links. Returns None if there are no links saved for this stage and key."""
+    experiment = _load(folder, stage, key)
+    if experiment is None:
+        return None
+    return experiment.links
+
+
+def save_links(folder: str, stage: str, key: str, links: Links):
+    """Saves the links of a stage of the pipeline."""
+    experiment = Experiment()
+    experiment.links = links
+    _save(folder, stage, key, experiment)
+
+
+def load_scores(folder: str, stage: str, key: str) -> Optional[ScoreCollection]:
+    """Loads the scores saved using save_scores. Returns None if there are no scores saved for this stage and key."""
+    experiment = _load(folder, stage, key)
+    if experiment is None:
+        return None
+    return experiment.scores
+
+
+def save_scores(folder: str, stage: str, key: str, scores: ScoreCollection):
+    """Saves the scores of a stage of the pipeline."""
+    experiment = Experiment()
+    experiment.scores = scores
+    _save(folder, stage, key, experiment)
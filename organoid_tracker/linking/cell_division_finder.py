@@ -1,15 +1,18 @@
 """Used to find divisions in linking data."""
 
 import itertools
-from typing import Set, List, Optional
+from typing import Set, List, Optional, Dict
 
-from organoid_tracker.core.images import Images
+from organoid_tracker.core import TimePoint, UserError
+from organoid_tracker.core.image_loader import ImageChannel
+from organoid_tracker.core.images import Images, Image
 from organoid_tracker.core.links import Links
 from organoid_tracker.core.position import Position
 from organoid_tracker.core.position_collection import PositionCollection
 from organoid_tracker.core.position_data import PositionData
-from organoid_tracker.core.score import Family, ScoreCollection
+from organoid_tracker.core.score import Family, ScoreCollection, Score
 from organoid_tracker.linking.scoring_system import MotherScoringSystem
+from organoid_tracker.util.processes import create_process_pool
 
 
 def get_next_division(links: Links, position: Position) -> Optional[Family]:
@@ -94,25 +97,94 @@ def find_families(links: Links, warn_on_many_daughters = True) -> List[Family]:
 
 
 def calculates_scores(images: Images, position_data: PositionData, links: Links,
-                      scoring_system: MotherScoringSystem) -> ScoreCollection:
-    """Finds all families in the given links and calculates their scores."""
-    scores = ScoreCollection()
-    families = find_families(links, warn_on_many_daughters=False)
-
-    # Sorting is important so that consecutive score calculations can use an image that is still in the cache
-    _sort_by_time_point(families)
+                      scoring_system: MotherScoringSystem, *, worker_count: int = 1) -> ScoreCollection:
+    """Finds all families in the given links and calculates their scores.
 
-    i = 0
-    for family in families:
-        scores.set_family_score(family, scoring_system.calculate(images, position_data, family))
-        i += 1
-        if i % 100 == 0:
-            print("   working on " + str(i) + "/" + str(len(families)) + "...")
+    The families are grouped by the time point of the mother, so that the images of that time point and the next are
+    loaded only once for the whole group. If worker_count is larger than 1, the groups are scored in that many worker
+    processes. The result is exactly the same as for a single process. (Only supported on systems that can fork
+    processes; on other systems, like Windows, a single process is always used.)"""
+    scores = ScoreCollection()
+    families_by_time_point = _group_by_time_point(find_families(links, warn_on_many_daughters=False))
+    family_count = sum(len(families) for families in families_by_time_point)
+
+    pool = create_process_pool(worker_count, _init_worker, (images, position_data, scoring_system))
+    try:
+        if pool is None:
+            _init_worker(images, position_data, scoring_system)
+            scores_of_groups = (_score_families(families) for families in families_by_time_point)
+        else:
+            scores_of_groups = pool.imap(_score_families, families_by_time_point)
+
+        done_count = 0
+        for families, scores_of_group in zip(families_by_time_point, scores_of_groups):
+            for family, score_dict in zip(families, scores_of_group):
+                scores.set_family_score(family, Score(**score_dict))
+            done_count += len(families)
+            print("   working on " + str(done_count) + "/" + str(family_count) + "...")
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _init_worker(None, None, None)
     return scores
 
 
-def _sort_by_time_point(families: List[Family]):
-    def get_time_point_number(family: Family):
-        return family.mother.time_point_number()
-
-    families.sort(key=get_time_point_number)
+def _group_by_time_point(families: List[Family]) -> List[List[Family]]:
+    """Groups the families by the time point of the mother. The groups are sorted by time point."""
+    families_by_time_point = dict()
+    for family in families:
+        time_point_number = family.mother.time_point_number()
+        families_of_time_point = families_by_time_point.get(time_point_number)
+        if families_of_time_point is None:
+            families_of_time_point = list()
+            families_by_time_point[time_point_number] = families_of_time_point
+        families_of_time_point.append(family)
+    return [families_by_time_point[time_point_number] for time_point_number in sorted(families_by_time_point.keys())]
+
+
+class _PreloadedImages(Images):
+    """Images that returns some already loaded images for the default image channel, and loads all others from the
+    wrapped images."""
+
+    _preloaded: Dict[TimePoint, Optional[Image]]
+
+    def __init__(self, images: Images, time_points: List[TimePoint]):
+        super().__init__()
+        self.use_image_loader_from(images)
+        self.offsets = images.offsets
+        try:
+            self.set_resolution(images.resolution())
+        except UserError:
+            pass  # No resolution set, so leave it empty here too
+        self._filters = images.filters
+        self._preloaded = dict()
+        for time_point in time_points:
+            self._preloaded[time_point] = images.get_image(time_point)
+
+    def get_image(self, time_point: TimePoint, image_channel: Optional[ImageChannel] = None) -> Optional[Image]:
+        if image_channel is None and time_point in self._preloaded:
+            return self._preloaded[time_point]
+        return super().get_image(time_point, image_channel)
+
+
+# Set by _init_worker, so that the worker processes receive these objects only once
+_worker_images: Optional[Images] = None
+_worker_position_data: Optional[PositionData] = None
+_worker_scoring_system: Optional[MotherScoringSystem] = None
+
+
+def _init_worker(images: Optional[Images], position_data: Optional[PositionData],
+                 scoring_system: Optional[MotherScoringSystem]):
+    global _worker_images, _worker_position_data, _worker_scoring_system
+    _worker_images = images
+    _worker_position_data = position_data
+    _worker_scoring_system = scoring_system
+
+
+def _score_families(families: List[Family]) -> List[Dict[str, float]]:
+    """Scores families that all have their mother in the same time point. Returns the scores as dictionaries, as Score
+    objects cannot be pickled."""
+    mother_time_point_number = families[0].mother.time_point_number()
+    images = _PreloadedImages(_worker_images, [TimePoint(mother_time_point_number),
+                                               TimePoint(mother_time_point_number + 1)])
+    return [_worker_scoring_system.calculate(images, _worker_position_data, family).dict() for family in families]
@@ -7,15 +7,19 @@ Targets. ECCV 2016 Proceedings.
 
 import dpct
 import math
-from typing import Dict, List, Iterable, Tuple
+from timeit import default_timer
+from typing import Dict, List, Tuple, Optional, Set
+
+import numpy
 
 from organoid_tracker.core.links import Links
 from organoid_tracker.core.position_collection import PositionCollection
 from organoid_tracker.core.position import Position
 from organoid_tracker.core.position_data import PositionData
 from organoid_tracker.core.resolution import ImageResolution
-from organoid_tracker.core.score import ScoreCollection, Score, ScoredFamily
+from organoid_tracker.core.score import ScoreCollection, Score
 from organoid_tracker.linking_analysis import linking_markers
+from organoid_tracker.util.processes import create_process_pool
 
 
 class _PositionToId:
@@ -42,20 +46,15 @@ class _PositionToId:
 
 def _to_links(position_ids: _PositionToId, results: Dict) -> Links:
     links = Links()
-
-    for entry in results["linkingResults"]:
-        if not entry["value"]:
-            continue  # Link was not detected
-        position1 = position_ids.position(entry["src"])
-        position2 = position_ids.position(entry["dest"])
+    for position1, position2 in _find_detected_links(position_ids, results, None, None):
         links.add_link(position1, position2)
-
     return links
 
 
 def run(positions: PositionCollection, position_data: PositionData, starting_links: Links, scores: ScoreCollection,
         resolution: ImageResolution, *, link_weight: int, detection_weight: int, division_weight: int, appearance_weight: int,
-        dissappearance_weight: int) -> Links:
+        dissappearance_weight: int, free_appearances: Set[Position] = frozenset(),
+        free_disappearances: Set[Position] = frozenset()) -> Links:
     """
     Calculates the optimal links, based on the given starting points and weights.
     :param positions: The positions.
@@ -68,37 +67,258 @@ def run(positions: PositionCollection, position_data: PositionData, starting_lin
     :param division_weight: multiplier for division features - the higher, the cheaper it is to create a cell division
     :param appearance_weight: multiplier for appearance features - the higher, the more expensive it is to create a cell out of nothing
     :param dissappearance_weight: multiplier for disappearance - the higher, the more expensive an end-of-lineage is
+    :param free_appearances: positions that can start a track without any penalty, just like positions in the first
+    time point. Useful if the position is already linked to the past outside of the given positions.
+    :param free_disappearances: positions that can end a track without any penalty, just like positions in the last
+    time point.
     :return:
     """
+    start_time = default_timer()
     position_ids = _PositionToId()
     input, has_possible_divisions = _create_dpct_graph(position_ids, starting_links, scores, position_data, resolution,
-                                        positions.first_time_point_number(), positions.last_time_point_number())
+                                                       positions.first_time_point_number(),
+                                                       positions.last_time_point_number(),
+                                                       free_appearances, free_disappearances)
+    graph_built_time = default_timer()
+
+    weights = _get_weights(has_possible_divisions, link_weight=link_weight, detection_weight=detection_weight,
+                           division_weight=division_weight, appearance_weight=appearance_weight,
+                           dissappearance_weight=dissappearance_weight)
+    results = dpct.trackFlowBased(input, weights)
+    solved_time = default_timer()
 
-    if has_possible_divisions:
-        weights = {"weights": [link_weight, detection_weight, division_weight, appearance_weight, dissappearance_weight]}
-    else:
-        weights = {"weights": [link_weight, detection_weight, appearance_weight, dissappearance_weight]}
+    links = _to_links(position_ids, results)
+    end_time = default_timer()
+    print(f"Building the linking graph took {graph_built_time - start_time:.1f} seconds, solving it took"
+          f" {solved_time - graph_built_time:.1f} seconds and converting the result took"
+          f" {end_time - solved_time:.1f} seconds.")
+    return links
+
+
+class _Window:
+    """A part of the time-lapse that is solved on its own."""
+    first_time_point_number: int
+    last_time_point_number: int
+
+    # Only links starting in this range are used from this window, see _get_window_cut. Both can be None for no limit.
+    min_owned_time_point_number: Optional[int]
+    max_owned_time_point_number: Optional[int]
+
+    # All possible links that lie completely within the window. (Not a Links object, as those can be too deeply nested
+    # to be sent to a worker process.)
+    links: List[Tuple[Position, Position]]
+
+    def __init__(self, first_time_point_number: int, last_time_point_number: int,
+                 min_owned_time_point_number: Optional[int], max_owned_time_point_number: Optional[int]):
+        self.first_time_point_number = first_time_point_number
+        self.last_time_point_number = last_time_point_number
+        self.min_owned_time_point_number = min_owned_time_point_number
+        self.max_owned_time_point_number = max_owned_time_point_number
+        self.links = list()
+
+
+def run_windowed(positions: PositionCollection, position_data: PositionData, starting_links: Links,
+                 scores: ScoreCollection, resolution: ImageResolution, *, link_weight: int, detection_weight: int,
+                 division_weight: int, appearance_weight: int, dissappearance_weight: int, window_size: int = 50,
+                 window_overlap: int = 10, worker_count: int = 1) -> Links:
+    """Like run(), but instead of solving the whole time-lapse at once, the time-lapse is split into windows of
+    window_size time points. Consecutive windows share window_overlap time points. The windows are solved independently,
+    in worker_count processes. (Only supported on systems that can fork processes; on other systems, like Windows, a
+    single process is always used.) The linking graph of a window is only built right before it is solved, so that at
+    most worker_count graphs are in memory at the same time.
+
+    Within a window, cells are free to appear in the first time point and to disappear in the last time point of the
+    window, just like for the first and last time point of the whole time-lapse. This makes the solution unreliable at
+    the window borders, which is why the windows overlap. The links in an overlapping region are taken from the earlier
+    window up to the middle of the region, and from the later window after that. The result is therefore deterministic,
+    but it can differ slightly from the solution of run()."""
+    first_time_point_number = positions.first_time_point_number()
+    last_time_point_number = positions.last_time_point_number()
+    if first_time_point_number is None or last_time_point_number is None:
+        return Links()  # No positions, so no links
+    windows = _create_windows(first_time_point_number, last_time_point_number, window_size, window_overlap)
+    _split_links_into_windows(starting_links, windows)
+    weights = {"link_weight": link_weight, "detection_weight": detection_weight, "division_weight": division_weight,
+               "appearance_weight": appearance_weight, "dissappearance_weight": dissappearance_weight}
+
+    start_time = default_timer()
+    links = Links()
+    pool = create_process_pool(min(worker_count, len(windows)), _init_worker,
+                               (position_data, scores, resolution, weights))
+    try:
+        if pool is None:
+            _init_worker(position_data, scores, resolution, weights)
+            links_of_windows = (_solve_window(window) for window in windows)
+        else:
+            links_of_windows = pool.imap(_solve_window, windows)
+
+        for window, links_of_window in zip(windows, links_of_windows):
+            for position1, position2 in links_of_window:
+                links.add_link(position1, position2)
+            window.links = list()  # Free up memory
+            print(f"    solved time points {window.first_time_point_number} to {window.last_time_point_number}")
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _init_worker(None, None, None, None)
+    end_time = default_timer()
+    print(f"Building and solving the linking graphs of {len(windows)} windows took {end_time - start_time:.1f}"
+          f" seconds.")
+    return links
+
+
+def _get_windows(first_time_point_number: int, last_time_point_number: int, window_size: int, window_overlap: int
+                 ) -> List[Tuple[int, int]]:
+    """Splits the time range into windows of the given size (in time points). Returns the first and last time point
+    number of every window, both inclusive. Consecutive windows share window_overlap time points. The last window can be
+    smaller than the others."""
+    if window_overlap < 2:
+        raise ValueError(f"window_overlap must be at least 2, was {window_overlap}")
+    if window_size <= window_overlap:
+        raise ValueError(f"window_size ({window_size}) must be larger than window_overlap ({window_overlap})")
+    windows = []
+    window_start = first_time_point_number
+    while True:
+        window_end = min(window_start + window_size - 1, last_time_point_number)
+        windows.append((window_start, window_end))
+        if window_end >= last_time_point_number:
+            return windows
+        window_start = window_end - window_overlap + 1
+
+
+def _get_window_cut(window: Tuple[int, int], next_window: Tuple[int, int]) -> int:
+    """Gets the time point number in the middle of the overlap of the two windows. Links that start before this time
+    point are taken from the first window, links that start at or after this time point from the second window."""
+    return (next_window[0] + window[1]) // 2
+
+
+def _create_windows(first_time_point_number: int, last_time_point_number: int, window_size: int, window_overlap: int
+                    ) -> List[_Window]:
+    """Creates the windows, including the time points of the links that every window is responsible for. The windows
+    don't contain any links yet."""
+    bounds = _get_windows(first_time_point_number, last_time_point_number, window_size, window_overlap)
+    windows = []
+    for i, (window_start, window_end) in enumerate(bounds):
+        min_owned_time_point_number = _get_window_cut(bounds[i - 1], bounds[i]) if i > 0 else None
+        max_owned_time_point_number = _get_window_cut(bounds[i], bounds[i + 1]) if i + 1 < len(bounds) else None
+        windows.append(_Window(window_start, window_end, min_owned_time_point_number, max_owned_time_point_number))
+    return windows
+
+
+def _split_links_into_windows(links: Links, windows: List[_Window]):
+    """Adds all links to the windows that they lie completely within. The windows must be created by _create_windows,
+    so that consecutive windows always start the same number of time points apart."""
+    first_time_point_number = windows[0].first_time_point_number
+    window_step = windows[1].first_time_point_number - first_time_point_number if len(windows) > 1 else 1
+    for position1, position2 in links.find_all_links():
+        time_point_number1 = position1.time_point_number()  # Position 1 is always the earliest in time
+        time_point_number2 = position2.time_point_number()
+
+        # Start at the last window that starts at or before the link, and go back until the windows end too early
+        window_index = min((time_point_number1 - first_time_point_number) // window_step, len(windows) - 1)
+        while window_index >= 0 and windows[window_index].last_time_point_number >= time_point_number2:
+            windows[window_index].links.append((position1, position2))
+            window_index -= 1
+
+
+# Set by _init_worker, so that the worker processes receive these objects only once
+_worker_position_data: Optional[PositionData] = None
+_worker_scores: Optional[ScoreCollection] = None
+_worker_resolution: Optional[ImageResolution] = None
+_worker_weights: Optional[Dict[str, int]] = None
+
+
+def _init_worker(position_data: Optional[PositionData], scores: Optional[ScoreCollection],
+                 resolution: Optional[ImageResolution], weights: Optional[Dict[str, int]]):
+    global _worker_position_data, _worker_scores, _worker_resolution, _worker_weights
+    _worker_position_data = position_data
+    _worker_scores = scores
+    _worker_resolution = resolution
+    _worker_weights = weights
+
+
+def _solve_window(window: _Window) -> List[Tuple[Position, Position]]:
+    """Builds and solves the linking graph of the window. Returns the detected links that this window is responsible
+    for. Used by worker processes."""
+    links = Links()
+    for position1, position2 in window.links:
+        links.add_link(position1, position2)
+
+    position_ids = _PositionToId()
+    input, has_possible_divisions = _create_dpct_graph(position_ids, links, _worker_scores,
+                                                       _worker_position_data, _worker_resolution,
+                                                       window.first_time_point_number, window.last_time_point_number)
+    weights = _get_weights(has_possible_divisions, **_worker_weights)
     results = dpct.trackFlowBased(input, weights)
-    return _to_links(position_ids, results)
+    return _find_detected_links(position_ids, results, window.min_owned_time_point_number,
+                                window.max_owned_time_point_number)
 
 
-def _scores_involving(daughter: Position, scores: Iterable[ScoredFamily]) -> Iterable[ScoredFamily]:
-    """Gets all scores where the given position plays the role as a daughter in the given score."""
-    for score in scores:
-        if daughter in score.family.daughters:
-            yield score
+def _find_detected_links(position_ids: _PositionToId, results: Dict, min_time_point_number: Optional[int],
+                         max_time_point_number: Optional[int]) -> List[Tuple[Position, Position]]:
+    """Gets all detected links. Only links that start at or after min_time_point_number and before
+    max_time_point_number are returned. (Both can be None for no limit.)"""
+    links = list()
+    for entry in results["linkingResults"]:
+        if not entry["value"]:
+            continue  # Link was not detected
+        position1 = position_ids.position(entry["src"])
+        position2 = position_ids.position(entry["dest"])
+        time_point_number = position1.time_point_number()  # Position 1 is always the earliest in time
+        if min_time_point_number is not None and time_point_number < min_time_point_number:
+            continue
+        if max_time_point_number is not None and time_point_number >= max_time_point_number:
+            continue
+        links.append((position1, position2))
+    return links
+
+
+def _get_weights(has_possible_divisions: bool, *, link_weight: int, detection_weight: int, division_weight: int,
+                 appearance_weight: int, dissappearance_weight: int) -> Dict:
+    """Gets the weights in the format of DPCT. If there are no possible divisions, no division weight must be given."""
+    if has_possible_divisions:
+        return {"weights": [link_weight, detection_weight, division_weight, appearance_weight, dissappearance_weight]}
+    return {"weights": [link_weight, detection_weight, appearance_weight, dissappearance_weight]}
+
+
+def _create_division_index(scores: ScoreCollection) -> Tuple[Dict[Position, Score],
+                                                                 Dict[Tuple[Position, Position], Score]]:
+    """Finds the highest score of every mother, and the highest score of every mother with one of its daughters. This
+    needs only one pass over all scores, after which the scores can be looked up for every position and link."""
+    mother_scores = dict()
+    mother_daughter_scores = dict()
+    for scored_family in scores.all_scored_families():
+        score = scored_family.score
+        total = score.total()
+        mother = scored_family.family.mother
+
+        current_score = mother_scores.get(mother)
+        if current_score is None or total > current_score.total():
+            mother_scores[mother] = score
+        for daughter in scored_family.family.daughters:
+            current_score = mother_daughter_scores.get((mother, daughter))
+            if current_score is None or total > current_score.total():
+                mother_daughter_scores[(mother, daughter)] = score
+    return mother_scores, mother_daughter_scores
 
 
 def _create_dpct_graph(position_ids: _PositionToId, starting_links: Links, scores: ScoreCollection,
                        position_data: PositionData, resolution: ImageResolution,
-                       min_time_point: int, max_time_point: int) -> Tuple[Dict, bool]:
-    """Creates the linking network. Returns the network and whether there are possible divisions."""
+                       min_time_point: int, max_time_point: int, free_appearances: Set[Position] = frozenset(),
+                       free_disappearances: Set[Position] = frozenset()) -> Tuple[Dict, bool]:
+    """Creates the linking network. Returns the network and whether there are possible divisions. Appearing in the
+    first time point, disappearing in the last time point and the given free appearances and disappearances don't cost
+    anything."""
     created_possible_division = False
+    mother_scores, mother_daughter_scores = _create_division_index(scores)
 
     segmentation_hypotheses = []
+    volumes = [0.0, 0.0]  # Indexed by position id, the first two ids are not used
     for position in starting_links.find_all_positions():
-        appearance_penalty = 1 if position.time_point_number() > min_time_point else 0
-        disappearance_penalty = 1 if position.time_point_number() < max_time_point else 0
+        appearance_penalty = 1 if position.time_point_number() > min_time_point \
+                                  and position not in free_appearances else 0
+        disappearance_penalty = 1 if position.time_point_number() < max_time_point \
+                                     and position not in free_disappearances else 0
 
         map = {
             "id": position_ids.id(position),
@@ -107,32 +327,44 @@ def _create_dpct_graph(position_ids: _PositionToId, starting_links: Links, score
             "disappearanceFeatures": [[0], [disappearance_penalty]],  # Using a dissappearance is expensive
             "timestep": [position.time_point_number(), position.time_point_number()]
         }
+        volumes.append(linking_markers.get_shape(position_data, position).volume())
 
         # Add division score
-        division_score = _max_score(scores.of_mother(position))
+        division_score = mother_scores.get(position, _ZERO_SCORE)
         if not division_score.is_unlikely_mother():
             map["divisionFeatures"] = [[0], [-division_score.total()]]
             created_possible_division = True
         segmentation_hypotheses.append(map)
 
-    linking_hypotheses = []
-    for position1, position2 in starting_links.find_all_links():
+    # Collect the links as arrays
+    link_count = len(starting_links)
+    ids = numpy.empty((link_count, 2), dtype=numpy.int64)
+    xyz = numpy.empty((link_count, 2, 3), dtype=numpy.float64)
+    is_possible_mother_daughter = numpy.zeros(link_count, dtype=bool)
+    for i, (position1, position2) in enumerate(starting_links.find_all_links()):
         # Make sure position1 is earlier in time
         if position1.time_point_number() > position2.time_point_number():
             position1, position2 = position2, position1
 
-        volume1, volume2 = linking_markers.get_shape(position_data, position1).volume(),\
-                           linking_markers.get_shape(position_data, position2).volume()
-        link_penalty = position1.distance_um(position2, resolution)
-        link_penalty += (abs(volume1 - volume2) ** (1 / 3)) * resolution.pixel_size_x_um
+        ids[i] = position_ids.id(position1), position_ids.id(position2)
+        xyz[i, 0] = position1.x, position1.y, position1.z
+        xyz[i, 1] = position2.x, position2.y, position2.z
+        if not mother_daughter_scores.get((position1, position2), _ZERO_SCORE).is_unlikely_mother():
+            is_possible_mother_daughter[i] = True
 
-        mother_score = _max_score(_scores_involving(position2, scores.of_mother(position1)))
+    # Calculate the link penalties: distance plus a penalty for volume changes
+    volumes = numpy.array(volumes, dtype=numpy.float64)
+    pixel_size_xyz_um = numpy.array(resolution.pixel_size_zyx_um[::-1], dtype=numpy.float64)
+    difference_um = (xyz[:, 0] - xyz[:, 1]) * pixel_size_xyz_um
+    link_penalties = numpy.sqrt(difference_um[:, 0] ** 2 + difference_um[:, 1] ** 2 + difference_um[:, 2] ** 2)
+    link_penalties += (numpy.abs(volumes[ids[:, 0]] - volumes[ids[:, 1]]) ** (1 / 3)) * resolution.pixel_size_x_um
+    link_penalties[is_possible_mother_daughter] /= 2
 
-        if not mother_score.is_unlikely_mother():
-            link_penalty /= 2
+    linking_hypotheses = []
+    for (id1, id2), link_penalty in zip(ids.tolist(), link_penalties.tolist()):
         linking_hypotheses.append({
-            "src": position_ids.id(position1),
-            "dest": position_ids.id(position2),
+            "src": id1,
+            "dest": id2,
             "features": [[0],  # Sending zero cells through the link costs nothing
                          [link_penalty]  # Sending one cell through the link costs this
                          ]
@@ -154,14 +386,3 @@ class _ZeroScore(Score):
 
 
 _ZERO_SCORE = _ZeroScore()
-
-
-def _max_score(scored_family: Iterable[ScoredFamily]) -> Score:
-    """Returns the highest score from the collection, or zero if the collection is empty."""
-    max_score = None
-    for family in scored_family:
-        if max_score is None or family.score.total() > max_score.total():
-            max_score = family.score
-    if max_score is None:
-        return _ZERO_SCORE
-    return max_score
@@ -0,0 +1,181 @@
+"""Used to find good weights for the DPCT linker. For every combination of weights, the links are calculated and compared
+to ground truth links, both on the level of individual links and on the level of lineages (cell divisions and lineage
+ends)."""
+import itertools
+from typing import List, Dict, Optional
+
+from organoid_tracker.comparison import links_comparison, lineage_comparison
+from organoid_tracker.comparison.report import ComparisonReport
+from organoid_tracker.core.experiment import Experiment
+from organoid_tracker.core.links import Links
+from organoid_tracker.core.score import ScoreCollection
+from organoid_tracker.linking import dpct_linker
+from organoid_tracker.util.processes import create_process_pool
+
+
+class LinkingWeights:
+    """The weights used by dpct_linker.run."""
+    link_weight: int
+    detection_weight: int
+    division_weight: int
+    appearance_weight: int
+    dissappearance_weight: int
+
+    def __init__(self, *, link_weight: int, detection_weight: int, division_weight: int, appearance_weight: int,
+                 dissappearance_weight: int):
+        self.link_weight = link_weight
+        self.detection_weight = detection_weight
+        self.division_weight = division_weight
+        self.appearance_weight = appearance_weight
+        self.dissappearance_weight = dissappearance_weight
+
+    def to_dict(self) -> Dict[str, int]:
+        """Returns the weights as keyword arguments for dpct_linker.run."""
+        return {"link_weight": self.link_weight, "detection_weight": self.detection_weight,
+                "division_weight": self.division_weight, "appearance_weight": self.appearance_weight,
+                "dissappearance_weight": self.dissappearance_weight}
+
+    def __repr__(self) -> str:
+        return "LinkingWeights(" + ", ".join(f"{key}={value}" for key, value in self.to_dict().items()) + ")"
+
+
+def create_weight_grid(*, link_weights: List[int], detection_weights: List[int], division_weights: List[int],
+                       appearance_weights: List[int], dissappearance_weights: List[int]) -> List[LinkingWeights]:
+    """Creates all combinations of the given weights."""
+    return [LinkingWeights(link_weight=link_weight, detection_weight=detection_weight, division_weight=division_weight,
+                           appearance_weight=appearance_weight, dissappearance_weight=dissappearance_weight)
+            for link_weight, detection_weight, division_weight, appearance_weight, dissappearance_weight
+            in itertools.product(link_weights, detection_weights, division_weights, appearance_weights,
+                                 dissappearance_weights)]
+
+
+def _f1_score(true_positives: int, false_positives: int, false_negatives: int) -> float:
+    """Calculates the F1 score. Returns 0 if there are no true positives."""
+    if true_positives == 0:
+        return 0
+    return 2 * true_positives / (2 * true_positives + false_positives + false_negatives)
+
+
+class WeightSweepResult:
+    """How well the links calculated using some weights match the ground truth."""
+    weights: LinkingWeights
+
+    links_true_positives: int
+    links_false_positives: int
+    links_false_negatives: int
+    divisions_true_positives: int
+    divisions_false_positives: int
+    divisions_false_negatives: int
+    lineage_ends_true_positives: int
+    lineage_ends_false_positives: int
+    lineage_ends_false_negatives: int
+
+    def __init__(self, weights: LinkingWeights, links_report: ComparisonReport, lineages_report: ComparisonReport):
+        self.weights = weights
+        self.links_true_positives = links_report.count_positions(links_comparison.LINKS_TRUE_POSITIVES)
+        self.links_false_positives = links_report.count_positions(links_comparison.LINKS_FALSE_POSITIVES)
+        self.links_false_negatives = links_report.count_positions(links_comparison.LINKS_FALSE_NEGATIVES)
+        self.divisions_true_positives = lineages_report.count_positions(lineage_comparison.DIVISIONS_TRUE_POSITIVES)
+        self.divisions_false_positives = lineages_report.count_positions(lineage_comparison.DIVISIONS_FALSE_POSITIVES)
+        self.divisions_false_negatives = lineages_report.count_positions(lineage_comparison.DIVISIONS_FALSE_NEGATIVES)
+        self.lineage_ends_true_positives = lineages_report.count_positions(
+            lineage_comparison.LINEAGE_END_TRUE_POSITIVES)
+        self.lineage_ends_false_positives = lineages_report.count_positions(
+            lineage_comparison.LINEAGE_END_FALSE_POSITIVES)
+        self.lineage_ends_false_negatives = lineages_report.count_positions(
+            lineage_comparison.LINEAGE_END_FALSE_NEGATIVES)
+
+    def links_f1_score(self) -> float:
+        return _f1_score(self.links_true_positives, self.links_false_positives, self.links_false_negatives)
+
+    def divisions_f1_score(self) -> float:
+        return _f1_score(self.divisions_true_positives, self.divisions_false_positives, self.divisions_false_negatives)
+
+    def lineage_ends_f1_score(self) -> float:
+        return _f1_score(self.lineage_ends_true_positives, self.lineage_ends_false_positives,
+                         self.lineage_ends_false_negatives)
+
+
+# Set by _init_worker, so that the worker processes receive these objects only once
+_worker_experiment: Optional[Experiment] = None
+_worker_possible_links: Optional[Links] = None
+_worker_scores: Optional[ScoreCollection] = None
+_worker_ground_truth: Optional[Experiment] = None
+_worker_max_distance_um: float = 5
+
+
+def _init_worker(experiment: Optional[Experiment], possible_links: Optional[Links], scores: Optional[ScoreCollection],
+                 ground_truth: Optional[Experiment], max_distance_um: float):
+    global _worker_experiment, _worker_possible_links, _worker_scores, _worker_ground_truth, _worker_max_distance_um
+    _worker_experiment = experiment
+    _worker_possible_links = possible_links
+    _worker_scores = scores
+    _worker_ground_truth = ground_truth
+    _worker_max_distance_um = max_distance_um
+
+
+def _solve_and_compare(weights: LinkingWeights) -> WeightSweepResult:
+    """Calculates the links for the given weights and compares them to the ground truth."""
+    scratch = Experiment()
+    scratch.images.set_resolution(_worker_experiment.images.resolution())
+    scratch.links = dpct_linker.run(_worker_experiment.positions, _worker_experiment.position_data,
+                                    _worker_possible_links, _worker_scores, _worker_experiment.images.resolution(),
+                                    **weights.to_dict())
+    for position in scratch.links.find_all_positions():
+        scratch.positions.add(position)
+
+    links_report = links_comparison.compare_links(_worker_ground_truth, scratch, _worker_max_distance_um,
+                                                  margin_xy_px=-1)
+    lineages_report = lineage_comparison.compare_links(_worker_ground_truth, scratch, _worker_max_distance_um)
+    return WeightSweepResult(weights, links_report, lineages_report)
+
+
+def sweep(experiment: Experiment, possible_links: Links, scores: ScoreCollection, ground_truth: Experiment,
+          weights_list: List[LinkingWeights], *, max_distance_um: float = 5, worker_count: int = 1
+          ) -> List[WeightSweepResult]:
+    """Calculates the links for all given weights, and compares every result to the ground truth. Returns the results
+    ranked from best to worst, first by the F1 score of the links, then by the F1 score of the cell divisions.
+
+    The possible links and scores are calculated only once by the caller, and are then reused for every set of weights.
+    If worker_count is larger than 1, that many sets of weights are tried at the same time in worker processes. (Only
+    supported on systems that can fork processes; on other systems, like Windows, a single process is always used.)
+
+    The ground truth must have an image resolution set. Positions are considered equal if they are at most
+    max_distance_um apart."""
+    results = list()
+    pool = create_process_pool(min(worker_count, len(weights_list)), _init_worker,
+                               (experiment, possible_links, scores, ground_truth, max_distance_um))
+    try:
+        if pool is None:
+            _init_worker(experiment, possible_links, scores, ground_truth, max_distance_um)
+            results_iterable = (_solve_and_compare(weights) for weights in weights_list)
+        else:
+            results_iterable = pool.imap(_solve_and_compare, weights_list)
+
+        for result in results_iterable:
+            results.append(result)
+            print(f"    done with {len(results)}/{len(weights_list)} sets of weights")
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _init_worker(None, None, None, None, 5)
+
+    # Sorting is stable, so for equal scores the order of weights_list is kept
+    results.sort(key=lambda result: (result.links_f1_score(), result.divisions_f1_score()), reverse=True)
+    return results
+
+
+def format_table(results: List[WeightSweepResult]) -> str:
+    """Formats the results as a tab-separated table, one row per set of weights."""
+    lines = ["rank\tlink_weight\tdetection_weight\tdivision_weight\tappearance_weight\tdissappearance_weight"
+             "\tlinks_f1\tlinks_tp\tlinks_fp\tlinks_fn\tdivisions_f1\tdivisions_tp\tdivisions_fp\tdivisions_fn"
+             "\tlineage_ends_f1"]
+    for rank, result in enumerate(results, start=1):
+        weights = result.weights
+        lines.append(f"{rank}\t{weights.link_weight}\t{weights.detection_weight}\t{weights.division_weight}"
+                     f"\t{weights.appearance_weight}\t{weights.dissappearance_weight}"
+                     f"\t{result.links_f1_score():.4f}\t{result.links_true_positives}\t{result.links_false_positives}"
+                     f"\t{result.links_false_negatives}\t{result.divisions_f1_score():.4f}"
+                     f"\t{result.divisions_true_positives}\t{result.divisions_false_positives}"
+                     f"\t{result.divisions_false_negatives}\t{result.lineage_ends_f1_score():.4f}")
+    return "\n".join(lines) + "\n"
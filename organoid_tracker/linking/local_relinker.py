@@ -0,0 +1,111 @@
+"""Used to link a small region of an experiment again, for example after manual corrections. All links to positions
+outside that region are kept as they are. Within the region, the possible links are found again, the possible divisions
+are scored again and the best links are chosen using the DPCT linker. The result is then spliced into the existing
+links."""
+from typing import Set, Optional, Iterable
+
+from organoid_tracker.core import TimePoint
+from organoid_tracker.core.experiment import Experiment
+from organoid_tracker.core.links import Links
+from organoid_tracker.core.position import Position
+from organoid_tracker.linking import nearest_neighbor_linker, cell_division_finder, dpct_linker
+from organoid_tracker.linking.nearby_position_finder import find_close_positions_batched
+from organoid_tracker.linking.rational_scoring_system import RationalScoringSystem
+from organoid_tracker.linking.scoring_system import MotherScoringSystem
+
+
+def find_region(experiment: Experiment, *, min_time_point_number: int, max_time_point_number: int,
+                around: Optional[Iterable[Position]] = None, radius_um: float = float("inf")) -> Set[Position]:
+    """Finds all positions from min_time_point_number to max_time_point_number (inclusive). If positions are given
+    for around, only positions that are at most radius_um away from one of those positions are returned. (Time is
+    ignored for this distance.)"""
+    resolution = experiment.images.resolution()
+    around = list(around) if around is not None else None
+    region = set()
+    for time_point_number in range(min_time_point_number, max_time_point_number + 1):
+        positions = list(experiment.positions.of_time_point(TimePoint(time_point_number)))
+        if around is None:
+            region.update(positions)
+            continue
+        close_positions_list = find_close_positions_batched(around, around=positions, tolerance=1,
+                                                            resolution=resolution, max_amount=1,
+                                                            max_distance_um=radius_um)
+        for position, close_positions in zip(positions, close_positions_list):
+            if len(close_positions) > 0:
+                region.add(position)
+    return region
+
+
+def relink_region(experiment: Experiment, region: Set[Position], *,
+                  scoring_system: Optional[MotherScoringSystem] = None, link_weight: int = 20,
+                  detection_weight: int = 150, division_weight: int = 30, appearance_weight: int = 150,
+                  dissappearance_weight: int = 100) -> Links:
+    """Links the positions in the given region again. Returns a copy of experiment.links in which all links between two
+    positions in the region are replaced by the new links. Links to positions outside the region are kept. If a
+    position is linked to the future outside the region, its other links to the future are kept too, so that a division
+    on the border of the region isn't broken up. The same is done for links to the past.
+
+    Positions in the region with a kept link to the past can start a track for free, and will not receive another link
+    to the past. Likewise, positions with a kept link to the future can end a track for free, and will not receive
+    another link to the future.
+
+    By default, the RationalScoringSystem is used to score possible divisions, which requires images. The default
+    weights are the same as for the create_links script."""
+    if scoring_system is None:
+        scoring_system = RationalScoringSystem()
+    links = experiment.links
+
+    # Find the possible links within the region
+    sub_experiment = Experiment()
+    sub_experiment.images = experiment.images
+    for position in region:
+        sub_experiment.positions.add(position)
+    possible_links = nearest_neighbor_linker.nearest_neighbor(sub_experiment, tolerance=2)
+
+    # Find the links that are kept: all links to positions outside the region, along with the other links in the same
+    # direction of those positions
+    kept_links = set()
+    for position in region:
+        future_positions = links.find_futures(position)
+        if any(future_position not in region for future_position in future_positions):
+            kept_links.update((position, future_position) for future_position in future_positions)
+        past_positions = links.find_pasts(position)
+        if any(past_position not in region for past_position in past_positions):
+            kept_links.update((past_position, position) for past_position in past_positions)
+
+    # Don't allow links that would conflict with the links that are kept
+    free_appearances = set()
+    free_disappearances = set()
+    for position in region:
+        if any((past_position, position) in kept_links for past_position in links.find_pasts(position)):
+            free_appearances.add(position)
+            for past_position in possible_links.find_pasts(position):
+                possible_links.remove_link(past_position, position)
+        if any((position, future_position) in kept_links for future_position in links.find_futures(position)):
+            free_disappearances.add(position)
+            for future_position in possible_links.find_futures(position):
+                possible_links.remove_link(position, future_position)
+
+    # Choose the best links
+    if possible_links.has_links():
+        scores = cell_division_finder.calculates_scores(experiment.images, experiment.position_data, possible_links,
+                                                        scoring_system)
+        new_links = dpct_linker.run(sub_experiment.positions, experiment.position_data, possible_links, scores,
+                                    experiment.images.resolution(), link_weight=link_weight,
+                                    detection_weight=detection_weight, division_weight=division_weight,
+                                    appearance_weight=appearance_weight, dissappearance_weight=dissappearance_weight,
+                                    free_appearances=free_appearances, free_disappearances=free_disappearances)
+    else:
+        new_links = Links()
+
+    # Splice the new links into the existing links
+    result = links.copy()
+    removed_links = [(position, future_position) for position in region
+                     for future_position in links.find_futures(position)
+                     if future_position in region and (position, future_position) not in kept_links]
+    for position1, position2 in removed_links:
+        result.remove_link(position1, position2)
+    for position1, position2 in new_links.find_all_links():
+        result.add_link(position1, position2)
+    print(f"Relinked {len(region)} positions: replaced {len(removed_links)} links by {len(new_links)} links.")
+    return result
@@ -3,6 +3,9 @@
 import operator
 from typing import Iterable, List, Optional, Set, Dict
 
+import numpy
+from scipy.spatial import cKDTree
+
 from organoid_tracker.core.position import Position
 from organoid_tracker.core.resolution import ImageResolution
 
@@ -70,6 +73,43 @@ def find_close_positions(positions: Iterable[Position], *, around: Position, tol
     return nearest_positions.get_positions(max_amount)
 
 
+def find_close_positions_batched(positions: Iterable[Position], *, around: List[Position], tolerance: float,
+                                 resolution: ImageResolution, max_amount: int = 1000,
+                                 max_distance_um: float = float("inf")) -> List[List[Position]]:
+    """Like find_close_positions, but for many positions at once: for every position in around, a list of the nearest
+    positions is returned. Instead of calculating the distance to every position, a KD-tree is used, so this is much
+    faster if there are many positions."""
+    if tolerance < 1:
+        raise ValueError()
+    positions = list(positions)
+    if len(positions) == 0 or len(around) == 0:
+        return [[] for _ in around]
+
+    scale_xyz = numpy.array([resolution.pixel_size_zyx_um[2], resolution.pixel_size_zyx_um[1],
+                             resolution.pixel_size_zyx_um[0]], dtype=numpy.float64)
+    positions_xyz = numpy.array([(position.x, position.y, position.z) for position in positions], dtype=numpy.float64)
+    around_xyz = numpy.array([(position.x, position.y, position.z) for position in around], dtype=numpy.float64)
+
+    amount = min(max_amount, len(positions))
+    _, nearest_indices = cKDTree(positions_xyz * scale_xyz).query(around_xyz * scale_xyz, k=amount)
+    nearest_indices = nearest_indices.reshape(len(around), amount)
+
+    # Recalculate the distances in the same way as Position.distance_squared, so that we get exactly the same results
+    # as find_close_positions
+    difference = (positions_xyz[nearest_indices] - around_xyz[:, numpy.newaxis, :]) * scale_xyz
+    distances_squared = difference[:, :, 0] ** 2 + difference[:, :, 1] ** 2 + difference[:, :, 2] ** 2
+    distances_squared[distances_squared > max_distance_um ** 2] = numpy.inf
+    shortest_distances_squared = distances_squared.min(axis=1)
+    accepted = (distances_squared <= shortest_distances_squared[:, numpy.newaxis] * tolerance ** 2) \
+        & (distances_squared != numpy.inf)
+
+    results = []
+    for i in range(len(around)):
+        order = numpy.argsort(distances_squared[i], kind="stable")
+        results.append([positions[nearest_indices[i, j]] for j in order if accepted[i, j]])
+    return results
+
+
 def find_closest_position(positions: Iterable[Position], *, around: Position, resolution: ImageResolution,
                           ignore_z: bool = False, max_distance_um: int = 100000) -> Optional[Position]:
     """Gets the position closest ot the given position."""
@@ -1,14 +1,37 @@
 """Ultra-simple linker. Used as a starting point for more complex links."""
+from typing import List, Optional, Tuple
+
+from numpy import ndarray
+
 from organoid_tracker.core import TimePoint
 from organoid_tracker.core.experiment import Experiment
-from organoid_tracker.core.images import Images
 from organoid_tracker.core.links import Links
-from organoid_tracker.core.position_collection import PositionCollection
-from organoid_tracker.linking.nearby_position_finder import find_close_positions
+from organoid_tracker.core.position import Position
+from organoid_tracker.core.resolution import ImageResolution
+from organoid_tracker.linking.nearby_position_finder import find_close_positions_batched
+from organoid_tracker.util.processes import create_process_pool
+
+
+class _TimePointPair:
+    """All data necessary to find the links between two consecutive time points. Sent to worker processes."""
+    positions_previous: List[Position]
+    positions_current: List[Position]
+
+    # Whether the positions would still be inside the image of the other time point. None if there are no images.
+    previous_inside_current_image: Optional[ndarray]
+    current_inside_previous_image: Optional[ndarray]
 
+    def __init__(self, experiment: Experiment, time_point_previous: TimePoint, time_point_current: TimePoint):
+        self.positions_previous = list(experiment.positions.of_time_point(time_point_previous))
+        self.positions_current = list(experiment.positions.of_time_point(time_point_current))
+        self.previous_inside_current_image = experiment.images.are_inside_image(self.positions_previous,
+                                                                                time_point_current)
+        self.current_inside_previous_image = experiment.images.are_inside_image(self.positions_current,
+                                                                                time_point_previous)
 
-def nearest_neighbor(experiment: Experiment, *, tolerance: float = 1.0, back: bool = True, forward: bool = True
-                     ) -> Links:
+
+def nearest_neighbor(experiment: Experiment, *, tolerance: float = 1.0, back: bool = True, forward: bool = True,
+                     worker_count: int = 1) -> Links:
     """Simple nearest neighbour linking, keeping a list of potential candidates based on a given tolerance.
 
     A tolerance of 1.05 also links positions 5% from the closest position, so you end up with more links than you have
@@ -21,60 +44,90 @@ def nearest_neighbor(experiment: Experiment, *, tolerance: float = 1.0, back: bo
     tolerance is calculated independently for both directions: with a tolerance of for example 2, you'll get all forward
     links that are at most twice as long as the shortest forward link, and you'll get all backward links that are at
     most twice as long as the shortest backward link.
+
+    If worker_count is larger than 1, the links of every pair of time points are found in that many worker processes.
+    The result is exactly the same as for a single process. (Only supported on systems that can fork processes; on
+    other systems, like Windows, a single process is always used.)
     """
     if not back and not forward:
         raise ValueError("Cannot create links if back and forward are both False.")
     links = Links()
+    resolution = experiment.images.resolution()
 
+    time_point_pairs = []
     time_point_previous = None
     for time_point_current in experiment.time_points():
-
         if time_point_previous is not None:
-            if back:
-                _add_nearest_edges(links, experiment.positions, experiment.images,
-                                   time_point_previous, time_point_current, tolerance)
-            if forward:
-                _add_nearest_edges_extra(links, experiment.positions, experiment.images,
-                                         time_point_previous, time_point_current, tolerance)
-
-        if time_point_current.time_point_number() % 50 == 0:
-            print("    completed up to time point", time_point_current.time_point_number())
+            time_point_pairs.append((time_point_previous, time_point_current))
         time_point_previous = time_point_current
 
+    tasks = (_TimePointPair(experiment, time_point_previous, time_point_current)
+             for time_point_previous, time_point_current in time_point_pairs)
+    pool = create_process_pool(worker_count)
+    try:
+        if pool is None:
+            edges_of_pairs = (_find_edges_of_time_point_pair(task, resolution, tolerance, back, forward)
+                              for task in tasks)
+        else:
+            edges_of_pairs = pool.imap(_FindEdgesOfTimePointPair(resolution, tolerance, back, forward), tasks,
+                                       chunksize=4)
+
+        # Add all edges in the same order as when using a single process, so that the result is identical
+        for (time_point_previous, time_point_current), edges in zip(time_point_pairs, edges_of_pairs):
+            for position1, position2 in edges:
+                links.add_link(position1, position2)
+
+            if time_point_current.time_point_number() % 50 == 0:
+                print("    completed up to time point", time_point_current.time_point_number())
+    finally:
+        if pool is not None:
+            pool.terminate()
+
     print("Done creating nearest-neighbor links!")
     return links
 
 
-def _add_nearest_edges(links: Links, positions: PositionCollection, images: Images, time_point_previous: TimePoint,
-                       time_point_current: TimePoint, tolerance: float):
-    """Adds edges pointing towards previous time point, making the shortest one the preferred."""
-    resolution = images.resolution()
-    for position in positions.of_time_point(time_point_current):
-        # Check if position was inside the image in the previous time point
-        previous_position = position.with_time_point(time_point_previous)
-        if images.is_inside_image(previous_position) is False:
-            # ^ Using "is False" because the method can also return None
-            continue  # Skip, position will go out of view
-
-        # If yes, make links to previous time point
-        nearby_list = find_close_positions(positions.of_time_point(time_point_previous), around=position,
-                                           tolerance=tolerance, max_amount=5, resolution=resolution)
-        for nearby_position in nearby_list:
-            links.add_link(position, nearby_position)
-
-
-def _add_nearest_edges_extra(links: Links, positions: PositionCollection, images: Images, time_point_current: TimePoint, time_point_next: TimePoint, tolerance: float):
-    """Adds edges to the next time point, which is useful if _add_edges missed some possible links."""
-    resolution = images.resolution()
-    for position in positions.of_time_point(time_point_current):
-        # Check if position is still inside the image in the next time point
-        next_position = position.with_time_point(time_point_next)
-        if images.is_inside_image(next_position) is False:
-            # ^ Using "is False" because the method can also return None
-            continue  # Skip, position will go out of view
-
-        # If yes, make links to next time point
-        nearby_list = find_close_positions(positions.of_time_point(time_point_next), around=position,
-                                           tolerance=tolerance, max_amount=5, resolution=resolution)
+class _FindEdgesOfTimePointPair:
+    """Picklable version of _find_edges_of_time_point_pair with the settings filled in."""
+
+    def __init__(self, resolution: ImageResolution, tolerance: float, back: bool, forward: bool):
+        self._resolution = resolution
+        self._tolerance = tolerance
+        self._back = back
+        self._forward = forward
+
+    def __call__(self, time_point_pair: _TimePointPair) -> List[Tuple[Position, Position]]:
+        return _find_edges_of_time_point_pair(time_point_pair, self._resolution, self._tolerance, self._back,
+                                              self._forward)
+
+
+def _find_edges_of_time_point_pair(time_point_pair: _TimePointPair, resolution: ImageResolution, tolerance: float,
+                                   back: bool, forward: bool) -> List[Tuple[Position, Position]]:
+    """Finds the backward edges (if back is True), followed by the forward edges (if forward is True)."""
+    edges = []
+    if back:
+        edges += _find_nearest_edges(time_point_pair.positions_current, time_point_pair.positions_previous,
+                                     time_point_pair.current_inside_previous_image, resolution, tolerance)
+    if forward:
+        edges += _find_nearest_edges(time_point_pair.positions_previous, time_point_pair.positions_current,
+                                     time_point_pair.previous_inside_current_image, resolution, tolerance)
+    return edges
+
+
+def _find_nearest_edges(positions_from: List[Position], positions_to: List[Position],
+                        inside_image: Optional[ndarray], resolution: ImageResolution, tolerance: float
+                        ) -> List[Tuple[Position, Position]]:
+    """Finds edges from every position in positions_from to the nearest position(s) in positions_to. Positions that
+    would be outside the image in the time point of positions_to are skipped, as they will go out of view. The
+    inside_image array says for every position in positions_from whether that is the case; if it is None (because no
+    images are loaded), no positions are skipped."""
+    if inside_image is not None:
+        positions_from = [position for position, inside in zip(positions_from, inside_image) if inside]
+
+    nearby_lists = find_close_positions_batched(positions_to, around=positions_from, tolerance=tolerance, max_amount=5,
+                                                resolution=resolution)
+    edges = []
+    for position, nearby_list in zip(positions_from, nearby_lists):
         for nearby_position in nearby_list:
-            links.add_link(position, nearby_position)
+            edges.append((position, nearby_position))
+    return edges
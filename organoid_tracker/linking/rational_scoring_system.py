@@ -1,7 +1,11 @@
 """Designed scoring system for scoring putative mother cells."""
+from collections import OrderedDict
+from typing import Tuple, Optional
+
 import numpy
 from numpy import ndarray
 
+from organoid_tracker.core import TimePoint
 from organoid_tracker.core.images import Images, Image
 from organoid_tracker.core.mask import create_mask_for, Mask, OutsideImageError
 from organoid_tracker.core.position import Position
@@ -12,46 +16,103 @@ from organoid_tracker.linking_analysis import linking_markers
 
 
 class RationalScoringSystem(MotherScoringSystem):
-    """Rationally-designed score system."""
+    """Rationally-designed score system.
+
+    The masks of the positions and the average intensities inside those masks are cached, so that a position that is
+    part of multiple families is only drawn once. The caches hold at most cache_size entries each; the least recently
+    used entries are removed first. So use a single instance for all families of a run."""
+
+    _masks: "OrderedDict[Position, Optional[Mask]]"
+    _average_intensities: "OrderedDict[Tuple[Position, int], Optional[float]]"
+    _cache_size: int
+
+    def __init__(self, *, cache_size: int = 5000):
+        self._masks = OrderedDict()
+        self._average_intensities = OrderedDict()
+        self._cache_size = cache_size
 
     def calculate(self, images: Images, position_data: PositionData, family: Family) -> Score:
         mother = family.mother
         daughter1, daughter2 = family.daughters
 
-        mother_image_stack = images.get_image(mother.time_point())
-        daughter_image_stack = images.get_image(daughter1.time_point())
+        mother_time_point = mother.time_point()
+        daughter_time_point = daughter1.time_point()
+        mother_image_stack = images.get_image(mother_time_point)
+        daughter_image_stack = images.get_image(daughter_time_point)
 
         try:
-            mother_mask = _get_mask(mother_image_stack, mother, position_data)
-            daughter1_mask = _get_mask(daughter_image_stack, daughter1, position_data)
-            daughter2_mask = _get_mask(daughter_image_stack, daughter2, position_data)
-
-            mother_intensities = _get_nucleus_image(mother_image_stack, mother_mask)
-            mother_intensities_next = _get_nucleus_image(daughter_image_stack, mother_mask)
-            daughter1_intensities = _get_nucleus_image(daughter_image_stack, daughter1_mask)
-            daughter2_intensities = _get_nucleus_image(daughter_image_stack, daughter2_mask)
-            daughter1_intensities_prev = _get_nucleus_image(mother_image_stack, daughter1_mask)
-            daughter2_intensities_prev = _get_nucleus_image(mother_image_stack, daughter2_mask)
+            mother_average = self._get_average_intensity(mother_image_stack, mother, mother_image_stack,
+                                                         mother_time_point, position_data)
+            mother_average_next = self._get_average_intensity(mother_image_stack, mother, daughter_image_stack,
+                                                              daughter_time_point, position_data)
+            daughter1_average = self._get_average_intensity(daughter_image_stack, daughter1, daughter_image_stack,
+                                                            daughter_time_point, position_data)
+            daughter2_average = self._get_average_intensity(daughter_image_stack, daughter2, daughter_image_stack,
+                                                            daughter_time_point, position_data)
+            daughter1_average_prev = self._get_average_intensity(daughter_image_stack, daughter1, mother_image_stack,
+                                                                 mother_time_point, position_data)
+            daughter2_average_prev = self._get_average_intensity(daughter_image_stack, daughter2, mother_image_stack,
+                                                                 mother_time_point, position_data)
 
             score = Score()
-            score_mother_intensities(score, mother, mother_intensities, mother_intensities_next)
-            score_daughter_intensities(score, daughter1_intensities, daughter2_intensities,
-                                       daughter1_intensities_prev, daughter2_intensities_prev)
+            score_mother_average_intensities(score, mother_average, mother_average_next)
+            score_daughter_average_intensities(score, daughter1_average, daughter2_average,
+                                               daughter1_average_prev, daughter2_average_prev)
             score_using_volumes(score, position_data, mother, daughter1, daughter2)
             return score
         except OutsideImageError:
             print("No score for " + str(mother) + ": outside image")
             return Score()
 
+    def _get_average_intensity(self, position_image_stack: Image, position: Position, image_stack: Image,
+                               time_point: TimePoint, position_data: PositionData) -> float:
+        """Gets the average normalized intensity inside the mask of the position, for the image stack of the given time
+        point. The mask itself is drawn using position_image_stack, the image stack of the time point of the position.
+        Raises OutsideImageError if the mask falls outside the image."""
+        key = (position, time_point.time_point_number())
+        if key in self._average_intensities:
+            self._average_intensities.move_to_end(key)
+            average = self._average_intensities[key]
+        else:
+            try:
+                mask = self._get_mask(position_image_stack, position, position_data)
+                average = numpy.nanmean(_get_nucleus_image(image_stack, mask))
+            except OutsideImageError:
+                average = None
+            _add_to_cache(self._average_intensities, key, average, self._cache_size)
+        if average is None:
+            raise OutsideImageError()
+        return average
+
+    def _get_mask(self, image_stack: Image, position: Position, position_data: PositionData) -> Mask:
+        """Gets the mask of the position, drawn for the image stack of the time point of the position."""
+        mask = self._masks.get(position)
+        if mask is None:
+            mask = _get_mask(image_stack, position, position_data)
+            _add_to_cache(self._masks, position, mask, self._cache_size)
+        else:
+            self._masks.move_to_end(position)
+        return mask
+
+
+def _add_to_cache(cache: OrderedDict, key, value, max_size: int):
+    """Adds a value to the cache. If the cache becomes too large, the least recently used values are removed."""
+    cache[key] = value
+    while len(cache) > max_size:
+        cache.popitem(last=False)
+
 
 def score_daughter_intensities(score: Score, daughter1_intensities: ndarray, daughter2_intensities: ndarray,
                                daughter1_intensities_prev: ndarray, daughter2_intensities_prev: ndarray):
     """Daughter cells must have almost the same intensity"""
-    daughter1_average = numpy.nanmean(daughter1_intensities)
-    daughter2_average = numpy.nanmean(daughter2_intensities)
-    daughter1_average_prev = numpy.nanmean(daughter1_intensities_prev)
-    daughter2_average_prev = numpy.nanmean(daughter2_intensities_prev)
+    score_daughter_average_intensities(score, numpy.nanmean(daughter1_intensities), numpy.nanmean(daughter2_intensities),
+                                       numpy.nanmean(daughter1_intensities_prev),
+                                       numpy.nanmean(daughter2_intensities_prev))
 
+
+def score_daughter_average_intensities(score: Score, daughter1_average: float, daughter2_average: float,
+                                       daughter1_average_prev: float, daughter2_average_prev: float):
+    """Like score_daughter_intensities, but using the already calculated averages of the (normalized) intensities."""
     # Daughter cells must have almost the same intensity
     score.daughters_intensity_difference = -abs(daughter1_average - daughter2_average) / 2
     score.daughters_intensity_delta = 1
@@ -67,15 +128,16 @@ def score_daughter_intensities(score: Score, daughter1_intensities: ndarray, dau
 
 def score_mother_intensities(score: Score, mother: Position, mother_intensities: ndarray, mother_intensities_next: ndarray):
     """Mother cell must have high intensity """
+    score_mother_average_intensities(score, numpy.nanmean(mother_intensities), numpy.nanmean(mother_intensities_next))
+
 
-    # Intensity and contrast
-    mean_value = numpy.nanmean(mother_intensities)
+def score_mother_average_intensities(score: Score, mean_value: float, mean_value_next: float):
+    """Like score_mother_intensities, but using the already calculated averages of the (normalized) intensities."""
     if numpy.isnan(mean_value):
         score.mother_intensity_delta = 0
         return
 
     # Change of intensity (we use the max, as mothers often have both bright spots and darker spots near their center)
-    mean_value_next = numpy.nanmean(mother_intensities_next)
     if mean_value / (mean_value_next + 0.0001) > 2:  # +0.0001 protects against division by zero
         score.mother_intensity_delta = 1
     elif mean_value / (mean_value_next + 0.0001) > 1.4:
@@ -1,4 +1,5 @@
-from typing import Optional, Iterable, Callable
+from typing import Optional, Iterable, Callable, Set
+from weakref import WeakKeyDictionary
 
 import numpy
 
@@ -7,28 +8,44 @@ from organoid_tracker.core.experiment import Experiment
 from organoid_tracker.core.links import Links
 from organoid_tracker.core.position_collection import PositionCollection
 from organoid_tracker.core.position import Position
+from organoid_tracker.core.position_change_tracker import PositionChangeTracker
 from organoid_tracker.core.position_data import PositionData
 from organoid_tracker.core.resolution import ImageResolution
 from organoid_tracker.core.score import Score, ScoreCollection, Family
 from organoid_tracker.linking import cell_division_finder
-from organoid_tracker.linking_analysis import linking_markers, particle_age_finder
+from organoid_tracker.linking_analysis import linking_markers, particle_age_finder, vectorized_cell_error_finder
 from organoid_tracker.linking_analysis.errors import Error
 from organoid_tracker.linking_analysis.linking_markers import EndMarker
 
 
-def find_errors_in_experiment(experiment: Experiment) -> int:
+def find_errors_in_experiment(experiment: Experiment, *, vectorized: bool = False) -> int:
     """Adds errors for all logical inconsistencies in the graph, like cells that spawn out of nowhere, cells that
     merge together and cells that have three or more daughters. Returns the amount of errors, exluding errors for
-     positions without links."""
+     positions without links.
+
+    If vectorized is True, the errors of all positions are found at once using the vectorized_cell_error_finder module.
+    The result is the same, but that is much faster for large experiments."""
     position_data = experiment.position_data
     links = experiment.links
 
+    if vectorized:
+        errors = vectorized_cell_error_finder.get_errors(experiment)
+    else:
+        errors = ((position, get_error(experiment, position)) for position in experiment.positions)
+
     count = 0
-    for position in experiment.positions:
-        error = get_error(experiment, position)
-        linking_markers.set_error_marker(position_data, position, error)
-        if error is not None and links.contains_position(position):
-            count += 1
+    tracking_state = _tracking_states.get(experiment)
+    if tracking_state is not None:
+        tracking_state.change_tracker.pause()  # Error markers are not used to find errors, so don't record them
+    try:
+        for position, error in errors:
+            linking_markers.set_error_marker(position_data, position, error)
+            if error is not None and links.contains_position(position):
+                count += 1
+    finally:
+        if tracking_state is not None:
+            tracking_state.change_tracker.resume()
+            tracking_state.reset(experiment)  # All positions have been checked, so start tracking from scratch
     return count
 
 
@@ -167,11 +184,17 @@ def find_errors_in_all_dividing_cells(experiment: Experiment):
 def _find_errors_in_just_the_iterable(experiment: Experiment, iterable: Iterable[Position]):
     """Checks all positions in the given iterable for logical errors, like cell merges, cell dividing into three
     daughters, cells moving too fast, ect."""
-    links = experiment.links
     position_data = experiment.position_data
-    for position in iterable:
-        error = get_error(experiment, position)
-        linking_markers.set_error_marker(position_data, position, error)
+    tracking_state = _tracking_states.get(experiment)
+    if tracking_state is not None:
+        tracking_state.change_tracker.pause()  # Error markers are not used to find errors, so don't record them
+    try:
+        for position in iterable:
+            error = get_error(experiment, position)
+            linking_markers.set_error_marker(position_data, position, error)
+    finally:
+        if tracking_state is not None:
+            tracking_state.change_tracker.resume()
 
 
 def find_errors_in_just_these_positions(experiment: Experiment, *iterable: Position):
@@ -179,3 +202,151 @@ def find_errors_in_just_these_positions(experiment: Experiment, *iterable: Posit
     daughters, cells moving too fast, ect."""
     _find_errors_in_just_the_iterable(experiment, iterable)
 
+
+
+class _ErrorTrackingState:
+    """Records the changes made to an experiment since the errors were last checked."""
+
+    change_tracker: PositionChangeTracker
+
+    # The objects that the change tracker is registered to
+    positions: PositionCollection
+    links: Links
+    position_data: PositionData
+
+    # Changing these affects the errors of many positions
+    first_time_point_number: Optional[int]
+    last_time_point_number: Optional[int]
+    has_links: bool
+
+    def __init__(self, experiment: Experiment):
+        self.change_tracker = PositionChangeTracker()
+        self.positions = experiment.positions
+        self.links = experiment.links
+        self.position_data = experiment.position_data
+        self.reset(experiment)
+
+    def reset(self, experiment: Experiment):
+        """Forgets all recorded changes, and starts recording the changes of the given experiment."""
+        self.detach()
+        self.change_tracker.pop_changed_positions()
+        self.positions = experiment.positions
+        self.links = experiment.links
+        self.position_data = experiment.position_data
+        self.first_time_point_number = self.positions.first_time_point_number()
+        self.last_time_point_number = self.positions.last_time_point_number()
+        self.has_links = self.links.has_links()
+        for collection in [self.positions, self.links, self.position_data]:
+            collection.set_change_tracker(self.change_tracker)
+
+    def detach(self):
+        """Stops recording changes."""
+        for collection in [self.positions, self.links, self.position_data]:
+            collection.set_change_tracker(None)
+
+    def pop_changed_positions(self, experiment: Experiment) -> Set[Position]:
+        """Returns all positions that were changed since the last call, and starts recording again. Replaced
+        collections and a changed time span of the experiment are taken into account."""
+        changed_positions = self.change_tracker.pop_changed_positions()
+
+        if experiment.positions is not self.positions or experiment.position_data is not self.position_data:
+            changed_positions |= set(experiment.positions)  # Everything could have been changed
+        elif experiment.links is not self.links:
+            # Only the links were replaced, for example because the user relinked a region
+            old_links = set(self.links.find_all_links())
+            new_links = set(experiment.links.find_all_links())
+            for position1, position2 in old_links ^ new_links:
+                changed_positions.add(position1)
+                changed_positions.add(position2)
+
+        if experiment.links.has_links() != self.has_links:
+            changed_positions |= set(experiment.positions)  # Without links, only few errors are checked
+        else:
+            # Positions in the first and last time point don't get warnings for missing links, so if those time points
+            # change, positions get or lose their warnings
+            changed_positions |= _find_positions_in_time_span(experiment.positions, self.first_time_point_number,
+                                                              experiment.positions.first_time_point_number())
+            changed_positions |= _find_positions_in_time_span(experiment.positions, self.last_time_point_number,
+                                                              experiment.positions.last_time_point_number())
+
+        self.reset(experiment)
+        return changed_positions
+
+
+# Experiments of which changes are recorded. These are weak references, so that the experiments can still be removed
+# from memory.
+_tracking_states = WeakKeyDictionary()
+
+
+def _find_positions_in_time_span(positions: PositionCollection, time_point_number_1: Optional[int],
+                                 time_point_number_2: Optional[int]) -> Set[Position]:
+    """Finds all positions from time_point_number_1 to time_point_number_2 (inclusive), or the other way round. If both
+    time points are equal or one is None, no positions are returned."""
+    if time_point_number_1 is None or time_point_number_2 is None or time_point_number_1 == time_point_number_2:
+        return set()
+    found_positions = set()
+    for time_point_number in range(min(time_point_number_1, time_point_number_2),
+                                   max(time_point_number_1, time_point_number_2) + 1):
+        found_positions |= positions.of_time_point(TimePoint(time_point_number))
+    return found_positions
+
+
+def _find_affected_positions(experiment: Experiment, changed_positions: Iterable[Position]) -> Set[Position]:
+    """Finds all positions of which the error may have changed because of changes to the given positions. These are the
+    positions themselves, their direct neighbors, the positions that use their volume to check for shrinking cells and
+    the next mother cell, of which the age may have changed."""
+    links = experiment.links
+    positions = experiment.positions
+    affected_positions = set()
+    walked_positions = set()
+    for position in changed_positions:
+        if not positions.contains_position(position):
+            continue  # Position was removed, but its neighbors were marked as changed too
+        affected_positions.add(position)
+        affected_positions |= links.find_links_of(position)
+
+        # The volumes of up to five positions in the past and future are used to check for shrinking cells
+        _add_nearby_in_time(affected_positions, position, links.find_pasts, 5)
+        _add_nearby_in_time(affected_positions, position, links.find_futures, 5)
+
+        # The age of the next mother cell depends on where its track starts, which can be at or after this position
+        for walk_position in [position, *links.find_futures(position)]:
+            while walk_position not in walked_positions:
+                walked_positions.add(walk_position)
+                future_positions = links.find_futures(walk_position)
+                if len(future_positions) != 1:
+                    affected_positions.add(walk_position)  # Found the mother cell, or the end of the track
+                    break
+                walk_position = future_positions.pop()
+
+    return {position for position in affected_positions if positions.contains_position(position)}
+
+
+def _add_nearby_in_time(found_positions: Set[Position], position: Position,
+                        next_positions_getter: Callable[[Position], Set[Position]], max_steps: int):
+    """Adds all positions that can be reached in at most max_steps steps using the given getter."""
+    current_positions = {position}
+    for _ in range(max_steps):
+        next_positions = set()
+        for current_position in current_positions:
+            next_positions |= next_positions_getter(current_position)
+        found_positions |= next_positions
+        current_positions = next_positions
+
+
+def find_errors_in_changed_positions(experiment: Experiment, *also_check: Position):
+    """Checks all positions that were changed since the last call to this method for logical errors, along with all
+    positions of which the errors may depend on the changed positions. So this method updates the errors after any edit,
+    without rechecking the whole experiment.
+
+    The first call for an experiment starts the recording of changes to its positions, links and position data. Changes
+    made before that call are unknown, so pass the positions you just changed as also_check. Changes to the scores, the
+    warning limits or the resolution are not recorded: call find_errors_in_experiment after changing those."""
+    tracking_state = _tracking_states.get(experiment)
+    if tracking_state is None:
+        tracking_state = _ErrorTrackingState(experiment)
+        _tracking_states[experiment] = tracking_state
+    changed_positions = tracking_state.pop_changed_positions(experiment)
+    changed_positions.update(also_check)
+
+    _find_errors_in_just_the_iterable(experiment, _find_affected_positions(experiment, changed_positions))
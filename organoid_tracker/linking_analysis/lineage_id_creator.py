@@ -4,13 +4,13 @@ This makes it easier to color the cells using a color map.
 Note: the color depends on the id. The id depends on the sort order of the lineages. Call the sorting method on the
 links object beforehand to make the id better-defined."""
 import random
-from typing import Tuple
 
 import matplotlib.cm, matplotlib.colors
 
 from organoid_tracker.core import Color
-from organoid_tracker.core.links import Links, LinkingTrack
+from organoid_tracker.core.links import Links
 from organoid_tracker.core.position import Position
+from organoid_tracker.linking_analysis import lineage_index
 
 # Used for pseudo-randomization of the colors
 _RANDOM = random.Random()
@@ -22,16 +22,7 @@ def get_original_track_id(links: Links, position: Position) -> int:
     track = links.get_track(position)
     if track is None:
         return -1
-
-    # Find original track
-    previous_tracks = track.get_previous_tracks()
-    while len(previous_tracks) == 1:
-        track = previous_tracks.pop()
-        previous_tracks = track.get_previous_tracks()
-
-    track_id = links.get_track_id(track)
-
-    return track_id
+    return lineage_index.get_lineage_index(links).get_original_track_id(track)
 
 
 def generate_color_for_lineage_id(track_id: int) -> Color:
@@ -55,20 +46,4 @@ def get_lineage_id(links: Links, position: Position) -> int:
     track = links.get_track(position)
     if track is None:
         return -1
-
-    in_a_tree = len(track.get_next_tracks()) > 1  # If there is a division after this, there is a lineage tree
-
-    previous_tracks = track.get_previous_tracks()
-    while len(previous_tracks) == 1:
-        in_a_tree = True  # Found a previous track, so definitely a lineage tree
-        track = previous_tracks.pop()
-        previous_tracks = track.get_previous_tracks()
-    # track is now the root of the lineage id
-
-    if not in_a_tree:
-        return -1
-
-    track_id = links.get_track_id(track)
-
-    # Randomize last three digits
-    return track_id
+    return lineage_index.get_lineage_index(links).get_lineage_id(track)
@@ -0,0 +1,95 @@
+"""Index with the lineage information of every track: its track id, the root track of its lineage, its depth and
+division generation within the lineage, and the lineage id. Finding these by walking through the linking network is
+slow if you need them for many positions, for example when coloring all positions by lineage. This index calculates
+everything in one go, and then answers every question in constant time.
+
+Use get_lineage_index(links) to get the index. It's reused as long as the links remain unchanged, and recalculated
+the next time it's requested after the links have been changed."""
+from typing import Dict, Tuple, Optional, List
+from weakref import WeakKeyDictionary
+
+from organoid_tracker.core.links import Links, LinkingTrack
+
+
+class LineageIndex:
+    """Lineage information of all tracks in the links, at the moment the index was created. The root of a track is
+    found by going back in time until the track has no previous track, or until there's a cell merge. The depth is the
+    number of tracks that were passed to get there, the division generation is the number of cell divisions that were
+    passed."""
+
+    version: int  # Version of the links this index was created from, see Links.get_version
+
+    # Track id, root track id, depth and division generation, indexed by the id() of the track
+    _track_info: Dict[int, Tuple[int, int, int, int]]
+
+    def __init__(self, links: Links):
+        self.version = links.get_version()
+        track_ids = {id(track): track_id for track_id, track in links.find_all_tracks_and_ids()}
+        track_info = dict()
+
+        # Walk from every root track through all tracks that follow it
+        for root_track in links.find_all_tracks():
+            if len(root_track.get_previous_tracks()) == 1:
+                continue  # Not a root track, will be reached from its root track
+            root_track_id = track_ids[id(root_track)]
+            to_visit: List[Tuple[LinkingTrack, int, int]] = [(root_track, 0, 0)]
+            while len(to_visit) > 0:
+                track, depth, generation = to_visit.pop()
+                track_info[id(track)] = (track_ids[id(track)], root_track_id, depth, generation)
+
+                next_tracks = track.get_next_tracks()
+                next_generation = generation + 1 if len(next_tracks) > 1 else generation
+                for next_track in next_tracks:
+                    if len(next_track.get_previous_tracks()) == 1:  # Otherwise, next_track is a root track itself
+                        to_visit.append((next_track, depth + 1, next_generation))
+
+        self._track_info = track_info
+
+    def _get_track_info(self, track: LinkingTrack) -> Tuple[int, int, int, int]:
+        track_info = self._track_info.get(id(track))
+        if track_info is None:
+            raise ValueError(f"{track} is not part of the links")
+        return track_info
+
+    def get_track_id(self, track: LinkingTrack) -> Optional[int]:
+        """Gets the same track id as Links.get_track_id, but in constant time. Returns None if the track is not stored
+        in the links."""
+        track_info = self._track_info.get(id(track))
+        if track_info is None:
+            return None
+        return track_info[0]
+
+    def get_original_track_id(self, track: LinkingTrack) -> int:
+        """Gets the track id of the root track of the lineage. Going back in time stops at cell merges, so then the id
+        of the track directly after the merge is returned."""
+        return self._get_track_info(track)[1]
+
+    def get_lineage_id(self, track: LinkingTrack) -> int:
+        """Gets the track id of the root track, but only if the track is part of a lineage tree (so if the cell has
+        divided before, or will divide at the end of the track). Otherwise, -1 is returned."""
+        track_id, root_track_id, depth, generation = self._get_track_info(track)
+        if depth == 0 and len(track.get_next_tracks()) <= 1:
+            return -1  # Root track that doesn't divide, so not in a lineage tree
+        return root_track_id
+
+    def get_depth(self, track: LinkingTrack) -> int:
+        """Gets the number of tracks between the root track and this track. The root track itself has a depth of 0."""
+        return self._get_track_info(track)[2]
+
+    def get_division_generation(self, track: LinkingTrack) -> int:
+        """Gets the number of cell divisions between the start of the root track and this track."""
+        return self._get_track_info(track)[3]
+
+
+# Indices are kept as long as the Links object exists
+_indices = WeakKeyDictionary()
+
+
+def get_lineage_index(links: Links) -> LineageIndex:
+    """Gets the lineage index of the given links. The index is reused until the links are changed, after which it's
+    recalculated. So don't hold on to the returned index if the links can change, just call this method again."""
+    index = _indices.get(links)
+    if index is None or index.version != links.get_version():
+        index = LineageIndex(links)
+        _indices[links] = index
+    return index
@@ -1,6 +1,8 @@
+from typing import Set
+
 from organoid_tracker.core.experiment import Experiment
 
-from organoid_tracker.core.links import Links
+from organoid_tracker.core.links import Links, LinkingTrack
 from organoid_tracker.core.position import Position
 from organoid_tracker.core.position_data import PositionData
 from organoid_tracker.linking_analysis import linking_markers
@@ -14,46 +16,63 @@ def postprocess(experiment: Experiment, margin_xy: int):
 
 
 def _remove_positions_close_to_edge(experiment: Experiment, margin_xy: int):
-    image_loader = experiment.images
-    links = experiment.links
-    position_data = experiment.position_data
+    """Removes all positions that are within margin_xy pixels of the edge of the image, or outside the image. The
+    positions that were linked to removed positions receive a marker that they went out of view."""
+    images = experiment.images
+    to_remove = list()
     for time_point in experiment.time_points():
-        for position in list(experiment.positions.of_time_point(time_point)):
-            if not image_loader.is_inside_image(position, margin_xy=margin_xy):
-                # Remove cell, but inform neighbors first
-                _add_out_of_view_markers(links, position_data, position)
-                experiment.remove_position(position, update_splines=False)
+        positions = list(experiment.positions.of_time_point(time_point))
+        inside = images.are_inside_image(positions, time_point, margin_xy=margin_xy)
+        if inside is None:
+            continue  # No images, so nothing can be outside the images
+        to_remove += [position for position, is_inside in zip(positions, inside) if not is_inside]
+
+    # Inform the neighbors that are kept first, then remove everything at once
+    to_remove_set = set(to_remove)
+    for position in to_remove:
+        _add_out_of_view_markers(experiment.links, experiment.position_data, position, to_remove_set)
+    experiment.remove_positions(to_remove, update_splines=False)
 
 
 def _mark_positions_going_out_of_image(experiment: Experiment):
     """Adds "going into view" and "going out of view" markers to all positions that fall outside the next or previous
     image, in case the camera was moved."""
+    images = experiment.images
     for time_point in experiment.time_points():
         try:
             time_point_previous = experiment.get_previous_time_point(time_point)
         except ValueError:
             continue  # This is the first time point
 
-        offset = experiment.images.offsets.of_time_point(time_point)
-        offset_previous = experiment.images.offsets.of_time_point(time_point_previous)
+        offset = images.offsets.of_time_point(time_point)
+        offset_previous = images.offsets.of_time_point(time_point_previous)
         if offset == offset_previous:
             continue  # Image didn't move, so no positions can go out of the view
 
-        for position in experiment.positions.of_time_point(time_point_previous):
-            # Check for positions in the previous image that fall outside the current image
-            if not experiment.images.is_inside_image(position.with_time_point(time_point)):
+        # Check for positions in the previous image that fall outside the current image
+        positions_previous = list(experiment.positions.of_time_point(time_point_previous))
+        inside = images.are_inside_image(positions_previous, time_point)
+        if inside is None:
+            continue  # No images loaded
+        for position, is_inside in zip(positions_previous, inside):
+            if not is_inside:
                 linking_markers.set_track_end_marker(experiment.position_data, position, EndMarker.OUT_OF_VIEW)
 
-        for position in experiment.positions.of_time_point(time_point):
-            # Check for positions in the current image that fall outside the previous image
-            if not experiment.images.is_inside_image(position.with_time_point(time_point_previous)):
+        # Check for positions in the current image that fall outside the previous image
+        positions = list(experiment.positions.of_time_point(time_point))
+        inside = images.are_inside_image(positions, time_point_previous)
+        for position, is_inside in zip(positions, inside):
+            if not is_inside:
                 linking_markers.set_track_start_marker(experiment.position_data, position, StartMarker.GOES_INTO_VIEW)
 
 
-def _add_out_of_view_markers(links: Links, position_data: PositionData, position: Position):
-    """Adds markers to the remaining links so that it is clear why they appeared/disappeared."""
+def _add_out_of_view_markers(links: Links, position_data: PositionData, position: Position, removed: Set[Position]):
+    """Adds markers to the remaining links so that it is clear why they appeared/disappeared. Linked positions that
+    are removed too don't receive a marker."""
     linked_positions = links.find_links_of(position)
     for linked_position in linked_positions:
+        if linked_position in removed:
+            continue
         if linked_position.time_point_number() < position.time_point_number():
             linking_markers.set_track_end_marker(position_data, linked_position, EndMarker.OUT_OF_VIEW)
         else:
@@ -62,30 +81,32 @@ def _add_out_of_view_markers(links: Links, position_data: PositionData, position
 
 def _remove_spurs(experiment: Experiment):
     """Removes all very short tracks that end in a cell death."""
-    links = experiment.links
-    for position in list(links.find_appeared_positions()):
-        _check_for_and_remove_spur(experiment, links, position)
-
-
-def _check_for_and_remove_spur(experiment: Experiment, links: Links, position: Position):
-    track_length = 0
-    positions_in_track = [position]
-
-    while True:
-        next_positions = links.find_futures(position)
-        if len(next_positions) == 0:
-            # End of track
-            if track_length < 3:
-                # Remove this track, it is too short
-                for position_in_track in positions_in_track:
-                    experiment.remove_position(position_in_track, update_splines=False)
-            return
-        if len(next_positions) > 1:
+    to_remove = set()
+    for track in experiment.links.find_starting_tracks():
+        _find_spurs(track, to_remove)
+    experiment.remove_positions(to_remove, update_splines=False)
+
+
+def _find_spurs(starting_track: LinkingTrack, spur_positions: Set[Position]):
+    """Finds all spurs in the lineage tree of the given track, and adds their positions to spur_positions. A spur is a
+    piece of track, starting at the start of the lineage or directly after a cell division, that ends within three
+    positions."""
+    branch_starts = [starting_track]
+    while len(branch_starts) > 0:
+        track = branch_starts.pop()
+        tracks_in_branch = [track]
+        next_tracks = track.get_next_tracks()
+        while len(next_tracks) == 1:
+            track = next_tracks.pop()
+            tracks_in_branch.append(track)
+            next_tracks = track.get_next_tracks()
+
+        if len(next_tracks) == 0:
+            # End of the branch
+            if sum(len(track_in_branch) for track_in_branch in tracks_in_branch) <= 3:
+                # Remove this branch, it is too short
+                for track_in_branch in tracks_in_branch:
+                    spur_positions.update(track_in_branch.positions())
+        else:
             # Cell division
-            for next_position in next_positions:
-                _check_for_and_remove_spur(experiment, links, next_position)
-            return
-
-        position = next_positions.pop()
-        positions_in_track.append(position)
-        track_length += 1
+            branch_starts += next_tracks
@@ -0,0 +1,265 @@
+"""Alternative to calling cell_error_finder.get_error for every position. Instead of looking up the links, shapes and
+markers of every position separately, these are first collected in arrays for the whole experiment. Then the rules of
+get_error are applied to those arrays. The result is exactly the same, but it is much faster for large experiments."""
+from typing import Dict, Optional, List, Tuple
+
+import numpy
+from numpy import ndarray
+
+from organoid_tracker.core.experiment import Experiment
+from organoid_tracker.core.position import Position
+from organoid_tracker.core.position_data import PositionData
+from organoid_tracker.core.score import Family
+from organoid_tracker.linking_analysis import particle_age_finder, linking_markers
+from organoid_tracker.linking_analysis.errors import Error
+from organoid_tracker.linking_analysis.linking_markers import EndMarker
+
+# Error codes start at 1, so 0 can be used for positions without errors
+_NO_ERROR = 0
+
+_NOT_LIVE_END_MARKERS = {EndMarker.DEAD.name.lower(), EndMarker.SHED.name.lower(), EndMarker.SHED_OUTSIDE.name.lower()}
+
+
+class _ErrorArray:
+    """Stores the error of every position. Just like get_error returns the first error it finds, only the first error
+    that is set for a position is kept."""
+
+    error_codes: ndarray
+    decided: ndarray
+
+    def __init__(self, count: int):
+        self.error_codes = numpy.full(count, _NO_ERROR, dtype=numpy.int32)
+        self.decided = numpy.zeros(count, dtype=bool)
+
+    def set(self, mask: ndarray, error: Optional[Error]):
+        """Sets the error for all positions in the mask, unless they already had an error (or no error) set. Use None
+        for positions that are known to have no error."""
+        mask = mask & ~self.decided
+        self.error_codes[mask] = error.value if error is not None else _NO_ERROR
+        self.decided |= mask
+
+    def undecided(self) -> ndarray:
+        return ~self.decided
+
+
+class _PositionIndices:
+    """Finds the index of a position in a list. A dictionary of positions is slow for large experiments, as
+    Position.__hash__ only uses the x coordinate and the time point. So the exact coordinates are used as the key
+    instead. Positions that are only approximately equal (see Position.__eq__) are found by comparing them to the
+    positions with the same rounded x coordinate and time point."""
+
+    positions: List[Position]
+    _exact_indices: Dict[Tuple[float, float, float, int], int]
+    _approximate_indices: Optional[Dict[Tuple[int, int], List[int]]] = None
+
+    def __init__(self, positions: List[Position]):
+        self.positions = positions
+        self._exact_indices = {(position.x, position.y, position.z, position.time_point_number()): index
+                               for index, position in enumerate(positions)}
+
+    def get(self, position: Position) -> Optional[int]:
+        """Gets the index of the position, or None if it is not in the list."""
+        index = self._exact_indices.get((position.x, position.y, position.z, position.time_point_number()))
+        if index is not None:
+            return index
+
+        if self._approximate_indices is None:
+            self._approximate_indices = dict()
+            for index, other_position in enumerate(self.positions):
+                key = (int(other_position.x), other_position.time_point_number())
+                self._approximate_indices.setdefault(key, []).append(index)
+        for index in self._approximate_indices.get((int(position.x), position.time_point_number()), []):
+            if self.positions[index] == position:
+                return index
+        return None
+
+    def get_or_add(self, position: Position) -> int:
+        """Gets the index of the position. If it is not in the list yet, it is added to the end."""
+        index = self.get(position)
+        if index is None:
+            index = len(self.positions)
+            self.positions.append(position)
+            self._exact_indices[(position.x, position.y, position.z, position.time_point_number())] = index
+            if self._approximate_indices is not None:
+                self._approximate_indices.setdefault((int(position.x), position.time_point_number()), []).append(index)
+        return index
+
+
+def _get_data_mask(position_data: PositionData, data_name: str, indices: _PositionIndices, count: int) -> ndarray:
+    """Returns for every position whether it has the given data (with a truthy value)."""
+    mask = numpy.zeros(count, dtype=bool)
+    for position, value in position_data.find_all_positions_with_data(data_name):
+        index = indices.get(position)
+        if index is not None and index < count and value:
+            mask[index] = True
+    return mask
+
+
+def _get_mean_volumes(start_indices: ndarray, volumes: ndarray, next_indices: ndarray, max_amount: int) -> ndarray:
+    """Array version of cell_error_finder._get_volumes: gets the mean volume of up to max_amount positions, starting at
+    the given positions and following next_indices. Stops at the first unknown volume (NaN). Returns NaN where less than
+    two volumes are available."""
+    totals = numpy.zeros(len(start_indices), dtype=numpy.float64)
+    counts = numpy.zeros(len(start_indices), dtype=numpy.int32)
+    current_indices = start_indices.copy()
+    active = current_indices != -1
+    for _ in range(max_amount):
+        current_volumes = volumes[current_indices]
+        active &= ~numpy.isnan(current_volumes)
+        totals[active] += current_volumes[active]
+        counts[active] += 1
+        current_indices = numpy.where(active, next_indices[current_indices], -1)
+        active &= current_indices != -1
+
+    means = numpy.full(len(start_indices), numpy.nan, dtype=numpy.float64)
+    enough_volumes = counts >= 2
+    means[enough_volumes] = totals[enough_volumes] / counts[enough_volumes]
+    return means
+
+
+def get_errors(experiment: Experiment) -> List[Tuple[Position, Optional[Error]]]:
+    """Gets the errors of all positions in the experiment, in the same way as cell_error_finder.get_error does. Returns
+    a list of (position, error) in the same order as experiment.positions."""
+    links = experiment.links
+    position_data = experiment.position_data
+    resolution = experiment.images.resolution()
+    warning_limits = experiment.warning_limits
+
+    positions: List[Position] = list(experiment.positions)
+    position_count = len(positions)
+    indices = _PositionIndices(list(positions))
+    errors = _ErrorArray(position_count)
+
+    errors.set(_get_data_mask(position_data, "uncertain", indices, position_count), Error.UNCERTAIN_POSITION)
+    if not links.has_links() or position_count == 0:
+        return _to_list(positions, errors)  # Don't attempt to find other errors
+
+    # Collect all links as arrays of indices. Linked positions that are not in experiment.positions are added to the
+    # end of the list, so that they can still be looked up
+    earlier_indices = list()
+    later_indices = list()
+    for position1, position2 in links.find_all_links():
+        earlier_indices.append(indices.get_or_add(position1))
+        later_indices.append(indices.get_or_add(position2))
+    all_positions = indices.positions
+    total_count = len(all_positions)
+    earlier_indices = numpy.array(earlier_indices, dtype=numpy.int64)
+    later_indices = numpy.array(later_indices, dtype=numpy.int64)
+    future_counts_all = numpy.bincount(earlier_indices, minlength=total_count)
+    past_counts_all = numpy.bincount(later_indices, minlength=total_count)
+    future_counts = future_counts_all[:position_count]
+    past_counts = past_counts_all[:position_count]
+
+    # For following a track: the single position linked to the future/past, or -1 if there are zero or multiple
+    single_futures = numpy.full(total_count, -1, dtype=numpy.int64)
+    has_single_future = future_counts_all[earlier_indices] == 1
+    single_futures[earlier_indices[has_single_future]] = later_indices[has_single_future]
+    single_pasts = numpy.full(total_count, -1, dtype=numpy.int64)
+    has_single_past = past_counts_all[later_indices] == 1
+    single_pasts[later_indices[has_single_past]] = earlier_indices[has_single_past]
+
+    time_point_numbers = numpy.array([position.time_point_number() for position in positions], dtype=numpy.int64)
+    has_end_marker = _get_data_mask(position_data, "ending", indices, position_count)
+    has_start_marker = _get_data_mask(position_data, "starting", indices, position_count)
+
+    # Checks on the future
+    errors.set(future_counts > 2, Error.TOO_MANY_DAUGHTER_CELLS)
+    errors.set((future_counts == 0) & (time_point_numbers < experiment.positions.last_time_point_number())
+               & ~has_end_marker, Error.NO_FUTURE_POSITION)
+    _check_mothers(experiment, positions, errors, numpy.flatnonzero((future_counts == 2) & errors.undecided()))
+
+    # Checks on the past
+    no_past = past_counts == 0
+    errors.set(no_past & (time_point_numbers > experiment.positions.first_time_point_number()) & ~has_start_marker,
+               Error.NO_PAST_POSITION)
+    errors.set(no_past, None)
+    errors.set(past_counts >= 2, Error.CELL_MERGE)
+
+    # Now only positions with a single link to the past are left
+    remaining_indices = numpy.flatnonzero(errors.undecided())
+    if len(remaining_indices) == 0:
+        return _to_list(positions, errors)
+    past_indices = single_pasts[remaining_indices]
+
+    # Check the shapes
+    volumes = numpy.full(total_count, numpy.nan, dtype=numpy.float64)  # NaN for unknown shapes
+    failed_shapes = numpy.zeros(total_count, dtype=bool)
+    for position, shape in position_data.find_all_positions_with_data("shape"):
+        index = indices.get(position)
+        if index is None:
+            continue
+        failed_shapes[index] = shape.is_failed()
+        if not shape.is_unknown():
+            volumes[index] = shape.volume()
+    failed_shape = numpy.zeros(position_count, dtype=bool)
+    failed_shape[remaining_indices] = failed_shapes[remaining_indices] & (future_counts[remaining_indices] != 2)
+    errors.set(failed_shape, Error.FAILED_SHAPE)
+
+    shrink_candidates = ~numpy.isnan(volumes[remaining_indices]) & (future_counts_all[past_indices] == 1) \
+        & ~numpy.isnan(volumes[past_indices])
+    shrink_candidates[shrink_candidates] = volumes[past_indices[shrink_candidates]] \
+        / (volumes[remaining_indices[shrink_candidates]] + 0.0001) > 2
+    shrink_indices = remaining_indices[shrink_candidates]
+    if len(shrink_indices) > 0:
+        # Found a sudden decrease in volume. Compare volumes of last 5 and next 5 positions
+        volume_last_five = _get_mean_volumes(single_pasts[shrink_indices], volumes, single_pasts, 5)
+        volume_next_five = _get_mean_volumes(shrink_indices, volumes, single_futures, 5)
+        with numpy.errstate(invalid="ignore"):  # NaN is used for missing values
+            shrunk = volume_last_five / (volume_next_five + 0.0001) > 2
+        shrunk_mask = numpy.zeros(position_count, dtype=bool)
+        shrunk_mask[shrink_indices[shrunk]] = True
+        errors.set(shrunk_mask, Error.SHRUNK_A_LOT)
+
+    # Check movement distance (fast movement is only allowed when a cell is launched into its death)
+    coords = numpy.array([(position.x, position.y, position.z) for position in all_positions], dtype=numpy.float64)
+    delta = coords[past_indices] - coords[remaining_indices]
+    dx = delta[:, 0] * resolution.pixel_size_zyx_um[2]
+    dy = delta[:, 1] * resolution.pixel_size_zyx_um[1]
+    dz = delta[:, 2] * resolution.pixel_size_zyx_um[0]
+    distance_moved_um_per_m = numpy.sqrt(dx ** 2 + dy ** 2 + dz ** 2) / resolution.time_point_interval_m
+    is_live = numpy.ones(position_count, dtype=bool)
+    for position, end_marker in position_data.find_all_positions_with_data("ending"):
+        index = indices.get(position)
+        if index is not None and index < position_count and end_marker in _NOT_LIVE_END_MARKERS:
+            is_live[index] = False
+    moved_too_fast = numpy.zeros(position_count, dtype=bool)
+    moved_too_fast[remaining_indices] = (distance_moved_um_per_m > warning_limits.max_distance_moved_um_per_min) \
+        & is_live[remaining_indices]
+    errors.set(moved_too_fast, Error.MOVED_TOO_FAST)
+
+    return _to_list(positions, errors)
+
+
+def _check_mothers(experiment: Experiment, positions: List[Position], errors: _ErrorArray, mother_indices: ndarray):
+    """Checks the mother score and the age of all putative mothers. There are few mothers compared to the number of
+    positions, so these are just checked one by one."""
+    links = experiment.links
+    position_data = experiment.position_data
+    scores = experiment.scores
+    time_point_interval_h = experiment.images.resolution().time_point_interval_h
+    min_time_between_divisions_h = experiment.warning_limits.min_time_between_divisions_h
+    use_family_scores = scores.has_family_scores()
+
+    low_mother_score = numpy.zeros(len(positions), dtype=bool)
+    young_mother = numpy.zeros(len(positions), dtype=bool)
+    for index in mother_indices:
+        position = positions[index]
+        if use_family_scores:
+            score = scores.of_family(Family(position, *links.find_futures(position)))
+            if score is None or score.is_unlikely_mother():
+                low_mother_score[index] = True
+                continue
+        else:
+            if linking_markers.get_mother_score(position_data, position) <= 0:
+                low_mother_score[index] = True
+                continue
+        age = particle_age_finder.get_age(links, position)
+        if age is not None and age * time_point_interval_h < min_time_between_divisions_h:
+            young_mother[index] = True
+    errors.set(low_mother_score, Error.LOW_MOTHER_SCORE)
+    errors.set(young_mother, Error.YOUNG_MOTHER)
+
+
+def _to_list(positions: List[Position], errors: _ErrorArray) -> List[Tuple[Position, Optional[Error]]]:
+    return [(position, Error(error_code) if error_code != _NO_ERROR else None)
+            for position, error_code in zip(positions, errors.error_codes.tolist())]
@@ -1,7 +1,5 @@
 """Starting point for the Gaussian detector: from simple cell positions to full cell shapes."""
-from typing import Callable
-
-import numpy
+from typing import Callable, Optional, Iterable
 
 from organoid_tracker.core import TimePoint
 from organoid_tracker.core.experiment import Experiment
@@ -11,21 +9,31 @@ from organoid_tracker.core.position_data import PositionData
 from organoid_tracker.core.shape import GaussianShape, FAILED_SHAPE
 from organoid_tracker.linking_analysis import linking_markers
 from organoid_tracker.util import bits
-from organoid_tracker.position_detection import thresholding, watershedding, gaussian_fit
+from organoid_tracker.position_detection import watershedding, gaussian_fit
 
 
 def perform_for_experiment(experiment: Experiment, *, threshold_block_size: int,
                            gaussian_fit_smooth_size: int, cluster_detection_erosion_rounds: int,
-                           call_after_time_point: Callable[[TimePoint], type(None)] = lambda time_point: ...):
-    for time_point in experiment.time_points():
+                           call_after_time_point: Callable[[TimePoint], type(None)] = lambda time_point: ...,
+                           multiscale: bool = False, time_points: Optional[Iterable[TimePoint]] = None,
+                           max_memory_mb: Optional[float] = None):
+    """Fits Gaussians to all positions in the experiment. If multiscale is True, each fit is first performed on an image
+    downsampled in xy, which is faster for large nuclei. If time_points is given, only those time points are processed,
+    which is useful to resume an interrupted run. If max_memory_mb is given, the thresholding and watershed steps are
+    done in tiles that fit in that amount of memory."""
+    if time_points is None:
+        time_points = experiment.time_points()
+    for time_point in time_points:
         _perform_for_time_point(experiment.images, experiment.positions, experiment.position_data, time_point,
-                                threshold_block_size, gaussian_fit_smooth_size, cluster_detection_erosion_rounds)
+                                threshold_block_size, gaussian_fit_smooth_size, cluster_detection_erosion_rounds,
+                                multiscale, max_memory_mb)
         call_after_time_point(time_point)
 
 
 def _perform_for_time_point(images: Images, positions: PositionCollection, position_data: PositionData,
                             time_point: TimePoint, threshold_block_size: int,
-                            gaussian_fit_smooth_size: int, cluster_detection_erosion_rounds: int):
+                            gaussian_fit_smooth_size: int, cluster_detection_erosion_rounds: int, multiscale: bool,
+                            max_memory_mb: Optional[float]):
     print("Working on time point " + str(time_point.time_point_number()) + "...")
     # Acquire images
     image_offset = images.offsets.of_time_point(time_point)
@@ -41,27 +49,20 @@ def _perform_for_time_point(images: Images, positions: PositionCollection, posit
     image_stack = images.get_image_stack(time_point)
     image_stack = bits.image_to_8bit(image_stack)
 
-    # Create a threshold
-    threshold = numpy.empty_like(image_stack, dtype=numpy.uint8)
-    thresholding.advanced_threshold(image_stack, threshold, threshold_block_size)
-
-    # Labelling, calculate distance to label
+    # Threshold the image and perform a watershed from the positions
     resolution = images.resolution()
-    label_image = numpy.empty_like(image_stack, dtype=numpy.uint16)
-    watershedding.create_labels(image_positions, label_image)
-    distance_transform_to_labels = watershedding.distance_transform_to_labels(label_image, resolution.pixel_size_zyx_um)
-
-    # Remove places from distance transform that are outside the threshold
-    distance_transform_to_labels[threshold == 0] = distance_transform_to_labels.max()
-
-    # Perform the watershed on the threshold
-    watershed = watershedding.watershed_labels(threshold, distance_transform_to_labels,
-                                               label_image, len(positions_of_time_point))[0]
+    if max_memory_mb is None:
+        watershed = watershedding.watershed_positions(image_stack, image_positions, resolution.pixel_size_zyx_um,
+                                                      threshold_block_size)
+    else:
+        watershed = watershedding.watershed_positions_tiled(image_stack, image_positions, resolution.pixel_size_zyx_um,
+                                                            threshold_block_size, max_memory_mb)
 
     # Finally use that for fitting
     gaussians = gaussian_fit.perform_gaussian_mixture_fit_from_watershed(image_stack, watershed, image_positions,
                                                                          gaussian_fit_smooth_size,
-                                                                         cluster_detection_erosion_rounds)
+                                                                         cluster_detection_erosion_rounds,
+                                                                         multiscale=multiscale)
     for position, gaussian in zip(positions_of_time_point, gaussians):
         shape = FAILED_SHAPE if gaussian is None \
             else GaussianShape(gaussian
@@ -120,15 +120,47 @@ def perform_gaussian_mixture_fit(original_image: ndarray, guesses: List[Gaussian
     return result_gaussians
 
 
+_MULTISCALE_MIN_SIZE_XY = 16  # Below this size (in pixels), the coarse fit is skipped
+
+
+def perform_gaussian_mixture_fit_multiscale(original_image: ndarray, guesses: List[Gaussian]) -> List[Gaussian]:
+    """Like perform_gaussian_mixture_fit, but first fits on an image that is downsampled two times in x and y. The
+    result of that is then upscaled and used as the starting point for the fit at full resolution. For big nuclei this
+    is much faster, as most iterations of the optimizer then only need to touch a quarter of the pixels.
+
+    If the image is too small, or if the coarse fit fails, this method just fits at full resolution."""
+    if original_image.shape[1] < _MULTISCALE_MIN_SIZE_XY or original_image.shape[2] < _MULTISCALE_MIN_SIZE_XY:
+        return perform_gaussian_mixture_fit(original_image, guesses)
+
+    downsampled_image = _downsample_xy(original_image)
+    try:
+        coarse_gaussians = perform_gaussian_mixture_fit(downsampled_image,
+                                                        [guess.scaled_xy(0.5) for guess in guesses])
+    except ValueError:
+        return perform_gaussian_mixture_fit(original_image, guesses)
+    return perform_gaussian_mixture_fit(original_image, [gaussian.scaled_xy(2) for gaussian in coarse_gaussians])
+
+
+def _downsample_xy(image: ndarray) -> ndarray:
+    """Halves the size of the image in x and y by averaging blocks of 2x2 pixels. If the image has an odd width or
+    height, the last column or row is dropped."""
+    size_z, size_y, size_x = image.shape[0], image.shape[1] // 2, image.shape[2] // 2
+    image = image[:, 0:size_y * 2, 0:size_x * 2].astype(numpy.float64)
+    return image.reshape(size_z, size_y, 2, size_x, 2).mean(axis=(2, 4))
+
+
 _FIT_MARGIN = 5
 
 
 def perform_gaussian_mixture_fit_from_watershed(image: ndarray, watershed_image: ndarray, positions: List[Position],
-                                                blur_radius: int, erode_passes: int) -> List[Gaussian]:
+                                                blur_radius: int, erode_passes: int, *, multiscale: bool = False
+                                                ) -> List[Gaussian]:
     """GMM using watershed as seeds. The watershed is used to fit as few Gaussians at the same time as possible: if two
     colors in the watershed have only a small connection (defined by erode_passes) they will be fit separately. The
     positions are used as starting positions for the Gaussian fit; the index in the list must match the index in the
-    watershed image."""
+    watershed image. If multiscale is True, every cluster is first fit on a downsampled image, see
+    perform_gaussian_mixture_fit_multiscale."""
+    fit_function = perform_gaussian_mixture_fit_multiscale if multiscale else perform_gaussian_mixture_fit
     start_time = default_timer()
 
     # Find out where the positions are
@@ -171,7 +203,7 @@ def perform_gaussian_mixture_fit_from_watershed(image: ndarray, watershed_image:
         offset_x, offset_y, offset_z = bounding_box.min_x - _FIT_MARGIN, bounding_box.min_y - _FIT_MARGIN, bounding_box.min_z - _FIT_MARGIN
         gaussians = [gaussian.translated(-offset_x, -offset_y, -offset_z) for gaussian in gaussians]
         try:
-            gaussians = perform_gaussian_mixture_fit(cropped_image, gaussians)
+            gaussians = fit_function(cropped_image, gaussians)
             for i, gaussian in enumerate(gaussians):
                 all_gaussians[cell_ids[i]] = gaussian.translated(offset_x, offset_y, offset_z)
         except ValueError:
@@ -1,4 +1,7 @@
-from typing import Optional
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Tuple
 
 import cv2
 import numpy
@@ -107,6 +110,163 @@ def get_negative_gaussian_curvatures(image_stack: ndarray, derivatives: ImageDer
             out[z] = cv2.dilate(out[z], dilation_kernel, iterations=1)
 
 
+class _SlabBuffers:
+    """Reusable arrays for get_negative_gaussian_curvatures_in_slabs. Every worker thread gets its own instance, which
+    is then reused for all slabs that thread processes."""
+    _arrays: Dict[str, ndarray]
+
+    def __init__(self):
+        self._arrays = dict()
+
+    def get(self, name: str, shape: Tuple[int, int, int], dtype=numpy.float32) -> ndarray:
+        """Gets a buffer of the given shape. Its contents are undefined."""
+        array = self._arrays.get(name)
+        if array is None or array.shape[0] < shape[0] or array.shape[1:] != shape[1:]:
+            array = numpy.empty(shape, dtype=dtype)
+            self._arrays[name] = array
+        return array[0:shape[0]]
+
+
+def get_negative_gaussian_curvatures_in_slabs(image_stack: ndarray, out: ndarray, blur_radius: int = 5,
+                                              dilate: bool = True, slab_size: int = 8, workers: Optional[int] = None):
+    """Faster and less memory-hungry version of get_negative_gaussian_curvatures. The image is processed in slabs of
+    slab_size z layers (plus a few layers of padding), which are divided over multiple threads. All derivatives are
+    calculated in float32 using separable filters, in buffers that are reused for every slab. Instead of calculating the
+    full Gaussian curvature, only its sign is calculated, which needs fewer intermediate images.
+
+    The result is the same as that of get_negative_gaussian_curvatures, except for some rounding differences at pixels
+    where the curvature is almost zero."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    derivative_kernel, smooth_kernel = cv2.getDerivKernels(1, 0, blur_radius, ktype=cv2.CV_32F)
+    padding = 2 * (blur_radius // 2)  # z derivatives are taken twice
+    thread_buffers = threading.local()
+
+    def process_slab(start_z: int):
+        if not hasattr(thread_buffers, "buffers"):
+            thread_buffers.buffers = _SlabBuffers()
+        end_z = min(start_z + slab_size, image_stack.shape[0])
+        padded_start_z = max(0, start_z - padding)
+        padded_end_z = min(image_stack.shape[0], end_z + padding)
+        _get_negative_gaussian_curvatures_of_slab(image_stack[padded_start_z:padded_end_z],
+                                                  out[start_z:end_z], start_z - padded_start_z, blur_radius,
+                                                  derivative_kernel, smooth_kernel, dilate, thread_buffers.buffers)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Calling list(...) makes sure that exceptions are raised
+        list(executor.map(process_slab, range(0, image_stack.shape[0], slab_size)))
+
+
+def _get_negative_gaussian_curvatures_of_slab(padded_slab: ndarray, out: ndarray, offset_z: int, blur_radius: int,
+                                              derivative_kernel: ndarray, smooth_kernel: ndarray, dilate: bool,
+                                              buffers: _SlabBuffers):
+    """Processes a single slab. padded_slab is the image, including padding layers above and below. out is the part of
+    the output belonging to the slab (without padding), and offset_z is the number of padding layers above."""
+    shape = padded_slab.shape
+    blurred = buffers.get("blurred", shape, numpy.uint8)
+    for z in range(shape[0]):
+        cv2.GaussianBlur(padded_slab[z], (blur_radius * 2 + 1, blur_radius * 2 + 1), 0, dst=blurred[z])
+
+    def sobel_x(image: ndarray, name: str) -> ndarray:
+        result = buffers.get(name, shape)
+        for z in range(shape[0]):
+            cv2.sepFilter2D(image[z], cv2.CV_32F, derivative_kernel, smooth_kernel, dst=result[z],
+                            borderType=cv2.BORDER_CONSTANT)
+        return result
+
+    def sobel_y(image: ndarray, name: str) -> ndarray:
+        result = buffers.get(name, shape)
+        for z in range(shape[0]):
+            cv2.sepFilter2D(image[z], cv2.CV_32F, smooth_kernel, derivative_kernel, dst=result[z],
+                            borderType=cv2.BORDER_CONSTANT)
+        return result
+
+    def sobel_z(image: ndarray, name: str) -> ndarray:
+        # Smooth every layer in the y direction, then take the derivative over the layers. Like with cv2.Sobel, pixels
+        # outside the image are treated as zero
+        smoothed = buffers.get("smoothed_y", shape)
+        for z in range(shape[0]):
+            cv2.sepFilter2D(image[z], cv2.CV_32F, _IDENTITY_KERNEL, smooth_kernel, dst=smoothed[z],
+                            borderType=cv2.BORDER_CONSTANT)
+        result = buffers.get(name, shape)
+        result.fill(0)
+        radius = len(derivative_kernel) // 2
+        for i, weight in enumerate(derivative_kernel.ravel()):
+            if weight == 0:
+                continue
+            dz = i - radius
+            if dz >= 0:
+                result[0:shape[0] - dz] += weight * smoothed[dz:shape[0]]
+            else:
+                result[-dz:shape[0]] += weight * smoothed[0:shape[0] + dz]
+        return result
+
+    fx = sobel_x(blurred, "fx")
+    fy = sobel_y(blurred, "fy")
+    fz = sobel_z(blurred, "fz")
+    fxx = sobel_x(fx, "fxx")
+    fyy = sobel_y(fy, "fyy")
+    fzz = sobel_z(fz, "fzz")
+    fxy = sobel_y(fx, "fxy")
+    fxz = sobel_z(fx, "fxz")
+    fyz = sobel_z(fy, "fyz")
+
+    # Drop the padding
+    core = slice(offset_z, offset_z + out.shape[0])
+    fx, fy, fz, fxx, fyy, fzz, fxy, fxz, fyz = \
+        fx[core], fy[core], fz[core], fxx[core], fyy[core], fzz[core], fxy[core], fxz[core], fyz[core]
+    core_shape = fx.shape
+
+    # The Gaussian curvature K from _get_iic has the same sign as l * n - m ** 2, with l, m and n the numerators of L, M
+    # and N. Calculate that in place, overwriting derivatives once they are no longer needed
+    fz2 = numpy.multiply(fz, fz, out=buffers.get("fz2", core_shape))
+    l = numpy.multiply(fx, fz, out=buffers.get("l", core_shape))
+    l *= fxz
+    l *= 2
+    temp = numpy.multiply(fx, fx, out=buffers.get("temp", core_shape))
+    temp *= fzz
+    l -= temp
+    fxx *= fz2
+    l -= fxx
+
+    n = numpy.multiply(fy, fz, out=buffers.get("n", core_shape))
+    n *= fyz
+    n *= 2
+    numpy.multiply(fy, fy, out=temp)
+    temp *= fzz
+    n -= temp
+    fyy *= fz2
+    n -= fyy
+
+    m = fyz  # From now on, reuse the buffers for fyz, fxz, fzz and fxy to calculate the terms of m
+    m *= fx
+    m *= fz
+    fxz *= fy
+    fxz *= fz
+    m += fxz
+    fzz *= fx
+    fzz *= fy
+    m -= fzz
+    fxy *= fz2
+    m -= fxy
+
+    l *= n
+    m *= m
+    l -= m  # Now contains l * n - m ** 2
+
+    # Where fz is zero, K is NaN in _get_iic, so no curvature is marked as negative there
+    negative = numpy.less(l, 0, out=buffers.get("negative", core_shape, bool))
+    negative &= numpy.not_equal(fz, 0, out=buffers.get("fz_not_zero", core_shape, bool))
+    out[negative] = 0
+    if dilate:
+        dilation_kernel = numpy.ones((blur_radius, blur_radius), dtype=numpy.uint8)
+        for z in range(out.shape[0]):
+            out[z] = cv2.dilate(out[z], dilation_kernel, iterations=1)
+
+
+_IDENTITY_KERNEL = numpy.ones((1, 1), dtype=numpy.float32)
+
+
 def _get_iic(derivatives: ImageDerivatives) -> ndarray:
     """Calculates the minimal iso-intensity curvature. Algorithm described in Supplementary Information 2 of Toyoshima,
     Yu, et al. "Accurate Automatic Detection of Densely Distributed Cell Nuclei in 3D Space." PLoS computational biology
@@ -1,14 +1,28 @@
 """Attempt at edge detection. Doesn't work so well."""
+from typing import Optional
+
 import cv2
 import numpy
 from numpy import ndarray
 
 from organoid_tracker.position_detection import iso_intensity_curvature
-from organoid_tracker.position_detection.iso_intensity_curvature import ImageDerivatives
 
 
-def background_removal(orignal_image_8bit: ndarray, threshold: ndarray):
-    """A simple background removal using two algoritms"""
+def get_background_thresholds(orignal_image_8bit: ndarray) -> ndarray:
+    """Gets the intensity thresholds that background_removal uses for each z layer. These thresholds are calculated
+    using the Triangle method over entire z layers. If you process an image in parts, you can calculate them up front
+    using this method, so that every part uses the same thresholds."""
+    blur = numpy.empty_like(orignal_image_8bit[0])
+    thresholds = numpy.empty(orignal_image_8bit.shape[0], dtype=numpy.float64)
+    for z in range(orignal_image_8bit.shape[0]):
+        cv2.GaussianBlur(orignal_image_8bit[z], (5, 5), 0, dst=blur)
+        thresholds[z], _ = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_TRIANGLE)
+    return thresholds
+
+
+def background_removal(orignal_image_8bit: ndarray, threshold: ndarray, background_thresholds: Optional[ndarray] = None):
+    """A simple background removal using two algoritms. If background_thresholds is given (see
+    get_background_thresholds), those are used instead of calculating a Triangle threshold for each z layer."""
 
     # Remove everything below 10%
     absolute_thresh = int(0.01 * 255)
@@ -19,29 +33,34 @@ def background_removal(orignal_image_8bit: ndarray, threshold: ndarray):
     otsu_thresh = numpy.empty_like(orignal_image_8bit[0])
     for z in range(orignal_image_8bit.shape[0]):
         cv2.GaussianBlur(orignal_image_8bit[z], (5, 5), 0, dst=blur)
-        cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_TRIANGLE, dst=otsu_thresh)
+        if background_thresholds is None:
+            cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_TRIANGLE, dst=otsu_thresh)
+        else:
+            cv2.threshold(blur, background_thresholds[z], 255, cv2.THRESH_BINARY, dst=otsu_thresh)
         threshold[z] &= otsu_thresh
 
 
-def adaptive_threshold(image_8bit: ndarray, out: ndarray, block_size: int):
+def adaptive_threshold(image_8bit: ndarray, out: ndarray, block_size: int,
+                       background_thresholds: Optional[ndarray] = None):
     """A simple, adaptive threshold. Intensities below 10% are removed, as well as intensities that fall below an
     adaptive Gaussian threshold.
     """
     for z in range(image_8bit.shape[0]):
         cv2.adaptiveThreshold(image_8bit[z], 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size,
                               2, dst=out[z])
-    background_removal(image_8bit, out)
+    background_removal(image_8bit, out, background_thresholds)
 
 
-def advanced_threshold(image_8bit: ndarray, out: ndarray, block_size: int):
-    adaptive_threshold(image_8bit, out, block_size)
+def advanced_threshold(image_8bit: ndarray, out: ndarray, block_size: int,
+                       background_thresholds: Optional[ndarray] = None):
+    adaptive_threshold(image_8bit, out, block_size, background_thresholds)
 
     curvature_out = numpy.full_like(image_8bit, 255, dtype=numpy.uint8)
-    iso_intensity_curvature.get_negative_gaussian_curvatures(image_8bit, ImageDerivatives(), curvature_out)
+    iso_intensity_curvature.get_negative_gaussian_curvatures_in_slabs(image_8bit, curvature_out)
     out &= curvature_out
 
     fill_threshold(out)
-    background_removal(image_8bit, out)
+    background_removal(image_8bit, out, background_thresholds)
 
 
 def _open(threshold: ndarray):
@@ -1,3 +1,4 @@
+import math
 import random
 from typing import Tuple, List, Iterable, Optional
 
@@ -9,6 +10,8 @@ from numpy import ndarray
 from scipy.ndimage import morphology
 
 from organoid_tracker.core.position import Position
+from organoid_tracker.imaging import image_slicer
+from organoid_tracker.position_detection import thresholding
 
 
 def _create_colormap() -> List[Tuple[float, float, float, float]]:
@@ -93,16 +96,109 @@ def watershed_labels(threshold: ndarray, surface: ndarray, label_image: ndarray,
     return: Two images, one being a label image, the other being the watershed boundaries.
     """
 
+    areas, lines = _watershed_labels(threshold, surface, label_image, label_count)
+    areas[:, 0, 0] = areas.max()
+    return areas, lines
+
+
+def _watershed_labels(threshold: ndarray, surface: ndarray, label_image: ndarray, label_count: int
+                      ) -> Tuple[ndarray, ndarray]:
     # Give areas outside the threshold a temporary label to avoid watershedding them
     new_label = label_count + 1
     label_image[threshold == 0] = new_label
 
     areas, lines = mahotas.cwatershed(surface, label_image, return_lines=True)
     areas[areas == new_label] = 0  # And remove the temporary label again
-    areas[:, 0, 0] = areas.max()
     return areas, lines
 
 
+def watershed_positions(image_8bit: ndarray, positions: List[Optional[Position]],
+                        resolution_zyx_um: Tuple[float, float, float], threshold_block_size: int) -> ndarray:
+    """Thresholds the image using thresholding.advanced_threshold, and then performs a watershed from the given
+    positions, which flows outwards based on the distance to those positions. Returns the label image, in which label i
+    corresponds to positions[i]. As with create_labels, positions[0] must be None."""
+    areas = _watershed_positions(image_8bit, positions, resolution_zyx_um, threshold_block_size, None, len(positions) - 1)
+    areas[:, 0, 0] = areas.max()
+    return areas
+
+
+def _watershed_positions(image_8bit: ndarray, positions: List[Optional[Position]],
+                         resolution_zyx_um: Tuple[float, float, float], threshold_block_size: int,
+                         background_thresholds: Optional[ndarray], label_count: int) -> ndarray:
+    # Create a threshold
+    threshold = numpy.empty_like(image_8bit, dtype=numpy.uint8)
+    thresholding.advanced_threshold(image_8bit, threshold, threshold_block_size, background_thresholds)
+
+    # Labelling, calculate distance to label
+    label_image = numpy.zeros_like(image_8bit, dtype=numpy.uint16)
+    create_labels(positions, label_image)
+    distance_to_labels = distance_transform_to_labels(label_image, resolution_zyx_um)
+
+    # Remove places from distance transform that are outside the threshold
+    distance_to_labels[threshold == 0] = distance_to_labels.max()
+
+    # Perform the watershed on the threshold
+    return _watershed_labels(threshold, distance_to_labels, label_image, label_count)[0]
+
+
+# Rough peak memory usage of watershed_positions in bytes per voxel. This is dominated by the float64 distance transform
+# and the label images. (The curvature calculation in the thresholding step works in small slabs of z layers.)
+_WATERSHED_BYTES_PER_VOXEL = 32
+_MIN_TILE_SIZE_XY = 32
+
+
+def get_tile_size_xy(image_size_zyx: Tuple[int, int, int], tile_margin_xy: int, max_memory_mb: float) -> int:
+    """Gets the largest tile size in x and y (excluding the margin) for which watershed_positions_tiled stays within the
+    given memory budget. The memory used by the image stack itself and by the resulting label image is also counted.
+    If the budget is very small, a minimal tile size is returned, so the budget might then be exceeded."""
+    bytes_for_stacks = image_size_zyx[0] * image_size_zyx[1] * image_size_zyx[2] * 3  # uint8 input, uint16 output
+    bytes_for_tile = max_memory_mb * 1024 * 1024 - bytes_for_stacks
+    voxels_for_tile = max(0.0, bytes_for_tile / _WATERSHED_BYTES_PER_VOXEL)
+    tile_size_with_margin = int(math.sqrt(voxels_for_tile / image_size_zyx[0]))
+    return max(_MIN_TILE_SIZE_XY, tile_size_with_margin - 2 * tile_margin_xy)
+
+
+def watershed_positions_tiled(image_8bit: ndarray, positions: List[Optional[Position]],
+                              resolution_zyx_um: Tuple[float, float, float], threshold_block_size: int,
+                              max_memory_mb: float, tile_margin_xy: int = 64) -> ndarray:
+    """Memory-bounded version of watershed_positions. The stack is processed in tiles (in the xy plane, every tile
+    contains all z layers) that are small enough to stay within max_memory_mb. Tiles overlap with tile_margin_xy pixels,
+    and only the center of each tile is placed in the output. This margin must be larger than the nuclei, otherwise the
+    watershed can differ from that of watershed_positions near the edges of the tiles. It must also be larger than half
+    the threshold block size."""
+    tile_margin_xy = max(tile_margin_xy, threshold_block_size // 2 + 1)
+    tile_size_xy = get_tile_size_xy(image_8bit.shape, tile_margin_xy, max_memory_mb)
+    image_part_size = [image_8bit.shape[0], tile_size_xy, tile_size_xy]
+    image_part_margin = [0, tile_margin_xy, tile_margin_xy]
+    for axis in [1, 2]:
+        if image_8bit.shape[axis] <= tile_size_xy + 2 * tile_margin_xy:
+            image_part_size[axis] = image_8bit.shape[axis]  # No need to split along this axis
+            image_part_margin[axis] = 0
+
+    # Triangle thresholds are calculated over whole z layers, so do that up front
+    background_thresholds = thresholding.get_background_thresholds(image_8bit)
+    label_count = len(positions) - 1
+
+    areas = numpy.zeros_like(image_8bit, dtype=numpy.uint16)
+    for slicer in image_slicer.get_slices(image_8bit.shape, tuple(image_part_size), tuple(image_part_margin)):
+        _, start_y, start_x = slicer.get_start_zyx()
+        _, end_y, end_x = slicer.get_end_zyx()
+
+        # Only add positions that are inside the tile, and move them to tile coordinates
+        tile_positions = [None]
+        for position in positions[1:]:
+            if position is None or not start_x <= int(position.x) < end_x or not start_y <= int(position.y) < end_y:
+                tile_positions.append(None)
+            else:
+                tile_positions.append(position.with_offset(-start_x, -start_y, 0))
+
+        tile_areas = _watershed_positions(slicer.slice(image_8bit), tile_positions, resolution_zyx_um,
+                                          threshold_block_size, background_thresholds, label_count)
+        slicer.place_slice_in_volume(tile_areas, areas)
+    areas[:, 0, 0] = areas.max()
+    return areas
+
+
 # def remove_big_labels(labeled: ndarray):
 #     """Removes all labels 10x larger than the average."""
 #     sizes = mahotas.labeled.labeled_size(labeled)
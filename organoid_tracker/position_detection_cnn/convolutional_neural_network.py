@@ -21,8 +21,12 @@
 # SOFTWARE.
 
 
-TRAIN_TFRECORD = "train.tfrecord"  # Data file used for model training
-TEST_TFRECORD = "test.tfrecord"  # Data file used for model evaluation
+TRAIN_TFRECORD = "train.tfrecord"  # Data file used for model training (older versions, now one file per experiment)
+TEST_TFRECORD = "test.tfrecord"  # Data file used for model evaluation (older versions, now one file per experiment)
+TRAIN_TFRECORD_PREFIX = "train_experiment_"  # Start of the data files used for model training, one per experiment
+TEST_TFRECORD_PREFIX = "test_experiment_"  # Start of the data files used for model evaluation, one per experiment
+TRAIN_PATCHES_TFRECORD_PREFIX = "train_patches_"  # Start of the shard files with patches used for model training
+TEST_PATCHES_TFRECORD_PREFIX = "test_patches_"  # Start of the shard files with patches used for model evaluation
 
 
 import tensorflow as tf
@@ -60,6 +64,9 @@ def build_fcn_model(features, labels, mode, use_cpu=False):
         'prediction': layer,
         'data': features['data']
     }
+    for key in ['image_index', 'tile_index']:
+        if key in features:
+            predictions[key] = features[key]  # Passed through, so that the predictions can be put back in place
     if mode == tf.estimator.ModeKeys.PREDICT:
         return tf.estimator.EstimatorSpec(mode=mode, predictions=predictions)
 
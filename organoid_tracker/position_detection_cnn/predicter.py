@@ -25,8 +25,12 @@ import itertools
 import logging
 import math
 import os
+import threading
+from queue import Queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from typing import Optional, Tuple, Iterable, List, TypeVar
+from typing import Optional, Tuple, Iterable, List, TypeVar, Callable, Dict, Union
 from numpy import ndarray
 
 import numpy
@@ -51,13 +55,105 @@ tf.logging.set_verbosity(tf.logging.INFO)
 
 _IMAGE_PART_SIZE = (28, 256, 256)  # ZYX size of the image if split is True
 _IMAGE_PART_MARGIN = (2, 32, 32)  # Margin inside the image part
-_IMAGE_PART_SIZE_PLUS_MARGIN = (_IMAGE_PART_SIZE[0] + 2 * _IMAGE_PART_MARGIN[0],
-                                _IMAGE_PART_SIZE[1] + 2 * _IMAGE_PART_MARGIN[1],
-                                _IMAGE_PART_SIZE[2] + 2 * _IMAGE_PART_MARGIN[2])
-
-
-def _get_slices(volume: Tuple[int, int, int]) -> Iterable[Slicer3d]:
-    return image_slicer.get_slices(volume, _IMAGE_PART_SIZE, _IMAGE_PART_MARGIN)
+_NETWORK_BYTES_PER_VOXEL = 1200  # Rough estimate of the memory the network needs per voxel of its input
+_MAX_PRELOADED_IMAGES = 2  # Images of upcoming time points that are loaded in advance, regardless of the thread count
+_MAX_PENDING_PREDICTIONS = 2  # Predictions of finished time points that can wait for their peaks to be found
+
+
+def _get_slices(volume: Tuple[int, int, int], image_part_size: Tuple[int, int, int],
+                image_part_margin: Tuple[int, int, int]) -> Iterable[Slicer3d]:
+    return image_slicer.get_slices(volume, image_part_size, image_part_margin)
+
+
+def _plus_margin(image_part_size: Tuple[int, int, int], image_part_margin: Tuple[int, int, int]
+                 ) -> Tuple[int, int, int]:
+    return (image_part_size[0] + 2 * image_part_margin[0],
+            image_part_size[1] + 2 * image_part_margin[1],
+            image_part_size[2] + 2 * image_part_margin[2])
+
+
+def _get_image_part_size_for_memory(volume_zyx: Tuple[int, int, int], max_memory_mb: float, batch_size: int
+                                    ) -> Optional[Tuple[Tuple[int, int, int], Tuple[int, int, int]]]:
+    """Finds the image part size and margin (both ZYX) to use such that a batch of image parts fits in the given amount
+    of memory. Of all part sizes that fit, the one for which the least voxels need to go through the network is used,
+    so the margins overlap as little as possible. Like the whole image, the image parts (including margins) are
+    multiples of 32 pixels in size. Returns None if the whole image fits in memory, so that no splitting is needed."""
+    max_voxels = max_memory_mb * 1024 * 1024 / (_NETWORK_BYTES_PER_VOXEL * batch_size)
+    if volume_zyx[0] * volume_zyx[1] * volume_zyx[2] <= max_voxels:
+        return None
+
+    # Options for the size (including margin) and margin in each dimension
+    z_options = [(volume_zyx[0], 0)]
+    if volume_zyx[0] > 32:
+        z_options.append((32, _IMAGE_PART_MARGIN[0]))
+    xy_options = [(size_xy, _IMAGE_PART_MARGIN[1]) for size_xy in range(3 * 32, max(volume_zyx[1:]), 32)]
+    xy_options.append((max(volume_zyx[1:]), 0))
+
+    best_part = None
+    best_voxel_count = None
+    for size_z, margin_z in z_options:
+        for size_xy, margin_xy in xy_options:
+            if size_z * size_xy * size_xy > max_voxels:
+                continue
+            part_size = (size_z - 2 * margin_z, size_xy - 2 * margin_xy, size_xy - 2 * margin_xy)
+            part_count = math.ceil(volume_zyx[0] / part_size[0]) * math.ceil(volume_zyx[1] / part_size[1]) \
+                * math.ceil(volume_zyx[2] / part_size[2])
+            voxel_count = part_count * size_z * size_xy * size_xy
+            if best_voxel_count is None or voxel_count <= best_voxel_count:  # On a tie, prefer the larger part
+                best_part = part_size, (margin_z, margin_xy, margin_xy)
+                best_voxel_count = voxel_count
+
+    if best_part is None:
+        size_xy, margin_xy = xy_options[0]
+        size_z, margin_z = z_options[-1]
+        print(f"Warning: even image parts of {size_z}x{size_xy}x{size_xy} px need more than {max_memory_mb} MB;"
+              f" using them anyways")
+        best_part = (size_z - 2 * margin_z, size_xy - 2 * margin_xy, size_xy - 2 * margin_xy), \
+                    (margin_z, margin_xy, margin_xy)
+    return best_part
+
+
+class _PredictionImageWriter(threading.Thread):
+    """Writes the prediction images to TIFF files on a background thread, so that writing (and compressing) them doesn't
+    hold up the network. At most max_queued_images images wait to be written; after that, write() blocks."""
+
+    _out_dir: str
+    _compression: Union[int, str, Tuple[str, int]]
+    _queue: Queue  # Queue[Optional[Tuple[str, ndarray]]], None means: stop
+    _error: Optional[BaseException] = None
+
+    def __init__(self, out_dir: str, compression: Union[int, str, Tuple[str, int]], max_queued_images: int):
+        super().__init__(name="PredictionImageWriter", daemon=True)
+        self._out_dir = out_dir
+        self._compression = compression
+        self._queue = Queue(maxsize=max_queued_images)
+
+    def write(self, image_name: str, image: ndarray):
+        """Schedules an image for writing. If writing a previous image failed, that error is raised here."""
+        if self._error is not None:
+            raise self._error
+        self._queue.put((image_name, image))
+
+    def close(self):
+        """Waits for all scheduled images to be written. If writing an image failed, that error is raised here."""
+        self._queue.put(None)
+        self.join()
+        if self._error is not None:
+            raise self._error
+
+    def run(self):
+        """Writes the images in the queue. Do not call, let Python call it."""
+        while True:
+            item = self._queue.get(block=True, timeout=None)
+            if item is None:
+                return
+            if self._error is not None:
+                continue  # Keep emptying the queue, so that write() doesn't block forever
+            image_name, image = item
+            try:
+                tifffile.imsave(os.path.join(self._out_dir, image_name + ".tif"), image, compress=self._compression)
+            except BaseException as e:
+                self._error = e
 
 
 T = TypeVar('T')
@@ -68,82 +164,159 @@ def _cycle(list: List[T]) -> Iterable[T]:
             yield elem
 
 
-def _reconstruct_volume(multi_im: ndarray, mid_layers_nb: int) -> Tuple[ndarray, int]:
-    """Reconstructs a volume so that the xy scale is roughly equal to the z scale. Returns the used scale."""
-    # Make sure that
-    if mid_layers_nb < 0:
-        raise ValueError("negative number of mid layers")
-    if mid_layers_nb == 0:
-        return multi_im, 1  # No need to reconstruct anything
-
-    out_img = numpy.zeros(
-        (int(len(multi_im) + mid_layers_nb * (len(multi_im) - 1) + 2 * mid_layers_nb),) + multi_im[0].shape).astype(
-        multi_im[0].dtype)
-
-    layer_index = mid_layers_nb + 1
-    orig_index = []
-
-    for i in range(len(multi_im) - 1):
-
-        for layer in range(mid_layers_nb + 1):
-            t = float(layer) / (mid_layers_nb + 1)
-            interpolate = ((1 - t) * (multi_im[i]).astype(float) + t * (multi_im[i + 1]).astype(float))
-
-            out_img[layer_index] = interpolate
-
-            if t == 0:
-                orig_index.append(layer_index)
-            layer_index += 1
-
-    return out_img, mid_layers_nb + 1
-
-
 def _next_multiple_of_32(number: int) -> int:
     """31 becomes 32, 32 stays 32, 33 becomes 64, and so on."""
     return math.ceil(number / 32) * 32
 
 
-def _input_fn(images: Images, split: bool):
+def _load_normalized_image(images: Images, time_point: TimePoint, padded_size_zyx: Tuple[int, int, int],
+                           image_loading_lock: threading.Lock) -> ndarray:
+    """Loads the image of the given time point, scales the intensities to 0..1 and pads it with zeroes to the given
+    size."""
+    with image_loading_lock:  # Image loaders are not necessarily thread-safe
+        image_data = numpy.array(images.get_image(time_point).array).astype(numpy.float32)
+    image_data = (image_data - numpy.min(image_data)) / (numpy.max(image_data) - numpy.min(image_data))
+    data = numpy.zeros(padded_size_zyx, dtype=numpy.float32)
+    z = int((data.shape[0] - image_data.shape[0]) / 2)
+    data[z: z + image_data.shape[0], 0:image_data.shape[1], 0:image_data.shape[2]] = image_data
+    return data
+
+
+def _input_fn(images: Images, time_points: List[TimePoint], split: bool, image_part_size: Tuple[int, int, int],
+              image_part_margin: Tuple[int, int, int], worker_count: int, batch_size: int):
+    """Creates the input for the network. Every element is labeled with the index of its time point in the time_points
+    list and (if split is True) with the index of the image part, so that the predictions can be put back together
+    regardless of the order in which they arrive. Image parts of consecutive time points can end up in the same batch.
+    """
     image_size_zyx = images.image_loader().get_image_size_zyx()
     image_size_x = image_size_zyx[2]
     image_size_y = image_size_zyx[1]
     image_size_z = image_size_zyx[0]
     image_size_x = max(image_size_x, image_size_y)
     image_size_y = image_size_x
+    padded_size_zyx = (_next_multiple_of_32(image_size_z), _next_multiple_of_32(image_size_y),
+                       _next_multiple_of_32(image_size_x))
+    image_loading_lock = threading.Lock()
 
     def gen_images():
-        for time_point in images.time_points():
-            image_data = numpy.array(images.get_image(time_point).array).astype(numpy.float32)
-            image_data = (image_data - numpy.min(image_data)) / (numpy.max(image_data) - numpy.min(image_data))
-            data = numpy.zeros((_next_multiple_of_32(image_size_z), _next_multiple_of_32(image_size_y),
-                                _next_multiple_of_32(image_size_x))).astype(numpy.float32)
-            z = int((data.shape[0] - image_data.shape[0]) / 2)
-            data[z: z + image_data.shape[0], 0:image_data.shape[1], 0:image_data.shape[2]] = image_data
-
-            if split:
-                for slice in _get_slices(data.shape):
-                    slice_data = slice.slice(data)
-                    yield {'data': slice_data[numpy.newaxis, numpy.newaxis, :, :, :]}
-            else:
-                yield {'data': data[numpy.newaxis, numpy.newaxis, :, :, :]}
+        # Images of upcoming time points are loaded and normalized in the background, so that the network doesn't
+        # need to wait for that. Every preloaded image is a full padded volume, so only a few are kept in memory
+        with ThreadPoolExecutor(max_workers=min(worker_count, _MAX_PRELOADED_IMAGES)) as executor:
+            time_points_iter = iter(time_points)
+            upcoming_images = deque()
+            for time_point in itertools.islice(time_points_iter, _MAX_PRELOADED_IMAGES):
+                upcoming_images.append(executor.submit(_load_normalized_image, images, time_point, padded_size_zyx,
+                                                       image_loading_lock))
+            image_index = 0
+            while len(upcoming_images) > 0:
+                data = upcoming_images.popleft().result()
+                next_time_point = next(time_points_iter, None)
+                if next_time_point is not None:
+                    upcoming_images.append(executor.submit(_load_normalized_image, images, next_time_point,
+                                                           padded_size_zyx, image_loading_lock))
+
+                if split:
+                    for tile_index, slice in enumerate(_get_slices(data.shape, image_part_size, image_part_margin)):
+                        slice_data = slice.slice(data)
+                        yield {'data': slice_data[numpy.newaxis, :, :, :], 'image_index': image_index,
+                               'tile_index': tile_index}
+                else:
+                    yield {'data': data[numpy.newaxis, :, :, :], 'image_index': image_index, 'tile_index': 0}
+                image_index += 1
 
     if split:
-        output_shape = [1, 1, _IMAGE_PART_SIZE_PLUS_MARGIN[0], _IMAGE_PART_SIZE_PLUS_MARGIN[1], _IMAGE_PART_SIZE_PLUS_MARGIN[2]]
+        output_shape = [1, *_plus_margin(image_part_size, image_part_margin)]
     else:
-        output_shape = [1, 1, _next_multiple_of_32(image_size_z), _next_multiple_of_32(image_size_y), _next_multiple_of_32(image_size_x)]
+        output_shape = [1, padded_size_zyx[0], padded_size_zyx[1], padded_size_zyx[2]]
     dataset = tf.data.Dataset.from_generator(gen_images,
-                                             output_types={'data': tf.float32},
-                                             output_shapes={'data': tf.TensorShape(output_shape)})
+                                             output_types={'data': tf.float32, 'image_index': tf.int32,
+                                                           'tile_index': tf.int32},
+                                             output_shapes={'data': tf.TensorShape(output_shape),
+                                                            'image_index': tf.TensorShape([]),
+                                                            'tile_index': tf.TensorShape([])})
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.prefetch(2)
     iterator = dataset.make_one_shot_iterator()
     next_features = iterator.get_next()
     return next_features
 
 
+def _find_peaks(prediction: ndarray, time_point: TimePoint, image_offset: Position, z_scale: float,
+                min_peak_distance_px: int) -> List[Position]:
+    """Finds the positions in a prediction volume of a single time point. Peaks are first found at whole pixels, after
+    which their z position is refined by fitting a parabola through the peak and the pixels directly above and below
+    it. z_scale is the size of a pixel in z divided by its size in x and y, which is used to scale down the minimal
+    distance between the peaks in the z direction."""
+    min_peak_distance_z_px = int(min_peak_distance_px / z_scale)
+    footprint = numpy.ones((2 * min_peak_distance_z_px + 1, 2 * min_peak_distance_px + 1, 2 * min_peak_distance_px + 1),
+                           dtype=bool)
+    coordinates = peak_local_max(prediction, footprint=footprint, threshold_abs=0.1, exclude_border=False)
+    z_offsets = _get_subpixel_z_offsets(prediction, coordinates)
+
+    positions = []
+    for coordinate, z_offset in zip(coordinates, z_offsets):
+        pos = Position(coordinate[2], coordinate[1], coordinate[0] + z_offset, time_point=time_point) + image_offset
+        positions.append(pos)
+    return positions
+
+
+def _get_subpixel_z_offsets(prediction: ndarray, coordinates: ndarray) -> ndarray:
+    """For every ZYX coordinate, fits a parabola through the prediction at z - 1, z and z + 1, and returns how far the top
+    of that parabola is from z. This is a number from -0.5 to 0.5. For peaks in the first or last z layer, or peaks
+    that are not curved downwards, 0 is returned."""
+    offsets = numpy.zeros(len(coordinates), dtype=numpy.float64)
+    if len(coordinates) == 0:
+        return offsets
+    z, y, x = coordinates[:, 0], coordinates[:, 1], coordinates[:, 2]
+    inside = (z > 0) & (z < prediction.shape[0] - 1)
+    z, y, x = z[inside], y[inside], x[inside]
+
+    below = prediction[z - 1, y, x].astype(numpy.float64)
+    center = prediction[z, y, x].astype(numpy.float64)
+    above = prediction[z + 1, y, x].astype(numpy.float64)
+    curvature = below - 2 * center + above
+    curved_down = curvature < 0
+    inside_offsets = numpy.zeros(len(z), dtype=numpy.float64)
+    inside_offsets[curved_down] = 0.5 * (below[curved_down] - above[curved_down]) / curvature[curved_down]
+    offsets[inside] = numpy.clip(inside_offsets, -0.5, 0.5)
+    return offsets
+
+
 def predict(images: Images, checkpoint_dir: str, out_dir: Optional[str] = None, split: bool = False,
-            mid_layers_nb: int = 5, min_peak_distance_px: int = 9) -> PositionCollection:
-    min_time_point_number = images.image_loader().first_time_point_number()
-    if min_time_point_number is None:
+            mid_layers_nb: int = 5, min_peak_distance_px: int = 9, *,
+            time_points: Optional[Iterable[TimePoint]] = None,
+            call_after_time_point: Callable[[TimePoint, List[Position]], type(None)] = lambda time_point, positions: ...,
+            worker_count: Optional[int] = None, batch_size: int = 1, max_memory_mb: Optional[float] = None,
+            out_compression: Union[int, str, Tuple[str, int]] = 1) -> PositionCollection:
+    """Predicts the positions for all given time points, or for all time points with images if no time points are
+    given. The call_after_time_point function is called with the positions of every finished time point, which is useful
+    for saving intermediate results.
+
+    Loading and normalizing the images of upcoming time points, and finding the peaks in the predictions of finished
+    time points, is done in background threads, so that the network is kept busy. worker_count is the maximum number
+    of threads used for both; by default this is the number of CPUs. Regardless of worker_count, only a few images are
+    loaded in advance and only a few predictions wait for their peaks to be found, as each of those is a full volume.
+
+    batch_size controls how many images (or image parts, if split is True) are sent through the network at once. On a
+    CPU, a larger batch size reduces the overhead per image part.
+
+    If max_memory_mb is given, the split parameter is ignored. Instead, the image is only split if a batch of whole images
+    would need more than the given amount of memory, and then the image parts are made as large as possible within that
+    memory budget.
+
+    If out_dir is given, the raw prediction of every time point is written there as a TIFF file, on a background thread.
+    out_compression is passed on to tifffile: either a zlib compression level (0 is no compression, 9 is the strongest
+    but slowest), a codec name, or a (codec name, level) tuple.
+
+    Positions are found at whole pixels, after which their z position is refined to sub-pixel precision. The minimal
+    distance between positions is min_peak_distance_px in x and y, and min_peak_distance_px / (mid_layers_nb + 1) in z.
+    (The name of mid_layers_nb stems from an earlier version, which interpolated mid_layers_nb layers in between every
+    two z layers for finding the peaks.)"""
+    if images.image_loader().first_time_point_number() is None:
         raise ValueError("No images were loaded")
+    time_points = list(images.time_points() if time_points is None else time_points)
+    if len(time_points) == 0:
+        return PositionCollection()
     image_size_zyx = images.image_loader().get_image_size_zyx()
     image_size_x = image_size_zyx[2]
     image_size_y = image_size_zyx[1]
@@ -156,61 +329,86 @@ def predict(images: Images, checkpoint_dir: str, out_dir: Optional[str] = None,
     output_size_x = max(output_size_x, output_size_y)  # Make image a square
     output_size_y = output_size_x
 
-    # Try to turn off slit
-    if split and output_size_x <= _IMAGE_PART_SIZE_PLUS_MARGIN[2] and output_size_y <= _IMAGE_PART_SIZE_PLUS_MARGIN[1] \
-            and output_size_x <= _IMAGE_PART_SIZE_PLUS_MARGIN[1]:
+    image_part_size, image_part_margin = _IMAGE_PART_SIZE, _IMAGE_PART_MARGIN
+    image_part_size_plus_margin = _plus_margin(image_part_size, image_part_margin)
+    if max_memory_mb is not None:
+        image_part = _get_image_part_size_for_memory((output_size_z, output_size_y, output_size_x), max_memory_mb,
+                                                     batch_size)
+        split = image_part is not None
+        if split:
+            image_part_size, image_part_margin = image_part
+            print(f"Using image parts of {image_part_size} px with a margin of {image_part_margin} px")
+    elif split and output_size_x <= image_part_size_plus_margin[2] and output_size_y <= image_part_size_plus_margin[1]:
         split = False  # Input image is so small that it doesn't need to be split
 
+    if worker_count is None:
+        worker_count = os.cpu_count() or 1
+
     estimator = tf.estimator.Estimator(model_fn=partial(build_fcn_model, use_cpu=False), model_dir=checkpoint_dir)
-    predictions = estimator.predict(input_fn=lambda: _input_fn(images, split))
+    predictions = estimator.predict(input_fn=lambda: _input_fn(images, time_points, split, image_part_size,
+                                                               image_part_margin, worker_count, batch_size))
 
+    image_writer = None
     if out_dir is not None:
         if not os.path.exists(out_dir):
             os.mkdir(out_dir)
+        image_writer = _PredictionImageWriter(out_dir, out_compression, max_queued_images=2)
+        image_writer.start()
 
     all_positions = PositionCollection()
+    postprocessing_executor = ThreadPoolExecutor(max_workers=min(worker_count, _MAX_PENDING_PREDICTIONS))
+    pending_peaks = deque()
 
-    slices = list(_get_slices((output_size_z, output_size_y, output_size_x))) if split else []
-    complete_prediction = numpy.empty((output_size_z, output_size_y, output_size_x), dtype=numpy.float32)\
-        if split else None
+    def handle_finished_peaks():
+        """Waits for the peak finding of the oldest pending time point, and stores the found positions."""
+        finished_time_point, future = pending_peaks.popleft()
+        positions_of_time_point = future.result()
+        for position in positions_of_time_point:
+            all_positions.add(position)
+        call_after_time_point(finished_time_point, positions_of_time_point)
 
-    for index, p in enumerate(predictions):
+    slices = list(_get_slices((output_size_z, output_size_y, output_size_x), image_part_size, image_part_margin)) \
+        if split else []
+    incomplete_predictions: Dict[int, Tuple[ndarray, int]] = dict()  # Image index -> volume, number of missing parts
+
+    for p in predictions:
 
         # Remove batch and channel dimensions, shape should be (z, y, x)
         prediction = numpy.squeeze(p['prediction'])
+        image_index = int(p['image_index'])
 
-        # If the image was split: reconstruct the larger image from the four parts
+        # If the image was split: reconstruct the larger image from the parts
         if split:
-            sub_index = index % len(slices)
-            slicer = slices[sub_index]
-            slicer.place_slice_in_volume(prediction, complete_prediction)
-
-            if sub_index < len(slices) - 1:
+            complete_prediction, missing_parts = incomplete_predictions.pop(image_index, (None, len(slices)))
+            if complete_prediction is None:
+                complete_prediction = numpy.empty((output_size_z, output_size_y, output_size_x), dtype=numpy.float32)
+            slices[int(p['tile_index'])].place_slice_in_volume(prediction, complete_prediction)
+
+            missing_parts -= 1
+            if missing_parts > 0:
+                incomplete_predictions[image_index] = complete_prediction, missing_parts
                 continue  # More subimages to add
 
             # Prediction is now completed
             prediction = complete_prediction
-            image_index = index // len(slices)
-        else:
-            image_index = index
 
-        time_point = TimePoint(min_time_point_number + image_index)
+        time_point = time_points[image_index]
         print("Working on time point", time_point.time_point_number(), "...")
         image_offset = images.offsets.of_time_point(time_point)
 
         prediction = prediction[output_offset_z : output_offset_z + image_size_z]
-        if out_dir is not None:
-            image_name = "image_" + str(time_point.time_point_number())
-            tifffile.imsave(os.path.join(out_dir, '{}.tif'.format(image_name)), prediction, compress=9)
-        im, z_divisor = _reconstruct_volume(prediction, mid_layers_nb) # interpolate between layers for peak detection
-
-        #can do the same thing with data to visualize
-        # imsource, _ = _reconstruct_volume(numpy.squeeze(p['data']))
-
-        # Comparison between image_max and im to find the coordinates of local maxima
-        coordinates = peak_local_max(im, min_distance=min_peak_distance_px, threshold_abs=0.1, exclude_border=False)
-        for coordinate in coordinates:
-            pos = Position(coordinate[2], coordinate[1], coordinate[0] / z_divisor - 1,
-                           time_point=time_point) + image_offset
-            all_positions.add(pos)
+        if image_writer is not None:
+            image_writer.write("image_" + str(time_point.time_point_number()), prediction)
+
+        # Find the peaks in the background, while the network continues with the next time point
+        pending_peaks.append((time_point, postprocessing_executor.submit(
+            _find_peaks, prediction, time_point, image_offset, mid_layers_nb + 1, min_peak_distance_px)))
+        while len(pending_peaks) > 0 and (pending_peaks[0][1].done() or len(pending_peaks) > _MAX_PENDING_PREDICTIONS):
+            handle_finished_peaks()
+
+    while len(pending_peaks) > 0:
+        handle_finished_peaks()
+    postprocessing_executor.shutdown()
+    if image_writer is not None:
+        image_writer.close()
     return all_positions
@@ -23,16 +23,19 @@
 # SOFTWARE.
 """Code to do the actual training."""
 import argparse
+import glob
 import os
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 
 import tensorflow as tf
 import logging
 
 from functools import partial
 
-from organoid_tracker.position_detection_cnn.convolutional_neural_network import build_fcn_model, TRAIN_TFRECORD, TEST_TFRECORD
-from organoid_tracker.position_detection_cnn.training_dataset import Dataset
+from organoid_tracker.position_detection_cnn.convolutional_neural_network import build_fcn_model, TRAIN_TFRECORD, \
+    TEST_TFRECORD, TRAIN_PATCHES_TFRECORD_PREFIX, TEST_PATCHES_TFRECORD_PREFIX, TRAIN_TFRECORD_PREFIX, \
+    TEST_TFRECORD_PREFIX
+from organoid_tracker.position_detection_cnn.training_dataset import Dataset, PatchDataset
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
@@ -40,25 +43,55 @@ logger.setLevel(logging.DEBUG)
 tf.logging.set_verbosity(tf.logging.INFO)
 
 
+def _find_tfrecord_files(input_dir: str, prefix: str, old_file_name: str) -> List[str]:
+    """Finds the data files (one per experiment) in the given folder. Older versions wrote all data to a single file
+    instead; if that file exists, only that file is returned."""
+    old_file = os.path.join(input_dir, old_file_name)
+    if os.path.exists(old_file):
+        return [old_file]
+    return sorted(glob.glob(os.path.join(input_dir, prefix + "*.tfrecord")))
+
+
 def train(input_dir: str, checkpoint_dir: str, *, patch_size_zyx: Tuple[int, int, int],
-          image_size_zyx: Tuple[int, int, int], batch_size: int, use_cpu_output: bool, max_steps: int):
+          image_size_zyx: Tuple[int, int, int], batch_size: int, use_cpu_output: bool, max_steps: int,
+          use_patches: bool = False, num_parallel_calls: Optional[int] = None, cache_dir: Optional[str] = None):
+    """Trains the network. If use_patches is True, the training data must have been created using
+    training_data_creator.create_patch_training_data, otherwise using training_data_creator.create_training_data.
+
+    num_parallel_calls is the number of threads used to read the training data, by default one per CPU. If cache_dir is
+    given, the parsed training data is cached in that folder (not used for patches, which are already cheap to read)."""
     logger.info('Training network with settings: {}'.format(vars()))
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
 
     def input_fn(dataset_path, mode, patch_size_zyx: List[int], image_size_zyx, batch_size, use_cpu):
-        dataset = Dataset(dataset_path, batch_size=batch_size, patch_shape=patch_size_zyx, image_size_zyx=image_size_zyx,
-                          mode=mode, use_cpu=use_cpu)
-        next_features, next_labels = dataset.iterator.get_next()
+        if use_patches:
+            dataset = PatchDataset(dataset_path, batch_size=batch_size, patch_shape=patch_size_zyx, mode=mode,
+                                   use_cpu=use_cpu, num_parallel_calls=num_parallel_calls)
+        else:
+            cache_file = os.path.join(cache_dir, mode + "_cache") if cache_dir is not None else None
+            dataset = Dataset(dataset_path, batch_size=batch_size, patch_shape=patch_size_zyx,
+                              image_size_zyx=image_size_zyx, mode=mode, use_cpu=use_cpu,
+                              num_parallel_calls=num_parallel_calls, cache_file=cache_file)
+        next_features, next_labels = dataset.get_next()
         data_shape = [batch_size,] + patch_size_zyx + [1, ] if use_cpu else [batch_size, 1] + patch_size_zyx
         next_features.set_shape(data_shape)
         next_labels.set_shape(data_shape)
         return {'data': next_features}, next_labels
 
 
+    if use_patches:
+        train_path = os.path.join(input_dir, TRAIN_PATCHES_TFRECORD_PREFIX + "*.tfrecord")
+        test_path = os.path.join(input_dir, TEST_PATCHES_TFRECORD_PREFIX + "*.tfrecord")
+    else:
+        train_path = _find_tfrecord_files(input_dir, TRAIN_TFRECORD_PREFIX, TRAIN_TFRECORD)
+        test_path = _find_tfrecord_files(input_dir, TEST_TFRECORD_PREFIX, TEST_TFRECORD)
+
     estimator = tf.estimator.Estimator(model_fn=partial(build_fcn_model, use_cpu=use_cpu_output),
                                        model_dir=checkpoint_dir)
 
     train_spec = tf.estimator.TrainSpec(input_fn=partial(input_fn,
-                                                         dataset_path=os.path.join(input_dir, TRAIN_TFRECORD),
+                                                         dataset_path=train_path,
                                                          batch_size=batch_size,
                                                          mode=tf.estimator.ModeKeys.TRAIN,
                                                          patch_size_zyx=list(patch_size_zyx),
@@ -66,7 +99,7 @@ def train(input_dir: str, checkpoint_dir: str, *, patch_size_zyx: Tuple[int, int
                                                          use_cpu=use_cpu_output), max_steps=max_steps)
 
     eval_spec = tf.estimator.EvalSpec(input_fn=partial(input_fn,
-                                                       dataset_path=os.path.join(input_dir, TEST_TFRECORD),
+                                                       dataset_path=test_path,
                                                        batch_size=batch_size,
                                                        mode=tf.estimator.ModeKeys.EVAL,
                                                        patch_size_zyx=list(patch_size_zyx),
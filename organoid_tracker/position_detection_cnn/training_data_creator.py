@@ -25,6 +25,8 @@ import logging
 import os
 import random
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Iterable, Tuple
 
 import numpy
@@ -34,7 +36,8 @@ from numpy import ndarray
 from organoid_tracker.core import TimePoint
 from organoid_tracker.core.experiment import Experiment
 from organoid_tracker.core.images import Images
-from organoid_tracker.position_detection_cnn.convolutional_neural_network import TRAIN_TFRECORD, TEST_TFRECORD
+from organoid_tracker.position_detection_cnn.convolutional_neural_network import TRAIN_TFRECORD_PREFIX, \
+    TEST_TFRECORD_PREFIX, TRAIN_PATCHES_TFRECORD_PREFIX, TEST_PATCHES_TFRECORD_PREFIX
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
@@ -47,10 +50,13 @@ class _ImageWithPositions:
     _images: Images
     xyz_positions: ndarray
     experiment_name: str
+    experiment_index: int
 
-    def __init__(self, experiment_name: str, images: Images, time_point: TimePoint, xyz_positions: ndarray):
+    def __init__(self, experiment_name: str, experiment_index: int, images: Images, time_point: TimePoint,
+                 xyz_positions: ndarray):
         # xyz positions: 2D numpy integer array of cell nucleus positions: [ [x,y,z], [x,y,z], ...]
         self.experiment_name = experiment_name
+        self.experiment_index = experiment_index
         self._time_point = time_point
         self._images = images
         self.xyz_positions = xyz_positions
@@ -62,25 +68,18 @@ class _ImageWithPositions:
         return f"{self.experiment_name} t{self._time_point.time_point_number()}"
 
 
-def _create_serialized_data(image_with_positions: _ImageWithPositions, image_size_zyx: Tuple[int, int, int]):
-    sub_data_xyz = image_with_positions.xyz_positions
-
-    # int64 is an accepted format for serializing in tfrecord
-    multi_im = image_with_positions.load_image()
-    if multi_im is None:
-        raise Exception(f"Image not found: {image_with_positions}")
-
+def _create_markers(image_shape: Tuple[int, int, int], sub_data_xyz: ndarray) -> ndarray:
     # this will create the labels, we create them at this stage
     # it is a preprocessing step, it is less flexible but more efficient for later
     # create a volume the same shape as the images volume,
     # will contain little gaussian disks where the labels are, float32 format values between 0-1
-    markers = numpy.zeros(multi_im.shape).astype(numpy.float32)
+    markers = numpy.zeros(image_shape).astype(numpy.float32)
 
     # this fills in the labels volume (markers) with the gaussian disks
     for dz in numpy.unique(sub_data_xyz[:, -1]):
         mask = None
         for xyz in sub_data_xyz[numpy.where(sub_data_xyz[:, -1] == dz)]:
-            y, x = numpy.ogrid[-xyz[1]:multi_im.shape[1] - xyz[1], -xyz[0]:multi_im.shape[2] - xyz[0]]
+            y, x = numpy.ogrid[-xyz[1]:image_shape[1] - xyz[1], -xyz[0]:image_shape[2] - xyz[0]]
             sigma = 2
             gaussian_mask = (x ** 2 + y ** 2 < 4 ** 2) * numpy.exp(-(x ** 2 + y ** 2) /
                                                                    (2. * sigma ** 2))
@@ -91,6 +90,16 @@ def _create_serialized_data(image_with_positions: _ImageWithPositions, image_siz
         if mask is not None:
             if int(dz) < len(markers):  # Skip positions that were set outside the images
                 markers[int(dz)] = mask
+    return markers
+
+
+def _create_serialized_data(image_with_positions: _ImageWithPositions, image_size_zyx: Tuple[int, int, int]):
+    # int64 is an accepted format for serializing in tfrecord
+    multi_im = image_with_positions.load_image()
+    if multi_im is None:
+        raise Exception(f"Image not found: {image_with_positions}")
+
+    markers = _create_markers(multi_im.shape, image_with_positions.xyz_positions)
 
     # we need all of the volume to have the same shape
     # so pad smaller images with zeroes
@@ -142,21 +151,17 @@ def _make_tfrecord(tfrecord_path: str, image_with_positions_list: List[_ImageWit
     tfwriter.close()
 
 
-def create_training_data(experiments: Iterable[Experiment], *, out_dir: str, split_proportion: float = 0.8,
-                         image_size_zyx: Tuple[int, int, int]):
-    """
-    This script creates the dataset for training in the format tfrecord,
-    from images and corresponding annotations (json files)
-    output : train.tfrecord and test.tfrecord
-    """
-
+def _get_shuffled_images_with_positions(experiments: Iterable[Experiment], out_dir: str, split_proportion: float
+                                        ) -> Tuple[List[_ImageWithPositions], List[_ImageWithPositions]]:
+    """Collects all time points with positions, and splits them pseudo-randomly into a training and a test set. The names
+    of the images in both sets are written to out_dir."""
     if os.path.exists(out_dir):
         shutil.rmtree(out_dir)  # This empties the directory, but actually removing
                                 # it may not happen immediately on Windows
     os.makedirs(out_dir, exist_ok=True)
 
     image_with_positions_list = []
-    for experiment in experiments:
+    for experiment_index, experiment in enumerate(experiments):
         # read a complete experiment
 
         for time_point in experiment.positions.time_points():
@@ -171,7 +176,8 @@ def create_training_data(experiments: Iterable[Experiment], *, out_dir: str, spl
             positions_xyz = numpy.array(positions_xyz, dtype=numpy.int32)
 
             image_with_positions_list.append(
-                _ImageWithPositions(str(experiment.name), experiment.images, time_point, positions_xyz))
+                _ImageWithPositions(str(experiment.name), experiment_index, experiment.images, time_point,
+                                    positions_xyz))
 
     # shuffle images & positions pseudo-randomly and then split into test and training set
     random.seed("using a fixed seed to ensure reproducibility")
@@ -181,6 +187,141 @@ def create_training_data(experiments: Iterable[Experiment], *, out_dir: str, spl
     test_files = image_with_positions_list[train_eval_split:]
     numpy.savetxt(os.path.join(out_dir, 'train_files.txt'), [str(train_file) for train_file in train_files], fmt="%s")
     numpy.savetxt(os.path.join(out_dir, 'test_files.txt'), [str(test_file) for test_file in test_files], fmt="%s")
+    return train_files, test_files
+
+
+def create_training_data(experiments: Iterable[Experiment], *, out_dir: str, split_proportion: float = 0.8,
+                         image_size_zyx: Tuple[int, int, int]):
+    """
+    This script creates the dataset for training in the format tfrecord,
+    from images and corresponding annotations (json files)
+    output : a train and a test tfrecord file for every experiment, so that the training can interleave them
+    """
+    train_files, test_files = _get_shuffled_images_with_positions(experiments, out_dir, split_proportion)
+
+    for prefix, files in [(TRAIN_TFRECORD_PREFIX, train_files), (TEST_TFRECORD_PREFIX, test_files)]:
+        experiment_indices = sorted({image_with_positions.experiment_index for image_with_positions in files})
+        if len(experiment_indices) == 0:
+            experiment_indices = [0]  # Still write an (empty) file
+        for experiment_index in experiment_indices:
+            files_of_experiment = [image_with_positions for image_with_positions in files
+                                   if image_with_positions.experiment_index == experiment_index]
+            _make_tfrecord(os.path.join(out_dir, f"{prefix}{experiment_index + 1}.tfrecord"), files_of_experiment,
+                           image_size_zyx)
+
+
+def _pad_to_at_least(array: ndarray, size_zyx: Tuple[int, int, int]) -> ndarray:
+    """Pads the array with zeroes (centered, like in _create_serialized_data) so that it is at least the given size."""
+    if array.shape[0] >= size_zyx[0] and array.shape[1] >= size_zyx[1] and array.shape[2] >= size_zyx[2]:
+        return array
+    padded = numpy.zeros((max(array.shape[0], size_zyx[0]), max(array.shape[1], size_zyx[1]),
+                          max(array.shape[2], size_zyx[2])), dtype=array.dtype)
+    dz = (padded.shape[0] - array.shape[0]) // 2
+    dy = (padded.shape[1] - array.shape[1]) // 2
+    dx = (padded.shape[2] - array.shape[2]) // 2
+    padded[dz: dz + array.shape[0], dy: dy + array.shape[1], dx: dx + array.shape[2]] = array
+    return padded
+
+
+def _get_patch_corners(image_shape: Tuple[int, int, int], xyz_positions: ndarray, patch_size_zyx: Tuple[int, int, int],
+                       patch_count: int, nucleus_patch_fraction: float, random_state: numpy.random.RandomState
+                       ) -> ndarray:
+    """Returns the ZYX start corners of the patches. A fraction of the patches is centered (up to a quarter of the patch
+    size) around a randomly picked nucleus, the others are placed anywhere in the image."""
+    max_corner = numpy.array(image_shape) - numpy.array(patch_size_zyx)
+    corners = numpy.empty((patch_count, 3), dtype=numpy.int64)
+    nucleus_patch_count = int(round(patch_count * nucleus_patch_fraction)) if len(xyz_positions) > 0 else 0
+
+    # Patches around nuclei
+    zyx_positions = xyz_positions[:, ::-1].astype(numpy.int64) if len(xyz_positions) > 0 else None
+    for i in range(nucleus_patch_count):
+        center = zyx_positions[random_state.randint(len(zyx_positions))]
+        jitter = [random_state.randint(-(size // 4), size // 4 + 1) for size in patch_size_zyx]
+        corners[i] = center + jitter - numpy.array(patch_size_zyx) // 2
+
+    # Patches anywhere in the image
+    for i in range(nucleus_patch_count, patch_count):
+        corners[i] = [random_state.randint(0, max_value + 1) for max_value in max_corner]
+
+    return numpy.clip(corners, 0, max_corner)
+
+
+def _create_serialized_patches(image_with_positions: _ImageWithPositions, image_loading_lock: threading.Lock,
+                               patch_size_zyx: Tuple[int, int, int], patch_count: int, nucleus_patch_fraction: float,
+                               random_state: numpy.random.RandomState) -> List[bytes]:
+    with image_loading_lock:  # Image loaders are not necessarily thread-safe
+        multi_im = image_with_positions.load_image()
+    if multi_im is None:
+        raise Exception(f"Image not found: {image_with_positions}")
+
+    # Normalize here, so that the reader doesn't need to do that for every patch
+    data = multi_im.astype(numpy.float32)
+    data_min, data_max = data.min(), data.max()
+    data = (data - data_min) / (data_max - data_min) if data_max > data_min else numpy.zeros_like(data)
+    label = _create_markers(multi_im.shape, image_with_positions.xyz_positions)
+
+    # Translate the positions along with the padding
+    xyz_positions = image_with_positions.xyz_positions
+    data = _pad_to_at_least(data, patch_size_zyx)
+    label = _pad_to_at_least(label, patch_size_zyx)
+    if len(xyz_positions) > 0:
+        xyz_positions = xyz_positions + [(data.shape[2] - multi_im.shape[2]) // 2,
+                                         (data.shape[1] - multi_im.shape[1]) // 2,
+                                         (data.shape[0] - multi_im.shape[0]) // 2]
+
+    serialized_patches = []
+    for corner in _get_patch_corners(data.shape, xyz_positions, patch_size_zyx, patch_count, nucleus_patch_fraction,
+                                     random_state):
+        patch_slice = (slice(corner[0], corner[0] + patch_size_zyx[0]), slice(corner[1], corner[1] + patch_size_zyx[1]),
+                       slice(corner[2], corner[2] + patch_size_zyx[2]))
+        feature = {
+            'data': tf.train.Feature(bytes_list=tf.train.BytesList(
+                value=[data[patch_slice].astype(numpy.float16).tobytes()])),
+            'label': tf.train.Feature(bytes_list=tf.train.BytesList(
+                value=[label[patch_slice].astype(numpy.float16).tobytes()]))
+        }
+        example = tf.train.Example(features=tf.train.Features(feature=feature))
+        serialized_patches.append(example.SerializeToString())
+    return serialized_patches
+
+
+def _make_patch_tfrecord_shard(tfrecord_path: str, image_with_positions_list: List[_ImageWithPositions],
+                               image_loading_lock: threading.Lock, patch_size_zyx: Tuple[int, int, int],
+                               patches_per_image: int, nucleus_patch_fraction: float, seed: int):
+    random_state = numpy.random.RandomState(seed)
+    options = tf.python_io.TFRecordOptions(tf.python_io.TFRecordCompressionType.GZIP)
+    with tf.python_io.TFRecordWriter(tfrecord_path, options=options) as tfwriter:
+        for image_with_positions in image_with_positions_list:
+            for serialized in _create_serialized_patches(image_with_positions, image_loading_lock, patch_size_zyx,
+                                                         patches_per_image, nucleus_patch_fraction, random_state):
+                tfwriter.write(serialized)
+    logging.info('finished {}'.format(tfrecord_path))
+
+
+def create_patch_training_data(experiments: Iterable[Experiment], *, out_dir: str, split_proportion: float = 0.8,
+                               patch_size_zyx: Tuple[int, int, int], patches_per_image: int = 64,
+                               nucleus_patch_fraction: float = 0.8, images_per_shard: int = 8,
+                               worker_count: Optional[int] = None):
+    """Alternative to create_training_data. Instead of whole images, this function writes patches of the given size,
+    already normalized and stored as dense float16 volumes in GZIP-compressed tfrecord files. This makes reading the
+    training data much cheaper, see training_dataset.PatchDataset. Of every image, patches_per_image patches are
+    extracted, nucleus_patch_fraction of which are centered around a nucleus.
+
+    The patches are written to shards (named TRAIN_PATCHES_TFRECORD_PREFIX + number + ".tfrecord", and the same for the
+    test data) of images_per_shard images each. The shards are written in parallel, using worker_count threads."""
+    train_files, test_files = _get_shuffled_images_with_positions(experiments, out_dir, split_proportion)
 
-    _make_tfrecord(os.path.join(out_dir, TRAIN_TFRECORD), train_files, image_size_zyx)
-    _make_tfrecord(os.path.join(out_dir, TEST_TFRECORD), test_files, image_size_zyx)
+    if worker_count is None:
+        worker_count = os.cpu_count() or 1
+    image_loading_lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=worker_count) as executor:
+        futures = []
+        for prefix, files in [(TRAIN_PATCHES_TFRECORD_PREFIX, train_files), (TEST_PATCHES_TFRECORD_PREFIX, test_files)]:
+            for shard_index, start in enumerate(range(0, len(files), images_per_shard)):
+                tfrecord_path = os.path.join(out_dir, f"{prefix}{shard_index:04}.tfrecord")
+                futures.append(executor.submit(_make_patch_tfrecord_shard, tfrecord_path,
+                                               files[start:start + images_per_shard], image_loading_lock,
+                                               patch_size_zyx, patches_per_image, nucleus_patch_fraction,
+                                               len(futures)))
+        for future in futures:
+            future.result()  # Raises any errors that occurred
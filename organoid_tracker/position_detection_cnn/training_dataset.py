@@ -21,21 +21,71 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-from typing import Tuple
+import os
+import time
+from typing import Tuple, List, Union, Optional
 
 import tensorflow as tf
 from functools import partial
 import numpy as np
 
+try:
+    _AUTOTUNE = tf.data.experimental.AUTOTUNE
+except AttributeError:
+    _AUTOTUNE = None  # Not available in older Tensorflow versions, then we just use a larger prefetch buffer
+_PREFETCH_BUFFER_SIZE = 8  # Used if _AUTOTUNE is not available
+
+
+class _InputStallTimer:
+    """Keeps track of how long the training steps needed to wait for the input pipeline, and reports that every
+    report_every_n_steps steps. If the network needs to wait for a significant time, the input pipeline is too slow."""
+
+    _report_every_n_steps: int
+    _stall_seconds: float = 0
+    _step_count: int = 0
+
+    def __init__(self, report_every_n_steps: int):
+        self._report_every_n_steps = report_every_n_steps
+
+    def start(self) -> np.float64:
+        return np.float64(time.perf_counter())
+
+    def end(self, start_time: np.float64) -> np.float64:
+        stall_seconds = time.perf_counter() - start_time
+        self._stall_seconds += stall_seconds
+        self._step_count += 1
+        if self._step_count >= self._report_every_n_steps:
+            tf.logging.info("Waited on average {:.3f}s per step for the input pipeline".format(
+                self._stall_seconds / self._step_count))
+            self._stall_seconds = 0
+            self._step_count = 0
+        return np.float64(stall_seconds)
+
 
 class Dataset:
 
-    def __init__(self, filename: str, *, batch_size: int, patch_shape, image_size_zyx: Tuple[int, int, int],
-                 mode: str, use_cpu: bool = False):
+    def __init__(self, filenames: Union[str, List[str]], *, batch_size: int, patch_shape,
+                 image_size_zyx: Tuple[int, int, int], mode: str, use_cpu: bool = False,
+                 num_parallel_calls: Optional[int] = None, cache_file: Optional[str] = None):
+        """Creates the dataset. If multiple files are given (for example one per experiment), they are read in an
+        interleaved manner, so that consecutive training steps see images from different files. The parsing is done
+        using num_parallel_calls threads, by default one per CPU. If cache_file is given, the parsed images are cached
+        in that file after the first pass over the data. Make sure that location has enough free space."""
         self.use_cpu = use_cpu
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        if num_parallel_calls is None:
+            num_parallel_calls = os.cpu_count() or 1
 
-        dataset = tf.data.TFRecordDataset(filename, num_parallel_reads=32)
-        dataset = dataset.map(partial(Dataset.parse_tfrecord, image_size_zyx=image_size_zyx))
+        files = tf.data.Dataset.from_tensor_slices(filenames)
+        if mode == tf.estimator.ModeKeys.TRAIN:
+            files = files.shuffle(buffer_size=len(filenames))
+        dataset = files.apply(tf.contrib.data.parallel_interleave(tf.data.TFRecordDataset,
+                                                                  cycle_length=len(filenames)))
+        dataset = dataset.map(partial(Dataset.parse_tfrecord, image_size_zyx=image_size_zyx),
+                              num_parallel_calls=num_parallel_calls)
+        if cache_file is not None:
+            dataset = dataset.cache(cache_file)
 
         if mode == tf.estimator.ModeKeys.TRAIN:
             dataset = dataset.shuffle(buffer_size=10)  # small shuffling so that each iteration is a little different
@@ -46,10 +96,23 @@ class Dataset:
                                            batch_size=batch_size,
                                            patch_shape=patch_shape,
                                            mode=mode))
-        dataset = dataset.prefetch(2)
+        dataset = dataset.prefetch(_AUTOTUNE if _AUTOTUNE is not None else _PREFETCH_BUFFER_SIZE)
 
         self.iterator = dataset.make_one_shot_iterator()
 
+    def get_next(self, report_every_n_steps: int = 100):
+        """Gets the next batch of data and labels. Also measures how long the step had to wait for that batch, which is
+        logged every report_every_n_steps steps, and written to the input_pipeline_stall_seconds summary."""
+        timer = _InputStallTimer(report_every_n_steps)
+        start_time = tf.py_func(timer.start, [], tf.float64, stateful=True)
+        with tf.control_dependencies([start_time]):
+            image_data, label = self.iterator.get_next()
+        with tf.control_dependencies([image_data, label]):
+            stall_seconds = tf.py_func(timer.end, [start_time], tf.float64, stateful=True)
+        tf.summary.scalar("input_pipeline_stall_seconds", stall_seconds)
+        with tf.control_dependencies([stall_seconds]):
+            return tf.identity(image_data), tf.identity(label)
+
     @staticmethod
     def parse_tfrecord(example, image_size_zyx: Tuple[int, int, int]):
         features = {'label': tf.SparseFeature(index_key=['label_index_0', 'label_index_1', 'label_index_2'],
@@ -189,3 +252,47 @@ class Dataset:
         dataset = dataset.batch(batch_size)
         return dataset
 
+
+class PatchDataset(Dataset):
+    """Reads the patches written by training_data_creator.create_patch_training_data. As those patches are already cut
+    out and normalized, only the random perturbations need to be applied here. Reading is done from multiple shard files
+    at once."""
+
+    def __init__(self, file_pattern: str, *, batch_size: int, patch_shape, mode: str, use_cpu: bool = False,
+                 num_parallel_calls: Optional[int] = None):
+        self.use_cpu = use_cpu
+        is_training = mode == tf.estimator.ModeKeys.TRAIN
+        if num_parallel_calls is None:
+            num_parallel_calls = os.cpu_count() or 1
+
+        files = tf.data.Dataset.list_files(file_pattern, shuffle=is_training)
+        dataset = files.interleave(partial(tf.data.TFRecordDataset, compression_type="GZIP"), cycle_length=8)
+        dataset = dataset.map(partial(PatchDataset.parse_patch_tfrecord, patch_shape=patch_shape),
+                              num_parallel_calls=num_parallel_calls)
+
+        if is_training:
+            # Patches are small, so we can afford a much larger shuffle buffer than for whole images
+            dataset = dataset.shuffle(buffer_size=1000)
+            dataset = dataset.repeat()
+            # Note: the following function automatically converts to CPU output format if self.use_cpu is True
+            dataset = dataset.map(partial(self.apply_random_perturbations, patch_shape=patch_shape),
+                                  num_parallel_calls=num_parallel_calls)
+        elif use_cpu:
+            dataset = dataset.map(self.convert_ncwh_to_nhwc)
+
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.prefetch(_AUTOTUNE if _AUTOTUNE is not None else _PREFETCH_BUFFER_SIZE)
+
+        self.iterator = dataset.make_one_shot_iterator()
+
+    @staticmethod
+    def parse_patch_tfrecord(example, patch_shape):
+        features = {'data': tf.FixedLenFeature([], tf.string),
+                    'label': tf.FixedLenFeature([], tf.string)}
+        parsed_features = tf.parse_single_example(example, features)
+
+        # Add the channel dimension, to get the same shape as the patches of Dataset.generate_patches
+        shape = [1] + list(patch_shape)
+        image_data = tf.reshape(tf.cast(tf.decode_raw(parsed_features['data'], tf.float16), tf.float32), shape)
+        label = tf.reshape(tf.cast(tf.decode_raw(parsed_features['label'], tf.float16), tf.float32), shape)
+        return image_data, label
@@ -0,0 +1,21 @@
+"""Helpers for running work in multiple processes."""
+import multiprocessing
+import multiprocessing.pool
+from typing import Optional, Callable, Tuple, Any
+
+
+def create_process_pool(worker_count: int, initializer: Optional[Callable] = None, initargs: Tuple[Any, ...] = ()
+                        ) -> Optional[multiprocessing.pool.Pool]:
+    """Creates a pool of forked worker processes, or returns None if only one worker is requested or if forking is not
+    supported. (Without forking, the worker processes would re-run the script that started them.)
+
+    If an initializer is given, every worker process calls initializer(*initargs) when it starts. As the processes are
+    forked, the initargs are not pickled, so you can use this to give large objects to the workers once, instead of
+    sending them along with every task."""
+    if worker_count <= 1:
+        return None
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        return None  # Not supported on this system
+    return context.Pool(worker_count, initializer, initargs)
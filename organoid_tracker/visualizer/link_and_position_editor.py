@@ -6,7 +6,7 @@ from organoid_tracker import core
 from organoid_tracker.core import Color, UserError
 from organoid_tracker.core.connections import Connections
 from organoid_tracker.core.experiment import Experiment
-from organoid_tracker.core.links import LinkingTrack
+from organoid_tracker.core.links import LinkingTrack, Links
 from organoid_tracker.core.particle import Particle
 from organoid_tracker.core.position import Position
 from organoid_tracker.core.marker import Marker
@@ -40,7 +40,7 @@ class _InsertLinkAction(UndoableAction):
                 experiment.links.add_link(position, previous_position)
             previous_position = position
 
-        cell_error_finder.find_errors_in_positions_links_and_all_dividing_cells(experiment, *self.all_positions)
+        cell_error_finder.find_errors_in_changed_positions(experiment, *self.all_positions)
         return f"Inserted link between {self.all_positions[0]} and {self.all_positions[-1]}"
 
     def undo(self, experiment: Experiment):
@@ -52,7 +52,7 @@ class _InsertLinkAction(UndoableAction):
             for position in self.all_positions[1:-1]:
                 experiment.remove_position(position)
 
-        cell_error_finder.find_errors_in_positions_links_and_all_dividing_cells(experiment, self.all_positions[0], self.all_positions[-1])
+        cell_error_finder.find_errors_in_changed_positions(experiment, self.all_positions[0], self.all_positions[-1])
         return f"Removed link between {self.all_positions[0]} and {self.all_positions[-1]}"
 
 
@@ -66,7 +66,7 @@ class _InsertPositionAction(UndoableAction):
 
     def do(self, experiment: Experiment) -> str:
         self.particle.restore(experiment)
-        cell_error_finder.find_errors_in_positions_links_and_all_dividing_cells(experiment, self.particle.position, *self.particle.links)
+        cell_error_finder.find_errors_in_changed_positions(experiment, self.particle.position, *self.particle.links)
 
         return_value = f"Added {self.particle.position}"
         if len(self.particle.links) > 1:
@@ -78,7 +78,7 @@ class _InsertPositionAction(UndoableAction):
 
     def undo(self, experiment: Experiment) -> str:
         experiment.remove_position(self.particle.position)
-        cell_error_finder.find_errors_in_positions_links_and_all_dividing_cells(experiment, *self.particle.links)
+        cell_error_finder.find_errors_in_changed_positions(experiment, *self.particle.links)
         return f"Removed {self.particle.position}"
 
 
@@ -91,16 +91,15 @@ class _DeletePositionsAction(UndoableAction):
 
     def do(self, experiment: Experiment):
         experiment.remove_positions((particle.position for particle in self._particles))
-        for particle in self._particles:  # Check linked particles for errors
-            cell_error_finder.find_errors_in_just_these_positions(experiment, *particle.links)
-        cell_error_finder.find_errors_in_all_dividing_cells(experiment)
+        linked_positions = [linked_position for particle in self._particles for linked_position in particle.links]
+        cell_error_finder.find_errors_in_changed_positions(experiment, *linked_positions)
         return f"Removed {len(self._particles)} positions"
 
     def undo(self, experiment: Experiment):
         for particle in self._particles:
             particle.restore(experiment)
-            cell_error_finder.find_errors_in_just_these_positions(experiment, particle.position, *particle.links)
-        cell_error_finder.find_errors_in_all_dividing_cells(experiment)
+        cell_error_finder.find_errors_in_changed_positions(experiment,
+                                                           *(particle.position for particle in self._particles))
         return f"Re-added {len(self._particles)} positions"
 
 
@@ -118,12 +117,12 @@ class _MovePositionAction(UndoableAction):
 
     def do(self, experiment: Experiment):
         experiment.move_position(self.old_position, self.new_position)
-        cell_error_finder.find_errors_in_positions_links_and_all_dividing_cells(experiment, self.new_position)
+        cell_error_finder.find_errors_in_changed_positions(experiment, self.new_position)
         return f"Moved {self.old_position} to {self.new_position}"
 
     def undo(self, experiment: Experiment):
         experiment.move_position(self.new_position, self.old_position)
-        cell_error_finder.find_errors_in_positions_links_and_all_dividing_cells(experiment, self.old_position)
+        cell_error_finder.find_errors_in_changed_positions(experiment, self.old_position)
         return f"Moved {self.new_position} back to {self.old_position}"
 
 
@@ -141,14 +140,14 @@ class _MarkLineageEndAction(UndoableAction):
 
     def do(self, experiment: Experiment) -> str:
         linking_markers.set_track_end_marker(experiment.position_data, self.position, self.marker)
-        cell_error_finder.find_errors_in_positions_links_and_all_dividing_cells(experiment, self.position)
+        cell_error_finder.find_errors_in_changed_positions(experiment, self.position)
         if self.marker is None:
             return f"Removed the lineage end marker of {self.position}"
         return f"Added the {self.marker.get_display_name()}-marker to {self.position}"
 
     def undo(self, experiment: Experiment):
         linking_markers.set_track_end_marker(experiment.position_data, self.position, self.old_marker)
-        cell_error_finder.find_errors_in_positions_links_and_all_dividing_cells(experiment, self.position)
+        cell_error_finder.find_errors_in_changed_positions(experiment, self.position)
         if self.old_marker is None:
             return f"Removed the lineage end marker again of {self.position}"
         return f"Re-added the {self.old_marker.get_display_name()}-marker to {self.position}"
@@ -189,6 +188,29 @@ class _ReplaceConnectionsAction(UndoableAction):
         return "Restored the previous connections"
 
 
+class _ReplaceLinksAction(UndoableAction):
+    """Used to replace all links at once, for example after relinking a region."""
+
+    _old_links: Links
+    _new_links: Links
+    _changed_positions: Set[Position]
+
+    def __init__(self, old_links: Links, new_links: Links, changed_positions: Set[Position]):
+        self._old_links = old_links
+        self._new_links = new_links
+        self._changed_positions = changed_positions
+
+    def do(self, experiment: Experiment) -> str:
+        experiment.links = self._new_links
+        cell_error_finder.find_errors_in_changed_positions(experiment, *self._changed_positions)
+        return f"Relinked {len(self._changed_positions)} positions"
+
+    def undo(self, experiment: Experiment) -> str:
+        experiment.links = self._old_links
+        cell_error_finder.find_errors_in_changed_positions(experiment, *self._changed_positions)
+        return f"Restored the previous links of {len(self._changed_positions)} positions"
+
+
 class _SetAllAsType(UndoableAction):
     _previous_position_types: Dict[Position, str]
     _type: Marker
@@ -245,15 +267,15 @@ class _OverwritePositionAction(UndoableAction):
     def do(self, experiment: Experiment) -> str:
         experiment.remove_position(self._old_particle.position)
         self._new_particle.restore(experiment)
-        cell_error_finder.find_errors_in_just_these_positions(experiment, *self._old_particle.links)
-        cell_error_finder.find_errors_in_positions_links_and_all_dividing_cells(experiment, self._new_particle.position)
+        cell_error_finder.find_errors_in_changed_positions(experiment, self._new_particle.position,
+                                                           *self._old_particle.links)
         return f"Overwritten {self._old_particle.position} with {self._new_particle.position}"
 
     def undo(self, experiment: Experiment) -> str:
         experiment.remove_position(self._new_particle.position)
         self._old_particle.restore(experiment)
-        cell_error_finder.find_errors_in_just_these_positions(experiment, *self._new_particle.links)
-        cell_error_finder.find_errors_in_positions_links_and_all_dividing_cells(experiment, self._old_particle.position)
+        cell_error_finder.find_errors_in_changed_positions(experiment, self._old_particle.position,
+                                                           *self._new_particle.links)
         return f"Restored {self._old_particle.position}"
 
 
@@ -266,12 +288,12 @@ class _MarkPositionAsUncertainAction(UndoableAction):
 
     def do(self, experiment: Experiment) -> str:
         linking_markers.set_uncertain(experiment.position_data, self._position, True)
-        cell_error_finder.find_errors_in_just_these_positions(experiment, self._position)
+        cell_error_finder.find_errors_in_changed_positions(experiment, self._position)
         return f"Marked {self._position} as uncertain"
 
     def undo(self, experiment: Experiment) -> str:
         linking_markers.set_uncertain(experiment.position_data, self._position, False)
-        cell_error_finder.find_errors_in_just_these_positions(experiment, self._position)
+        cell_error_finder.find_errors_in_changed_positions(experiment, self._position)
         return f"Marked that {self._position} is no longer uncertain"
 
 
@@ -337,6 +359,7 @@ class LinkAndPositionEditor(AbstractEditor):
             "Edit//Batch-Batch deletion//Delete all positions in a rectangle...": self._show_positions_in_rectangle_deleter,
             "Edit//Batch-Batch deletion//Delete all positions without links...": self._delete_positions_without_links,
             "Edit//Batch-Batch connection//Connect positions by distance...": self._connect_positions_by_distance,
+            "Edit//Batch-Batch linking//Relink around selected position...": self._relink_around_selected_position,
             "Edit//LineageEnd-Mark as cell death [D]": lambda: self._try_set_end_marker(EndMarker.DEAD),
             "Edit//LineageEnd-Mark as cell shedding into lumen [S]": lambda: self._try_set_end_marker(EndMarker.SHED),
             "Edit//LineageEnd-Mark as cell shedding to outside": lambda: self._try_set_end_marker(EndMarker.SHED_OUTSIDE),
@@ -533,6 +556,30 @@ class LinkAndPositionEditor(AbstractEditor):
         self.get_window().redraw_data()
 
 
+    def _relink_around_selected_position(self):
+        """Links all positions near the selected position again, using the same algorithm as the create_links script.
+        Links to positions further away are kept."""
+        if self._selected1 is None or self._selected2 is not None:
+            raise UserError("No cell selected", "You need to select exactly one cell. All cells near that cell will be"
+                                                " linked again.")
+        time_point_count = dialog.prompt_int("Time points", "How many time points before and after the selected"
+                                                            " position should be relinked?", minimum=1, default=5)
+        if time_point_count is None:
+            return
+        radius_um = dialog.prompt_float("Radius", "Up to what distance (μm) from the selected position should cells"
+                                                  " be relinked?", minimum=1, default=20)
+        if radius_um is None:
+            return
+
+        from organoid_tracker.linking import local_relinker
+        selected_time_point_number = self._selected1.time_point_number()
+        region = local_relinker.find_region(self._experiment,
+                                            min_time_point_number=selected_time_point_number - time_point_count,
+                                            max_time_point_number=selected_time_point_number + time_point_count,
+                                            around=[self._selected1], radius_um=radius_um)
+        new_links = local_relinker.relink_region(self._experiment, region)
+        self._perform_action(_ReplaceLinksAction(self._experiment.links, new_links, region))
+
     def _connect_positions_by_distance(self):
         distance_um = dialog.prompt_float("Maximum distance", "Up to what distance (μm) should all positions be"
                                                               " connected?", minimum=0)
@@ -2,9 +2,10 @@
 
 """Creates links between known nucleus positions at different time points. Nucleus shape information (as obtained by
 a Gaussian fit) is necessary for this."""
+import os
 
-from organoid_tracker.config import ConfigFile, config_type_int
-from organoid_tracker.imaging import io
+from organoid_tracker.config import ConfigFile, config_type_int, config_type_bool
+from organoid_tracker.imaging import io, stage_cache
 from organoid_tracker.image_loading import general_image_loader
 from organoid_tracker.linking import nearest_neighbor_linker, dpct_linker, cell_division_finder
 from organoid_tracker.linking.rational_scoring_system import RationalScoringSystem
@@ -38,6 +39,26 @@ _appearance_weight = config.get_or_default("weight_appearance", str(150), commen
 _dissappearance_weight = config.get_or_default("weight_dissappearance", str(100), comment="Penalty for ending a track.",
                                                type=config_type_int)
 _links_output_file = config.get_or_default("output_file", "Automatic links.aut")
+_worker_count = config.get_or_default("worker_processes", str(os.cpu_count() or 1), comment="Number of processes used"
+                                      " to find the possible links, to score the possible divisions and to solve the"
+                                      " linking windows. Not supported on Windows, there a single process is always"
+                                      " used.", type=config_type_int)
+_window_size = config.get_or_default("linking_window_size", str(0), comment="If larger than 0, the links are decided"
+                                    " on windows of this many time points, which are solved in parallel. This is much"
+                                    " faster and uses less memory for long time-lapses, but the result can differ"
+                                    " slightly from solving the whole time-lapse at once.", type=config_type_int)
+_window_overlap = config.get_or_default("linking_window_overlap", str(10), comment="Number of time points that"
+                                       " consecutive windows share. Only used if linking_window_size is larger than"
+                                       " 0.", type=config_type_int)
+_compare_windowed_to_global = config.get_or_default("compare_windowed_to_global", "false", comment="If true and"
+                                                    " windows are used, the whole time-lapse is also solved at once,"
+                                                    " and the number of links that differ between the two is printed.",
+                                                    type=config_type_bool)
+_cache_folder = config.get_or_default("cache_folder", "Linking cache", comment="Folder to store the possible links, the"
+                                     " scores and the final links in, so that they don't need to be calculated again"
+                                     " in the next run if their settings and the positions file didn't change. (The"
+                                     " images are only checked by their folder and file name pattern.) Leave empty to"
+                                     " disable.")
 config.save()
 # END OF PARAMETERS
 
@@ -47,26 +68,62 @@ experiment = io.load_data_file(_positions_file, min_time_point=_min_time_point,
 print("Discovering images...")
 general_image_loader.load_images(experiment, _images_folder, _images_format,
                                  min_time_point=_min_time_point, max_time_point=_max_time_point)
+_possible_links_key = stage_cache.create_key("possible_links", stage_cache.hash_file(_positions_file), _min_time_point,
+                                             _max_time_point, _images_folder, _images_format)
 print("Performing nearest-neighbor linking...")
-possible_links = nearest_neighbor_linker.nearest_neighbor(experiment, tolerance=2)
+possible_links = stage_cache.load_links(_cache_folder, "possible_links", _possible_links_key) if _cache_folder else None
+if possible_links is not None:
+    print("    found possible links in the cache folder, using those instead")
+else:
+    possible_links = nearest_neighbor_linker.nearest_neighbor(experiment, tolerance=2, worker_count=_worker_count)
+    if _cache_folder:
+        stage_cache.save_links(_cache_folder, "possible_links", _possible_links_key, possible_links)
 print("Calculating scores of possible mothers...")
-if experiment.scores.has_family_scores():
+score_system = RationalScoringSystem()
+_scores_key = stage_cache.create_key("scores", _possible_links_key, type(score_system).__name__)
+scores = stage_cache.load_scores(_cache_folder, "scores", _scores_key) if _cache_folder else None
+if scores is not None:
+    print("    found scores in the cache folder, using those instead")
+elif experiment.scores.has_family_scores():
     print("    found existing scores, using those instead")
     scores = experiment.scores
 else:
-    score_system = RationalScoringSystem()
-    scores = cell_division_finder.calculates_scores(experiment.images, experiment.position_data, possible_links, score_system)
+    scores = cell_division_finder.calculates_scores(experiment.images, experiment.position_data, possible_links,
+                                                    score_system, worker_count=_worker_count)
+    if _cache_folder:
+        stage_cache.save_scores(_cache_folder, "scores", _scores_key, scores)
 print("Deciding on what links to use...")
-link_result = dpct_linker.run(experiment.positions, experiment.position_data, possible_links, scores,
-                              experiment.images.resolution(), link_weight=_link_weight,
-                              detection_weight=_detection_weight, division_weight=_division_weight,
-                              appearance_weight=_appearance_weight, dissappearance_weight=_dissappearance_weight)
+_weights = dict(link_weight=_link_weight, detection_weight=_detection_weight, division_weight=_division_weight,
+                appearance_weight=_appearance_weight, dissappearance_weight=_dissappearance_weight)
+_links_key = stage_cache.create_key("links", _scores_key, _weights, _window_size,
+                                    _window_overlap if _window_size > 0 else 0)
+link_result = stage_cache.load_links(_cache_folder, "links", _links_key) if _cache_folder else None
+if link_result is not None:
+    print("    found links for these weights in the cache folder, using those instead")
+else:
+    if _window_size > 0:
+        link_result = dpct_linker.run_windowed(experiment.positions, experiment.position_data, possible_links, scores,
+                                               experiment.images.resolution(), window_size=_window_size,
+                                               window_overlap=_window_overlap, worker_count=_worker_count, **_weights)
+        if _compare_windowed_to_global:
+            print("Deciding on what links to use for the whole time-lapse at once, for comparison...")
+            global_links = set(dpct_linker.run(experiment.positions, experiment.position_data, possible_links, scores,
+                                               experiment.images.resolution(), **_weights).find_all_links())
+            windowed_links = set(link_result.find_all_links())
+            print(f"    {len(windowed_links - global_links)} links were only found using windows,"
+                  f" {len(global_links - windowed_links)} links were only found without windows and"
+                  f" {len(windowed_links & global_links)} links were found by both.")
+    else:
+        link_result = dpct_linker.run(experiment.positions, experiment.position_data, possible_links, scores,
+                                      experiment.images.resolution(), **_weights)
+    if _cache_folder:
+        stage_cache.save_links(_cache_folder, "links", _links_key, link_result)
 print("Applying final touches...")
 experiment.links = link_result
 experiment.scores = scores
 links_postprocessor.postprocess(experiment, margin_xy=_margin_xy)
 print("Checking results for common errors...")
-warning_count = cell_error_finder.find_errors_in_experiment(experiment)
+warning_count = cell_error_finder.find_errors_in_experiment(experiment, vectorized=True)
 print("Writing results to file...")
 io.save_data_to_json(experiment, _links_output_file)
 print(f"Done! Found {warning_count} potential errors in the data.")
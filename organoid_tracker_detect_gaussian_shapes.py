@@ -11,11 +11,15 @@ Parameters: (all sizes are in pixels)
 - gaussian_fit_smooth_size: smoothing size (must be odd) used for fitting Gaussians to the image. The more the image
   already looks like Gaussians, the smaller this size can be
 - min_segmentation_distance: used for recognizing cell boundaries in a watershed transform
+- gaussian_fit_multiscale: first fits on a 2x downsampled (in xy) image, then refines at full resolution
+- max_memory_mb: if set, thresholding and watershedding are done in overlapping tiles to stay within this budget
+- checkpoint_shards_folder: folder where the result of every finished time point is written, so that an interrupted run
+  can be resumed (see resume_from_shards)
 """
 from organoid_tracker.core import TimePoint
 from organoid_tracker.imaging import io
 from organoid_tracker.image_loading import general_image_loader
-from organoid_tracker.config import ConfigFile, config_type_int
+from organoid_tracker.config import ConfigFile, config_type_int, config_type_bool
 from organoid_tracker.position_detection import gaussian_detector_for_experiment
 from organoid_tracker.core.resolution import ImageResolution
 
@@ -43,6 +47,19 @@ _gaussian_fit_smooth_size = config.get_or_default("gaussian_fit_smooth_size", st
                                                   " a smoothed image. This setting controls pixel radius for smoothing."
                                                   " If you have a particulary noisy or high-res image, you will need to"
                                                   " increase this value.", type=config_type_int)
+_gaussian_fit_multiscale = config.get_or_default("gaussian_fit_multiscale", str(False), comment="If True, the"
+                                                 " Gaussians are first fit to an image that is downsampled two times in"
+                                                 " x and y, after which the result is refined at full resolution."
+                                                 " This is faster for large cells.", type=config_type_bool)
+_max_memory_mb = config.get_or_default("max_memory_mb", "", comment="Maximum amount of memory (in megabytes) used for"
+                                      " the thresholding and watershed steps. If set, these steps are done in"
+                                      " overlapping tiles. Leave empty to process entire images at once.")
+_max_memory_mb = float(_max_memory_mb) if _max_memory_mb else None
+_shards_folder = config.get_or_default("checkpoint_shards_folder", "", comment="If you paste a folder path here, the"
+                                      " results of every time point are written to that folder as soon as they are"
+                                      " finished. If the script is interrupted, you can then resume it.")
+_resume = config.get_or_default("resume_from_shards", str(True), comment="If True, time points that already have"
+                                " results in the checkpoint shards folder are skipped.", type=config_type_bool)
 config.save_and_exit_if_changed()
 # END OF PARAMETERS
 
@@ -51,10 +68,21 @@ experiment = io.load_data_file(_positions_input_file, min_time_point=_min_time_p
 print("Discovering images...")
 general_image_loader.load_images(experiment, _images_folder, _images_format,
                                  min_time_point=_min_time_point, max_time_point=_max_time_point)
+_time_points = list(experiment.time_points())
+if _shards_folder and _resume:
+    _finished_time_points = io.find_time_points_with_shards(_shards_folder)
+    if len(_finished_time_points) > 0:
+        print(f"Resuming: loading {len(_finished_time_points)} finished time points...")
+        io.load_time_point_shards(experiment, _shards_folder, min_time_point=_min_time_point,
+                                  max_time_point=_max_time_point)
+        _time_points = [time_point for time_point in _time_points if time_point not in _finished_time_points]
 print("Running detection...")
 def _autosave(time_point: TimePoint):
-    """To protect against crashes, we save the result every five time points."""
-    if time_point.time_point_number() % 5 == 0:
+    """To protect against crashes, we save the result of every time point as a shard, or if no shards folder was given,
+    the full result every five time points."""
+    if _shards_folder:
+        io.save_time_point_shard(experiment, time_point, _shards_folder)
+    elif time_point.time_point_number() % 5 == 0:
         print("Saving...")
         io.save_data_to_json(experiment, _positions_output_file)
 
@@ -62,7 +90,9 @@ def _autosave(time_point: TimePoint):
 gaussian_detector_for_experiment.perform_for_experiment(experiment, threshold_block_size=_threshold_block_size,
                                                         gaussian_fit_smooth_size=_gaussian_fit_smooth_size,
                                                         cluster_detection_erosion_rounds=_cluster_detection_erosion_rounds,
-                                                        call_after_time_point=_autosave)
+                                                        call_after_time_point=_autosave,
+                                                        multiscale=_gaussian_fit_multiscale,
+                                                        time_points=_time_points, max_memory_mb=_max_memory_mb)
 
 print("Saving...")
 io.save_data_to_json(experiment, _positions_output_file)
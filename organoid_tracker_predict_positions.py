@@ -1,7 +1,12 @@
 """Predictions particle positions using an already-trained convolutional neural network."""
 
+import os
+from typing import List
+
 from organoid_tracker.config import ConfigFile, config_type_bool
+from organoid_tracker.core import TimePoint
 from organoid_tracker.core.experiment import Experiment
+from organoid_tracker.core.position import Position
 from organoid_tracker.image_loading.channel_merging_image_loader import ChannelMergingImageLoader
 from organoid_tracker.imaging import io
 from organoid_tracker.image_loading import general_image_loader
@@ -27,16 +32,51 @@ _checkpoint_folder = config.get_or_prompt("checkpoint_folder", "Please paste the
 _output_file = config.get_or_default("positions_output_file", "Automatic positions.aut", comment="Output file for the positions, can be viewed using the visualizer program.")
 _channels_str = config.get_or_default("images_channels", str(1), comment="Index(es) of the channels to use. Use \"3\" to use the third channel for predictions. Use \"1,3,4\" to use the sum of the first, third and fourth channel for predictions.")
 _images_channels = {int(part) for part in _channels_str.split(",")}
-_mid_layers = int(config.get_or_default("mid_layers", str(5), comment="Number of layers to interpolate in between"
-                                        " z-planes. Used to improve peak finding."))
+_mid_layers = int(config.get_or_default("mid_layers", str(5), comment="Size of a pixel in z divided by its size in x"
+                                        " and y, minus one. Used to scale the minimal distance between positions in"
+                                        " the z direction."))
 _peak_min_distance_px = int(config.get_or_default("peak_min_distance_px", str(9), comment="Minimum distance in pixels"
                                                   " between detected positions."))
 _split = config.get_or_default("save_video_ram", "true", comment="Whether video RAM should be saved by splitting"
                                                                  " the images into smaller parts, and processing"
                                                                  " each part independently.", type=config_type_bool)
+_max_memory_mb = config.get_or_default("max_memory_mb", "", comment="If you enter an amount of memory in megabytes"
+                                       " here, the images are only split if they don't fit in this amount of (video)"
+                                       " memory, and the parts are made as large as possible. save_video_ram is then"
+                                       " ignored.")
+_max_memory_mb = float(_max_memory_mb) if len(_max_memory_mb) > 0 else None
 _debug_folder = config.get_or_default("predictions_output_folder", "", comment="If you want to see the raw prediction images, paste the path to a folder here. In that folder, a prediction image will be placed for each time point.")
 if len(_debug_folder) == 0:
     _debug_folder = None
+_debug_compression = config.get_or_default("predictions_output_compression", "1", comment="Compression of the raw"
+                                           " prediction images. Either a zlib level from 0 (none) to 9 (smallest files,"
+                                           " but very slow), or a codec name like lzma, optionally followed by a colon"
+                                           " and a level, like zstd:3.")
+if _debug_compression.isdigit():
+    _debug_compression = int(_debug_compression)
+elif ":" in _debug_compression:
+    _debug_compression = (_debug_compression.split(":")[0], int(_debug_compression.split(":")[1]))
+_worker_threads = int(config.get_or_default("worker_threads", str(os.cpu_count() or 1), comment="Number of threads used"
+                                            " to load images of upcoming time points, and to find the positions in the"
+                                            " predictions of finished time points. Only a few images are"
+                                            " loaded in advance, so more threads don't use more memory."))
+_batch_size = int(config.get_or_default("prediction_batch_size", str(1), comment="Number of images (or image parts, if"
+                                        " save_video_ram is true) that are sent through the network at once. On a"
+                                        " CPU, a higher number can be faster."))
+_shards_folder = config.get_or_default("checkpoint_shards_folder", "", comment="If you paste a folder path here, the"
+                                      " positions of every time point are written to that folder as soon as they are"
+                                      " predicted. If the script is interrupted, you can then resume it.")
+_resume = config.get_or_default("resume_from_shards", str(True), comment="If True, time points that already have"
+                                " positions in the checkpoint shards folder are skipped.", type=config_type_bool)
+_resume_from_output = config.get_or_default("resume_from_output_file", str(True), comment="If True and the output file"
+                                            " already exists, time points that already have positions in that file are"
+                                            " skipped. Useful if more images have been recorded since the last run."
+                                            " (Time points without any positions are predicted again.)",
+                                            type=config_type_bool)
+_save_every_n_time_points = int(config.get_or_default("save_output_every_n_time_points", str(10), comment="The output"
+                                                      " file is saved after this many new time points have been"
+                                                      " predicted, so that an interrupted run can be resumed. Use 0"
+                                                      " to only save at the end."))
 config.save()
 # END OF PARAMETERS
 
@@ -54,10 +94,46 @@ if _images_channels != {1}:
     channel_merging_image_loader = ChannelMergingImageLoader(experiment.images.image_loader(), [new_channels])
     experiment.images.image_loader(channel_merging_image_loader)
 
+_time_points = list(experiment.images.time_points())
+_finished_time_points = set()
+if _resume_from_output and os.path.exists(_output_file):
+    io.load_data_file(_output_file, min_time_point=_min_time_point, max_time_point=_max_time_point,
+                      experiment=experiment)
+    _finished_time_points |= set(experiment.positions.time_points())
+if _shards_folder and _resume:
+    _shard_time_points = io.find_time_points_with_shards(_shards_folder)
+    if len(_shard_time_points) > 0:
+        io.load_time_point_shards(experiment, _shards_folder, min_time_point=_min_time_point,
+                                  max_time_point=_max_time_point)
+        _finished_time_points |= _shard_time_points
+if len(_finished_time_points) > 0:
+    _time_points = [time_point for time_point in _time_points if time_point not in _finished_time_points]
+    print(f"Resuming: skipping {len(_finished_time_points)} finished time points, {len(_time_points)} time points"
+          f" left to predict.")
+
+_unsaved_time_point_count = 0
+
+
+def _after_time_point(time_point: TimePoint, positions: List[Position]):
+    """To protect against crashes, we save the result of every time point as a shard, and we regularly update the output
+    file."""
+    global _unsaved_time_point_count
+    for position in positions:
+        experiment.positions.add(position)
+    if _shards_folder:
+        io.save_time_point_shard(experiment, time_point, _shards_folder)
+    _unsaved_time_point_count += 1
+    if _save_every_n_time_points > 0 and _unsaved_time_point_count >= _save_every_n_time_points:
+        io.save_data_to_json(experiment, _output_file)
+        _unsaved_time_point_count = 0
+
+
 print("Using neural networks to predict positions...")
-positions = predicter.predict(experiment.images, _checkpoint_folder, split=_split, out_dir=_debug_folder,
-                              mid_layers_nb=_mid_layers, min_peak_distance_px=_peak_min_distance_px)
-experiment.positions.add_positions(positions)
+predicter.predict(experiment.images, _checkpoint_folder, split=_split, out_dir=_debug_folder,
+                  mid_layers_nb=_mid_layers, min_peak_distance_px=_peak_min_distance_px,
+                  time_points=_time_points, call_after_time_point=_after_time_point,
+                  worker_count=_worker_threads, batch_size=_batch_size,
+                  max_memory_mb=_max_memory_mb, out_compression=_debug_compression)
 
 print("Saving file...")
 io.save_data_to_json(experiment, _output_file)
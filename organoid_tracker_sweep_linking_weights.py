@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+"""Tries many combinations of weights for the linker, and compares every result to ground truth links. The possible
+links and the scores of the possible divisions are only calculated once. The output is a table of all combinations of
+weights, ranked from best to worst. Use the best weights in the create_links script."""
+import os
+from typing import List
+
+from organoid_tracker.config import ConfigFile, config_type_int, config_type_float
+from organoid_tracker.core import UserError
+from organoid_tracker.image_loading import general_image_loader
+from organoid_tracker.imaging import io, stage_cache
+from organoid_tracker.linking import nearest_neighbor_linker, cell_division_finder, linking_weight_sweep
+from organoid_tracker.linking.rational_scoring_system import RationalScoringSystem
+
+
+def _config_type_int_list(input: str) -> List[int]:
+    """Parses a string like "10, 20, 30" as a list of integers."""
+    return [int(value) for value in input.split(",")]
+
+
+# PARAMETERS
+print("Hi! Configuration file is stored at " + ConfigFile.FILE_NAME)
+config = ConfigFile("sweep_linking_weights")
+_images_folder = config.get_or_prompt("images_container", "If you have a folder of image files, please paste the folder"
+                                      " path here. Else, if you have a LIF file, please paste the path to that file"
+                                      " here.", store_in_defaults=True)
+_images_format = config.get_or_prompt("images_pattern", "What are the image file names? (Use {time:03} for three digits"
+                                      " representing the time point, use {channel} for the channel)",
+                                      store_in_defaults=True)
+_min_time_point = int(config.get_or_default("min_time_point", str(1), store_in_defaults=True))
+_max_time_point = int(config.get_or_default("max_time_point", str(9999), store_in_defaults=True))
+_positions_file = config.get_or_default("positions_file", "Gaussian fitted positions.aut")
+_ground_truth_file = config.get_or_prompt("ground_truth_file", "In what file are the correct links stored?")
+_link_weights = config.get_or_default("weights_links", "10, 20, 40", comment="Comma-separated values to try for"
+                                      " weight_links of the create_links script.", type=_config_type_int_list)
+_detection_weights = config.get_or_default("weights_detections", "100, 150, 200", comment="Comma-separated values to"
+                                           " try for weight_detections.", type=_config_type_int_list)
+_division_weights = config.get_or_default("weights_division", "20, 30, 40", comment="Comma-separated values to try for"
+                                          " weight_division.", type=_config_type_int_list)
+_appearance_weights = config.get_or_default("weights_appearance", "150", comment="Comma-separated values to try for"
+                                            " weight_appearance.", type=_config_type_int_list)
+_dissappearance_weights = config.get_or_default("weights_dissappearance", "100", comment="Comma-separated values to"
+                                                " try for weight_dissappearance.", type=_config_type_int_list)
+_max_distance_um = config.get_or_default("max_distance_um", str(5), type=config_type_float, comment="Maximum distance"
+                                         " between positions in the ground truth and in the results for them to be"
+                                         " considered equal.")
+_worker_count = config.get_or_default("worker_processes", str(os.cpu_count() or 1), comment="Number of processes used"
+                                      " to find the possible links, to score the possible divisions and to try the"
+                                      " weights. Not supported on Windows, there a single process is always used.",
+                                      type=config_type_int)
+_cache_folder = config.get_or_default("cache_folder", "Linking cache", comment="Folder to store the possible links and"
+                                      " the scores in. If you use the same folder as for the create_links script, the"
+                                      " possible links and scores are shared. Leave empty to disable.")
+_output_file = config.get_or_default("output_file", "Linking weights.tsv")
+config.save()
+# END OF PARAMETERS
+
+
+print("Loading cell positions and shapes...", _positions_file)
+experiment = io.load_data_file(_positions_file, min_time_point=_min_time_point, max_time_point=_max_time_point)
+print("Discovering images...")
+general_image_loader.load_images(experiment, _images_folder, _images_format,
+                                 min_time_point=_min_time_point, max_time_point=_max_time_point)
+print("Loading ground truth...", _ground_truth_file)
+ground_truth = io.load_data_file(_ground_truth_file, min_time_point=_min_time_point, max_time_point=_max_time_point)
+try:
+    ground_truth.images.resolution()
+except UserError:
+    ground_truth.images.set_resolution(experiment.images.resolution())
+
+# Same keys as in the create_links script, so that the results of that script can be reused
+_possible_links_key = stage_cache.create_key("possible_links", stage_cache.hash_file(_positions_file), _min_time_point,
+                                             _max_time_point, _images_folder, _images_format)
+print("Performing nearest-neighbor linking...")
+possible_links = stage_cache.load_links(_cache_folder, "possible_links", _possible_links_key) if _cache_folder else None
+if possible_links is not None:
+    print("    found possible links in the cache folder, using those instead")
+else:
+    possible_links = nearest_neighbor_linker.nearest_neighbor(experiment, tolerance=2, worker_count=_worker_count)
+    if _cache_folder:
+        stage_cache.save_links(_cache_folder, "possible_links", _possible_links_key, possible_links)
+print("Calculating scores of possible mothers...")
+score_system = RationalScoringSystem()
+_scores_key = stage_cache.create_key("scores", _possible_links_key, type(score_system).__name__)
+scores = stage_cache.load_scores(_cache_folder, "scores", _scores_key) if _cache_folder else None
+if scores is not None:
+    print("    found scores in the cache folder, using those instead")
+elif experiment.scores.has_family_scores():
+    print("    found existing scores, using those instead")
+    scores = experiment.scores
+else:
+    scores = cell_division_finder.calculates_scores(experiment.images, experiment.position_data, possible_links,
+                                                    score_system, worker_count=_worker_count)
+    if _cache_folder:
+        stage_cache.save_scores(_cache_folder, "scores", _scores_key, scores)
+
+weights_list = linking_weight_sweep.create_weight_grid(
+    link_weights=_link_weights, detection_weights=_detection_weights, division_weights=_division_weights,
+    appearance_weights=_appearance_weights, dissappearance_weights=_dissappearance_weights)
+print(f"Trying {len(weights_list)} combinations of weights...")
+results = linking_weight_sweep.sweep(experiment, possible_links, scores, ground_truth, weights_list,
+                                     max_distance_um=_max_distance_um, worker_count=_worker_count)
+table = linking_weight_sweep.format_table(results)
+print("Writing results to file...")
+with open(_output_file, "w") as handle:
+    handle.write(table)
+print(table)
+print("Done! Best weights:", results[0].weights if len(results) > 0 else None)
@@ -5,7 +5,7 @@ from typing import Set, Tuple
 from os import path
 import os
 
-from organoid_tracker.config import ConfigFile, config_type_image_shape, config_type_int
+from organoid_tracker.config import ConfigFile, config_type_image_shape, config_type_int, config_type_bool
 from organoid_tracker.core.experiment import Experiment
 from organoid_tracker.image_loading.channel_merging_image_loader import ChannelMergingImageLoader
 from organoid_tracker.imaging import io
@@ -81,6 +81,17 @@ batch_size = config.get_or_default("batch_size", "64", comment="How many patches
 max_training_steps = config.get_or_default("max_training_steps", "100000", comment="For how many iterations the network"
                                            " is trained. Larger is not always better; at some point the network might"
                                            " get overfitted to your training data.", type=config_type_int)
+use_patches = config.get_or_default("precompute_patches", "false", comment="If true, patches are cut out of the images"
+                                    " in advance, with extra patches around the nuclei. This makes training faster, as"
+                                    " the training data is much quicker to read.", type=config_type_bool)
+patches_per_image = config.get_or_default("patches_per_image", "64", comment="If precompute_patches is true, this is"
+                                          " the number of patches that are cut out of every image.",
+                                          type=config_type_int)
+input_threads = config.get_or_default("input_threads", str(os.cpu_count() or 1), comment="Number of threads used to"
+                                      " read the training data.", type=config_type_int)
+cache_folder = config.get_or_default("input_cache_folder", "", comment="If you paste a folder path here (preferably on"
+                                     " a fast, local disk), the training data is cached there after it has been read"
+                                     " once. This needs a lot of disk space.")
 config.save_and_exit_if_changed()
 # END OF PARAMETERS
 
@@ -91,15 +102,23 @@ experiment_provider = (params.to_experiment() for params in per_experiment_param
 print("Note: this script can easily take several hours or even days to complete.")
 print("Creating training files...")
 checkpoint_dir = path.join(output_folder, "checkpoints")
-tfrecord_dir = path.join(output_folder, "tfrecord")
+tfrecord_dir = path.join(output_folder, "tfrecord_patches" if use_patches else "tfrecord")
 if not path.exists(tfrecord_dir):
-    training_data_creator.create_training_data(experiment_provider, out_dir=tfrecord_dir, image_size_zyx=image_shape)
+    if use_patches:
+        training_data_creator.create_patch_training_data(experiment_provider, out_dir=tfrecord_dir,
+                                                         patch_size_zyx=patch_shape,
+                                                         patches_per_image=patches_per_image)
+    else:
+        training_data_creator.create_training_data(experiment_provider, out_dir=tfrecord_dir,
+                                                   image_size_zyx=image_shape)
 else:
     print("   Skipped! Already found a tfrecord directory, assuming it's good.")
 
 print("Training...")
 trainer.train(tfrecord_dir, checkpoint_dir, patch_size_zyx=patch_shape, image_size_zyx=image_shape,
-              batch_size=batch_size, max_steps=max_training_steps, use_cpu_output=False)
+              batch_size=batch_size, max_steps=max_training_steps, use_cpu_output=False,
+              use_patches=use_patches, num_parallel_calls=input_threads,
+              cache_dir=cache_folder if len(cache_folder) > 0 else None)
 
 print("")
 print("Done! Was it worth the wait?")
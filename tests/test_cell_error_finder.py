@@ -0,0 +1,114 @@
+import random
+import unittest
+from typing import Dict, Optional
+
+from organoid_tracker.core.experiment import Experiment
+from organoid_tracker.core.position import Position
+from organoid_tracker.core.gaussian import Gaussian
+from organoid_tracker.core.resolution import ImageResolution
+from organoid_tracker.core.shape import GaussianShape, UnknownShape
+from organoid_tracker.linking_analysis import cell_error_finder, linking_markers, vectorized_cell_error_finder
+from organoid_tracker.linking_analysis.errors import Error
+from organoid_tracker.linking_analysis.linking_markers import EndMarker
+
+
+def _create_experiment() -> Experiment:
+    """Creates a cell that divides, after which both daughters divide again."""
+    experiment = Experiment()
+    experiment.images.set_resolution(ImageResolution(1, 1, 5, 12))
+    mother = [Position(0, 0, 0, time_point_number=t) for t in range(0, 10)]
+    daughter_1 = [Position(-t, 0, 0, time_point_number=t) for t in range(10, 20)]
+    daughter_2 = [Position(t, 0, 0, time_point_number=t) for t in range(10, 20)]
+    for track in [mother, daughter_1, daughter_2]:
+        for position in track:
+            experiment.positions.add(position)
+            linking_markers.set_mother_score(experiment.position_data, position, 2)
+        for position1, position2 in zip(track[:-1], track[1:]):
+            experiment.links.add_link(position1, position2)
+    experiment.links.add_link(mother[-1], daughter_1[0])
+    experiment.links.add_link(mother[-1], daughter_2[0])
+    return experiment
+
+
+def _create_random_experiment(seed: int) -> Experiment:
+    """Creates randomly moving cells that sometimes divide or disappear, with random shapes and markers."""
+    rnd = random.Random(seed)
+    experiment = Experiment()
+    experiment.images.set_resolution(ImageResolution(1, 1, 5, 12))
+    cells = [Position(rnd.uniform(0, 100), rnd.uniform(0, 100), rnd.uniform(0, 10), time_point_number=1)
+             for _ in range(15)]
+    for cell in cells:
+        experiment.positions.add(cell)
+    for time_point_number in range(2, 26):
+        new_cells = []
+        for cell in cells:
+            if rnd.random() < 0.04:
+                continue  # Cell disappears
+            for _ in range(2 if rnd.random() < 0.06 else 1):
+                new_cell = Position(cell.x + rnd.uniform(-12, 12), cell.y + rnd.uniform(-12, 12), cell.z,
+                                    time_point_number=time_point_number)
+                experiment.positions.add(new_cell)
+                experiment.links.add_link(cell, new_cell)
+                new_cells.append(new_cell)
+        cells = new_cells
+
+    for position in list(experiment.positions):
+        if rnd.random() < 0.1:
+            shape = UnknownShape(is_failed=rnd.random() < 0.5)
+        else:
+            shape = GaussianShape(Gaussian(200, 0, 0, 0, rnd.choice([1, 5, 30]), 25, 2, 0, 0, 0))
+        linking_markers.set_shape(experiment.position_data, position, shape)
+        linking_markers.set_mother_score(experiment.position_data, position, rnd.choice([-1, 2, 3]))
+        if rnd.random() < 0.03:
+            linking_markers.set_uncertain(experiment.position_data, position, True)
+        if rnd.random() < 0.05:
+            linking_markers.set_track_end_marker(experiment.position_data, position, rnd.choice(list(EndMarker)))
+    return experiment
+
+
+def _get_errors(experiment: Experiment) -> Dict[Position, Optional[Error]]:
+    return {position: linking_markers.get_error_marker(experiment.position_data, position)
+            for position in experiment.positions}
+
+
+class TestCellErrorFinder(unittest.TestCase):
+
+    def _assert_same_as_full_check(self, experiment: Experiment):
+        cell_error_finder.find_errors_in_changed_positions(experiment)
+        errors_incremental = _get_errors(experiment)
+        cell_error_finder.find_errors_in_experiment(experiment)
+        self.assertEqual(_get_errors(experiment), errors_incremental)
+
+    def test_changed_positions(self):
+        experiment = _create_experiment()
+        cell_error_finder.find_errors_in_experiment(experiment)
+        cell_error_finder.find_errors_in_changed_positions(experiment)  # Starts recording changes
+
+        # Add a division shortly after the first division, so the cell is a young mother
+        young_mother = Position(-15, 0, 0, time_point_number=15)
+        new_daughter = Position(-16, 1, 0, time_point_number=16)
+        experiment.positions.add(new_daughter)
+        experiment.links.add_link(young_mother, new_daughter)
+        self._assert_same_as_full_check(experiment)
+        self.assertEqual(Error.YOUNG_MOTHER, linking_markers.get_error_marker(experiment.position_data, young_mother))
+
+        # Remove the first division, far away from the young mother
+        experiment.links.remove_link(Position(0, 0, 0, time_point_number=9), Position(10, 0, 0, time_point_number=10))
+        self._assert_same_as_full_check(experiment)
+        self.assertNotEqual(Error.YOUNG_MOTHER, linking_markers.get_error_marker(experiment.position_data,
+                                                                                 young_mother))
+
+        # Remove a position in the middle of a track
+        experiment.remove_position(Position(-12, 0, 0, time_point_number=12))
+        self._assert_same_as_full_check(experiment)
+
+        # Mark a position as uncertain
+        linking_markers.set_uncertain(experiment.position_data, Position(0, 0, 0, time_point_number=3), True)
+        self._assert_same_as_full_check(experiment)
+
+    def test_vectorized_same_as_per_position(self):
+        for seed in range(5):
+            experiment = _create_random_experiment(seed)
+            expected = [(position, cell_error_finder.get_error(experiment, position))
+                        for position in experiment.positions]
+            self.assertEqual(expected, vectorized_cell_error_finder.get_errors(experiment))
@@ -0,0 +1,122 @@
+import sys
+import types
+import unittest
+from typing import Dict
+from unittest import mock
+
+try:
+    import dpct
+except ImportError:
+    # dpct.trackFlowBased is replaced by a stand-in solver in these tests, so the dpct package itself is never used
+    sys.modules["dpct"] = types.ModuleType("dpct")
+
+from organoid_tracker.core.links import Links
+from organoid_tracker.core.position import Position
+from organoid_tracker.core.position_collection import PositionCollection
+from organoid_tracker.core.position_data import PositionData
+from organoid_tracker.core.resolution import ImageResolution
+from organoid_tracker.core.score import ScoreCollection
+from organoid_tracker.linking import dpct_linker
+
+
+_LAST_TIME_POINT_NUMBER = 29
+
+
+def _create_links() -> Links:
+    """Creates three cells that move slowly from time point 0 to 29. One of them divides at time point 15."""
+    links = Links()
+    for y in [0, 20, 40]:
+        for t in range(0, _LAST_TIME_POINT_NUMBER):
+            links.add_link(Position(t * 0.1, y, 0, time_point_number=t),
+                           Position((t + 1) * 0.1, y, 0, time_point_number=t + 1))
+    for t in range(16, _LAST_TIME_POINT_NUMBER):
+        links.add_link(Position(t * 0.1, 10, 0, time_point_number=t),
+                       Position((t + 1) * 0.1, 10, 0, time_point_number=t + 1))
+    links.add_link(Position(1.5, 0, 0, time_point_number=15), Position(1.6, 10, 0, time_point_number=16))
+    return links
+
+
+def _stand_in_solver(input: Dict, weights: Dict) -> Dict:
+    """Stand-in for dpct.trackFlowBased. Detects all links, except those that start in the first time point or end in
+    the last time point of a window. (So just like the real solver, it's unreliable at the borders of a window.)"""
+    time_point_numbers = {hypothesis["id"]: hypothesis["timestep"][0] for hypothesis in input["segmentationHypotheses"]}
+    first_time_point_number = min(time_point_numbers.values())
+    if first_time_point_number == 0:
+        first_time_point_number = None  # Start of the time-lapse, not of a window
+    last_time_point_number = max(time_point_numbers.values())
+    if last_time_point_number == _LAST_TIME_POINT_NUMBER:
+        last_time_point_number = None  # End of the time-lapse, not of a window
+    return {"linkingResults": [
+        {"src": hypothesis["src"], "dest": hypothesis["dest"],
+         "value": 0 if time_point_numbers[hypothesis["src"]] == first_time_point_number
+                       or time_point_numbers[hypothesis["dest"]] == last_time_point_number else 1}
+        for hypothesis in input["linkingHypotheses"]]}
+
+
+class TestDpctLinker(unittest.TestCase):
+
+    def test_get_windows(self):
+        self.assertEqual([(0, 9), (6, 15), (12, 21), (18, 27), (24, 29)], dpct_linker._get_windows(0, 29, 10, 4))
+        self.assertEqual([(3, 8)], dpct_linker._get_windows(3, 8, 10, 4))
+        self.assertRaises(ValueError, dpct_linker._get_windows, 0, 29, 10, 1)
+        self.assertRaises(ValueError, dpct_linker._get_windows, 0, 29, 4, 4)
+
+    def test_get_window_cut(self):
+        # Time points 6, 7, 8 and 9 are in both windows, so the links 6-7, 7-8 and 8-9 are in both windows. The middle
+        # one is taken from the second window.
+        self.assertEqual(7, dpct_linker._get_window_cut((0, 9), (6, 15)))
+        self.assertEqual(8, dpct_linker._get_window_cut((0, 9), (7, 15)))
+
+    def test_split_links_into_windows(self):
+        links = _create_links()
+        windows = dpct_linker._create_windows(0, _LAST_TIME_POINT_NUMBER, 10, 4)
+        dpct_linker._split_links_into_windows(links, windows)
+
+        for window in windows:
+            expected = {(position1, position2) for position1, position2 in links.find_all_links()
+                        if position1.time_point_number() >= window.first_time_point_number
+                        and position2.time_point_number() <= window.last_time_point_number}
+            self.assertEqual(expected, set(window.links))
+
+    def test_every_link_owned_by_one_window(self):
+        links = _create_links()
+        windows = dpct_linker._create_windows(0, _LAST_TIME_POINT_NUMBER, 10, 4)
+        dpct_linker._split_links_into_windows(links, windows)
+
+        position_ids = dpct_linker._PositionToId()
+        results = {"linkingResults": [{"src": position_ids.id(position1), "dest": position_ids.id(position2),
+                                       "value": 1} for position1, position2 in links.find_all_links()]}
+        owned_links = [link for window in windows
+                       for link in dpct_linker._find_detected_links(position_ids, results,
+                                                                    window.min_owned_time_point_number,
+                                                                    window.max_owned_time_point_number)]
+        self.assertEqual(len(links), len(owned_links))
+        self.assertEqual(set(links.find_all_links()), set(owned_links))
+
+        # A link crossing the cut between the first two windows is in both windows, but only used from the first
+        crossing_link = (Position(0.7, 0, 0, time_point_number=7), Position(0.8, 0, 0, time_point_number=8))
+        self.assertIn(crossing_link, windows[0].links)
+        self.assertIn(crossing_link, windows[1].links)
+        self.assertEqual(1, owned_links.count(crossing_link))
+
+    def _run_windowed(self, links: Links, worker_count: int) -> Links:
+        positions = PositionCollection()
+        for position in links.find_all_positions():
+            positions.add(position)
+        with mock.patch.object(dpct_linker.dpct, "trackFlowBased", _stand_in_solver, create=True):
+            return dpct_linker.run_windowed(positions, PositionData(), links, ScoreCollection(),
+                                            ImageResolution(1, 1, 5, 12), link_weight=1, detection_weight=1,
+                                            division_weight=1, appearance_weight=1, dissappearance_weight=1,
+                                            window_size=10, window_overlap=4, worker_count=worker_count)
+
+    def test_run_windowed(self):
+        links = _create_links()
+
+        # Every window misses the links on its borders, but those are taken from the neighboring windows
+        result = self._run_windowed(links, worker_count=1)
+        self.assertEqual(set(links.find_all_links()), set(result.find_all_links()))
+
+    def test_run_windowed_in_two_processes(self):
+        links = _create_links()
+        self.assertEqual(set(self._run_windowed(links, worker_count=1).find_all_links()),
+                         set(self._run_windowed(links, worker_count=2).find_all_links()))
@@ -1,9 +1,11 @@
 import unittest
 
+import numpy
+
 from organoid_tracker.core import TimePoint
 from organoid_tracker.core.position import Position
 from organoid_tracker.core.resolution import ImageResolution
-from organoid_tracker.linking.nearby_position_finder import find_close_positions
+from organoid_tracker.linking.nearby_position_finder import find_close_positions, find_close_positions_batched
 
 
 _PX_RESOLUTION = ImageResolution(1, 1, 1, 1)
@@ -37,3 +39,16 @@ class TestFindNearestFew(unittest.TestCase):
         positions.add(Position(100, 20, 0, time_point=time_point))
         found = find_close_positions(positions, around=Position(40, 20, 0), tolerance=1, resolution=_PX_RESOLUTION)
         self.assertEqual(1, len(found), "Tolerance is set to 1.0, so only one position may be found")
+
+    def test_batched(self):
+        numpy.random.seed(1949)
+        resolution = ImageResolution(0.32, 0.32, 2, 12)
+        positions = [Position(*numpy.random.uniform(0, 100, size=3)) for i in range(200)]
+        around = [Position(*numpy.random.uniform(0, 100, size=3)) for i in range(50)]
+
+        found_batched = find_close_positions_batched(positions, around=around, tolerance=1.5, max_amount=5,
+                                                     resolution=resolution)
+        for around_position, found in zip(around, found_batched):
+            expected = find_close_positions(positions, around=around_position, tolerance=1.5, max_amount=5,
+                                            resolution=resolution)
+            self.assertEqual(set(expected), set(found))
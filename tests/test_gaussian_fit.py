@@ -83,6 +83,24 @@ class TestGaussianFit(unittest.TestCase):
         self.assertTrue(gaussian1.almost_equal(fitted1, a_delta=10, mu_delta=2, cov_delta=9))
         # The second Gaussian is hopeless - it is expanded to also cover the third Gaussian
 
+    def test_multiscale_single_gaussian(self):
+        gaussian = Gaussian(200, mu_x=30, mu_y=25, mu_z=10, cov_xx=60, cov_yy=40, cov_zz=5, cov_xy=10, cov_xz=0,
+                            cov_yz=0)
+
+        image = numpy.zeros((20, 60, 61), numpy.float32)
+        gaussian.draw(image)
+        gaussian_fit.add_noise(image)
+
+        hint = Gaussian(205, mu_x=28, mu_y=27, mu_z=10, cov_xx=10, cov_yy=10, cov_zz=1, cov_xy=0, cov_xz=0, cov_yz=0)
+        fitted = gaussian_fit.perform_gaussian_mixture_fit_multiscale(image, [hint])[0]
+        self.assertTrue(gaussian.almost_equal(fitted))
+
+    def test_scaled_xy(self):
+        gaussian = Gaussian(200, mu_x=30, mu_y=25, mu_z=10, cov_xx=60, cov_yy=40, cov_zz=5, cov_xy=10, cov_xz=2,
+                            cov_yz=1)
+        self.assertTrue(gaussian.almost_equal(gaussian.scaled_xy(0.5).scaled_xy(2), a_delta=0.001, mu_delta=0.001,
+                                              cov_delta=0.001))
+
     @unittest.skip("takes one minute to execute")
     def test_big_image(self):
         gaussians = [
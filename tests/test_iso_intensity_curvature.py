@@ -1,11 +1,14 @@
+import os
 import unittest
+from timeit import default_timer
 from typing import Tuple
 
 import math
 import numpy
 from numpy import ndarray
 
-from organoid_tracker.position_detection.iso_intensity_curvature import get_negative_gaussian_curvatures, ImageDerivatives
+from organoid_tracker.position_detection.iso_intensity_curvature import get_negative_gaussian_curvatures, ImageDerivatives, \
+    get_negative_gaussian_curvatures_in_slabs
 
 SQRT_OF_2PI = math.sqrt(2 * math.pi)
 
@@ -24,6 +27,17 @@ def _1d_gaussian(x, mean, sd):
     return 1 / (sd * SQRT_OF_2PI) * math.exp(-0.5 * ((x - mean) / sd) ** 2)
 
 
+def _create_larger_image() -> ndarray:
+    """Creates an image of 20x150x150 pixels with six Gaussians at random (but fixed) places."""
+    numpy.random.seed(1949)
+    array = numpy.zeros((20, 150, 150), dtype=numpy.uint8)
+    for i in range(6):
+        x, y, z = numpy.random.uniform(10, 140), numpy.random.uniform(10, 140), numpy.random.uniform(3, 17)
+        _add_3d_gaussian(array[int(z) - 8:int(z) + 8, int(y) - 20:int(y) + 20, int(x) - 20:int(x) + 20],
+                         intensity=60000, mean=(20, 20, 8), sd=(6, 6, 3))
+    return array
+
+
 class TestIsoIntensityCurvature(unittest.TestCase):
 
     def test(self):
@@ -39,3 +53,50 @@ class TestIsoIntensityCurvature(unittest.TestCase):
         self.assertEquals(255, out[7, 12, 18])
         # If tests fail, use tifffile.imsave to inspect
 
+
+    def test_in_slabs(self):
+        array = numpy.zeros((20, 25, 25), dtype=numpy.uint8)
+        _add_3d_gaussian(array, intensity=90000, mean=(8, 10, 5), sd=(3, 4, 2))
+        _add_3d_gaussian(array, intensity=80000, mean=(15, 11, 7), sd=(3, 4, 2))
+        out = numpy.full_like(array, 255)
+        get_negative_gaussian_curvatures_in_slabs(array, out, blur_radius=3, slab_size=4)
+
+        self.assertEquals(255, out[7, 12, 6])
+        self.assertEquals(0, out[7, 11, 11])
+        self.assertEquals(255, out[7, 12, 18])
+
+    def test_same_as_original_in_slabs(self):
+        """Compares the output of the two implementations on a larger image."""
+        array = _create_larger_image()
+
+        out_original = numpy.full_like(array, 255)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            get_negative_gaussian_curvatures(array, ImageDerivatives(), out_original)
+        out_in_slabs = numpy.full_like(array, 255)
+        get_negative_gaussian_curvatures_in_slabs(array, out_in_slabs)
+
+        # There can be some rounding differences where the curvature is almost zero
+        self.assertGreater((out_original == out_in_slabs).mean(), 0.999)
+
+    @unittest.skipUnless(os.environ.get("ORGANOID_TRACKER_BENCHMARK"), "benchmark, set ORGANOID_TRACKER_BENCHMARK=1 to"
+                                                                       " run it")
+    def test_benchmark_in_slabs(self):
+        """Times the two implementations on the same image as test_same_as_original_in_slabs. Of every
+        implementation, the fastest of three runs is reported."""
+        array = _create_larger_image()
+        out = numpy.full_like(array, 255)
+
+        times_original = []
+        for i in range(3):
+            start_time = default_timer()
+            with numpy.errstate(divide="ignore", invalid="ignore"):
+                get_negative_gaussian_curvatures(array, ImageDerivatives(), out)
+            times_original.append(default_timer() - start_time)
+
+        times_in_slabs = []
+        for i in range(3):
+            start_time = default_timer()
+            get_negative_gaussian_curvatures_in_slabs(array, out)
+            times_in_slabs.append(default_timer() - start_time)
+
+        print(f"\nOriginal: {min(times_original):.3f}s, in slabs: {min(times_in_slabs):.3f}s")
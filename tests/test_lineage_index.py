@@ -0,0 +1,77 @@
+import unittest
+
+from organoid_tracker.core.links import Links
+from organoid_tracker.core.position import Position
+from organoid_tracker.linking_analysis import lineage_index, lineage_id_creator
+
+
+def _create_links() -> Links:
+    """Creates a cell that divides twice, a cell that never divides and two cells that merge."""
+    links = Links()
+    mother = [Position(0, 0, 0, time_point_number=t) for t in range(0, 5)]
+    daughter_1 = [Position(-t, 0, 0, time_point_number=t) for t in range(5, 10)]
+    daughter_2 = [Position(t, 0, 0, time_point_number=t) for t in range(5, 10)]
+    granddaughter_1 = [Position(-t, 5, 0, time_point_number=t) for t in range(10, 12)]
+    granddaughter_2 = [Position(-t, -5, 0, time_point_number=t) for t in range(10, 12)]
+    single_cell = [Position(100, 100, 0, time_point_number=t) for t in range(0, 10)]
+    merging_cell_1 = [Position(200, 0, 0, time_point_number=t) for t in range(0, 3)]
+    merging_cell_2 = [Position(210, 0, 0, time_point_number=t) for t in range(0, 3)]
+    merged_cell = [Position(205, 0, 0, time_point_number=t) for t in range(3, 6)]
+    for track in [mother, daughter_1, daughter_2, granddaughter_1, granddaughter_2, single_cell, merging_cell_1,
+                  merging_cell_2, merged_cell]:
+        for position1, position2 in zip(track[:-1], track[1:]):
+            links.add_link(position1, position2)
+    links.add_link(mother[-1], daughter_1[0])
+    links.add_link(mother[-1], daughter_2[0])
+    links.add_link(daughter_1[-1], granddaughter_1[0])
+    links.add_link(daughter_1[-1], granddaughter_2[0])
+    links.add_link(merging_cell_1[-1], merged_cell[0])
+    links.add_link(merging_cell_2[-1], merged_cell[0])
+    return links
+
+
+class TestLineageIndex(unittest.TestCase):
+
+    def test_division_generation(self):
+        links = _create_links()
+        index = lineage_index.get_lineage_index(links)
+
+        mother_track = links.get_track(Position(0, 0, 0, time_point_number=0))
+        granddaughter_track = links.get_track(Position(-11, 5, 0, time_point_number=11))
+        self.assertEqual(0, index.get_division_generation(mother_track))
+        self.assertEqual(2, index.get_division_generation(granddaughter_track))
+        self.assertEqual(2, index.get_depth(granddaughter_track))
+        self.assertEqual(links.get_track_id(mother_track), index.get_original_track_id(granddaughter_track))
+
+    def test_lineage_ids(self):
+        links = _create_links()
+
+        mother = Position(0, 0, 0, time_point_number=0)
+        mother_id = links.get_track_id(links.get_track(mother))
+        self.assertEqual(mother_id, lineage_id_creator.get_lineage_id(links, mother))
+        granddaughter = Position(-11, -5, 0, time_point_number=11)
+        self.assertEqual(mother_id, lineage_id_creator.get_lineage_id(links, granddaughter))
+
+        # Never divides, so no lineage id, but it does have an original track id
+        single_cell = Position(100, 100, 0, time_point_number=4)
+        self.assertEqual(-1, lineage_id_creator.get_lineage_id(links, single_cell))
+        self.assertEqual(links.get_track_id(links.get_track(single_cell)),
+                         lineage_id_creator.get_original_track_id(links, single_cell))
+
+        # After a merge, the merged track is the start of a new lineage
+        merged_cell = Position(205, 0, 0, time_point_number=4)
+        self.assertEqual(links.get_track_id(links.get_track(merged_cell)),
+                         lineage_id_creator.get_original_track_id(links, merged_cell))
+
+    def test_updated_after_change(self):
+        links = _create_links()
+        granddaughter = Position(-11, 5, 0, time_point_number=11)
+        self.assertEqual(2, lineage_index.get_lineage_index(links).get_division_generation(
+            links.get_track(granddaughter)))
+
+        # Cut the link between the mother and the daughter
+        links.remove_link(Position(0, 0, 0, time_point_number=4), Position(-5, 0, 0, time_point_number=5))
+        self.assertEqual(1, lineage_index.get_lineage_index(links).get_division_generation(
+            links.get_track(granddaughter)))
+        self.assertEqual(links.get_track_id(links.get_track(Position(-5, 0, 0, time_point_number=5))),
+                         lineage_id_creator.get_lineage_id(links, granddaughter))
@@ -0,0 +1,97 @@
+import sys
+import types
+import unittest
+from unittest import mock
+
+try:
+    import dpct
+except ImportError:
+    # dpct_linker.run is replaced by a stand-in solver in these tests, so the dpct package itself is never used
+    sys.modules["dpct"] = types.ModuleType("dpct")
+
+from organoid_tracker.core.experiment import Experiment
+from organoid_tracker.core.links import Links
+from organoid_tracker.core.position import Position
+from organoid_tracker.core.resolution import ImageResolution
+from organoid_tracker.core.score import ScoreCollection
+from organoid_tracker.linking import linking_weight_sweep
+
+_MOTHER_END = Position(0, 0, 0, time_point_number=4)
+_DAUGHTER_2_START = Position(10, 0, 0, time_point_number=5)
+
+
+def _create_ground_truth() -> Experiment:
+    """Creates a cell that divides."""
+    experiment = Experiment()
+    experiment.images.set_resolution(ImageResolution(1, 1, 5, 12))
+    mother = [Position(0, 0, 0, time_point_number=t) for t in range(0, 5)]
+    daughter_1 = [Position(-10, 0, 0, time_point_number=t) for t in range(5, 10)]
+    daughter_2 = [Position(10, 0, 0, time_point_number=t) for t in range(5, 10)]
+    for track in [mother, daughter_1, daughter_2]:
+        for position in track:
+            experiment.positions.add(position)
+        for position1, position2 in zip(track[:-1], track[1:]):
+            experiment.links.add_link(position1, position2)
+    experiment.links.add_link(mother[-1], daughter_1[0])
+    experiment.links.add_link(mother[-1], daughter_2[0])
+    return experiment
+
+
+def _stand_in_solver(positions, position_data, possible_links: Links, scores, resolution, *, link_weight: int,
+                     detection_weight: int, division_weight: int, appearance_weight: int,
+                     dissappearance_weight: int) -> Links:
+    """Stand-in for dpct_linker.run. Returns all possible links, except that the division is missed if the division
+    weight is above 30."""
+    links = possible_links.copy()
+    if division_weight > 30:
+        links.remove_link(_MOTHER_END, _DAUGHTER_2_START)
+    return links
+
+
+class TestLinkingWeightSweep(unittest.TestCase):
+
+    def test_create_weight_grid(self):
+        grid = linking_weight_sweep.create_weight_grid(link_weights=[10, 20], detection_weights=[150],
+                                                       division_weights=[20, 40], appearance_weights=[150],
+                                                       dissappearance_weights=[100])
+        self.assertEqual([(10, 20), (10, 40), (20, 20), (20, 40)],
+                         [(weights.link_weight, weights.division_weight) for weights in grid])
+        self.assertEqual({"link_weight": 10, "detection_weight": 150, "division_weight": 20, "appearance_weight": 150,
+                          "dissappearance_weight": 100}, grid[0].to_dict())
+
+    def test_f1_score(self):
+        self.assertEqual(0, linking_weight_sweep._f1_score(0, 3, 4))
+        self.assertEqual(1, linking_weight_sweep._f1_score(5, 0, 0))
+        self.assertAlmostEqual(4 / 6, linking_weight_sweep._f1_score(2, 1, 1))
+
+    def _sweep(self, worker_count: int):
+        ground_truth = _create_ground_truth()
+        weights_list = linking_weight_sweep.create_weight_grid(link_weights=[10, 20], detection_weights=[150],
+                                                               division_weights=[40, 20], appearance_weights=[150],
+                                                               dissappearance_weights=[100])
+        with mock.patch("organoid_tracker.linking.dpct_linker.run", _stand_in_solver):
+            return linking_weight_sweep.sweep(ground_truth, ground_truth.links, ScoreCollection(), ground_truth,
+                                              weights_list, worker_count=worker_count)
+
+    def test_sweep(self):
+        results = self._sweep(worker_count=1)
+
+        # Best weights first, and for equal scores the order of the weights list is kept
+        self.assertEqual([(10, 20), (20, 20), (10, 40), (20, 40)],
+                         [(result.weights.link_weight, result.weights.division_weight) for result in results])
+        self.assertEqual(1, results[0].links_f1_score())
+        self.assertEqual(1, results[0].divisions_true_positives)
+        self.assertEqual(1, results[-1].links_false_negatives)
+        self.assertEqual(1, results[-1].divisions_false_negatives)
+
+    def test_sweep_in_two_processes(self):
+        self.assertEqual(linking_weight_sweep.format_table(self._sweep(worker_count=1)),
+                         linking_weight_sweep.format_table(self._sweep(worker_count=2)))
+
+    def test_format_table(self):
+        table = linking_weight_sweep.format_table(self._sweep(worker_count=1))
+        lines = table.splitlines()
+        self.assertEqual(5, len(lines))  # Header and four sets of weights
+        self.assertTrue(lines[0].startswith("rank\tlink_weight\t"))
+        self.assertTrue(lines[1].startswith("1\t10\t150\t20\t150\t100\t1.0000\t"))
+        self.assertEqual(len(lines[0].split("\t")), len(lines[1].split("\t")))
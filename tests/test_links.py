@@ -23,3 +23,25 @@ class TestLinks(unittest.TestCase):
 
         self.assertEquals({past_position}, links.find_pasts(position))
         self.assertEquals(set(), links.find_pasts(past_position))
+
+    def test_remove_links_of_positions(self):
+        # A track of five positions that divides into two tracks of five positions
+        track = [Position(0, 0, 0, time_point_number=t) for t in range(5)]
+        daughter_1 = [Position(-1, 0, 0, time_point_number=t) for t in range(5, 10)]
+        daughter_2 = [Position(1, 0, 0, time_point_number=t) for t in range(5, 10)]
+        links = Links()
+        for positions in [track, daughter_1, daughter_2]:
+            for position1, position2 in zip(positions[:-1], positions[1:]):
+                links.add_link(position1, position2)
+        links.add_link(track[-1], daughter_1[0])
+        links.add_link(track[-1], daughter_2[0])
+
+        removed = [track[2], daughter_1[0], daughter_2[3]]
+        expected = links.copy()
+        for position in removed:
+            expected.remove_links_of_position(position)
+        links.remove_links_of_positions(removed)
+
+        links.debug_sanity_check()
+        self.assertEqual(set(expected.find_all_links()), set(links.find_all_links()))
+        self.assertEqual(len(list(expected.find_all_tracks())), len(list(links.find_all_tracks())))
@@ -0,0 +1,79 @@
+import sys
+import types
+import unittest
+from unittest import mock
+
+try:
+    import dpct
+except ImportError:
+    # dpct_linker.run is replaced by a stand-in solver in these tests, so the dpct package itself is never used
+    sys.modules["dpct"] = types.ModuleType("dpct")
+
+from organoid_tracker.core.experiment import Experiment
+from organoid_tracker.core.links import Links
+from organoid_tracker.core.position import Position
+from organoid_tracker.core.resolution import ImageResolution
+from organoid_tracker.linking import local_relinker
+from organoid_tracker.linking.scoring_system import MotherScoringSystem
+
+_MOTHER_END = Position(0, 0, 0, time_point_number=4)
+_DAUGHTER_1_START = Position(-10, 0, 0, time_point_number=5)
+_DAUGHTER_2_START = Position(10, 0, 0, time_point_number=5)
+
+
+def _create_experiment() -> Experiment:
+    """Creates a cell that divides. The daughters move away from each other."""
+    experiment = Experiment()
+    experiment.images.set_resolution(ImageResolution(1, 1, 5, 12))
+    mother = [Position(0, 0, 0, time_point_number=t) for t in range(0, 5)]
+    daughter_1 = [Position(-5 - t, 0, 0, time_point_number=t) for t in range(5, 10)]
+    daughter_2 = [Position(5 + t, 0, 0, time_point_number=t) for t in range(5, 10)]
+    for track in [mother, daughter_1, daughter_2]:
+        for position in track:
+            experiment.positions.add(position)
+        for position1, position2 in zip(track[:-1], track[1:]):
+            experiment.links.add_link(position1, position2)
+    experiment.links.add_link(mother[-1], daughter_1[0])
+    experiment.links.add_link(mother[-1], daughter_2[0])
+    return experiment
+
+
+class _StandInSolver:
+    """Stand-in for dpct_linker.run. Keeps all possible links, and remembers the arguments it was called with."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, positions, position_data, possible_links: Links, scores, resolution, **kwargs) -> Links:
+        self.calls.append(kwargs)
+        return possible_links.copy()
+
+
+class TestLocalRelinker(unittest.TestCase):
+
+    def test_find_region(self):
+        experiment = _create_experiment()
+        region = local_relinker.find_region(experiment, min_time_point_number=2, max_time_point_number=7,
+                                            around=[Position(-5, 0, 0)], radius_um=8)
+        expected = {Position(0, 0, 0, time_point_number=t) for t in range(2, 5)} | \
+                   {Position(-5 - t, 0, 0, time_point_number=t) for t in range(5, 8)}
+        self.assertEqual(expected, region)
+
+    def test_relink_region_with_division_on_border(self):
+        experiment = _create_experiment()
+        original_links = set(experiment.links.find_all_links())
+        experiment.links.remove_link(Position(-11, 0, 0, time_point_number=6), Position(-12, 0, 0, time_point_number=7))
+
+        # Relink the mother and the first daughter, but not the second daughter
+        region = local_relinker.find_region(experiment, min_time_point_number=2, max_time_point_number=7,
+                                            around=[Position(-5, 0, 0)], radius_um=8)
+        solver = _StandInSolver()
+        with mock.patch("organoid_tracker.linking.dpct_linker.run", solver):
+            links = local_relinker.relink_region(experiment, region, scoring_system=MotherScoringSystem())
+
+        # The removed link is found again, and the division is not broken up
+        self.assertEqual(original_links, set(links.find_all_links()))
+        self.assertIn(_MOTHER_END, solver.calls[0]["free_disappearances"])
+        self.assertIn(_DAUGHTER_1_START, solver.calls[0]["free_appearances"])
+        self.assertTrue(links.contains_link(_MOTHER_END, _DAUGHTER_1_START))
+        self.assertTrue(links.contains_link(_MOTHER_END, _DAUGHTER_2_START))
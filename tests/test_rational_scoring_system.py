@@ -0,0 +1,132 @@
+import unittest
+from typing import Optional, Tuple, List
+
+import numpy
+from numpy import ndarray
+
+from organoid_tracker.core import TimePoint
+from organoid_tracker.core.experiment import Experiment
+from organoid_tracker.core.gaussian import Gaussian
+from organoid_tracker.core.image_loader import ImageLoader, ImageChannel
+from organoid_tracker.core.images import Images
+from organoid_tracker.core.position import Position
+from organoid_tracker.core.position_data import PositionData
+from organoid_tracker.core.resolution import ImageResolution
+from organoid_tracker.core.score import Family, Score
+from organoid_tracker.core.shape import GaussianShape
+from organoid_tracker.linking import cell_division_finder
+from organoid_tracker.linking.rational_scoring_system import RationalScoringSystem
+from organoid_tracker.linking.scoring_system import MotherScoringSystem
+from organoid_tracker.linking_analysis import linking_markers
+
+
+class _TestImageChannel(ImageChannel):
+
+    def __repr__(self) -> str:
+        return "_TestImageChannel"
+
+
+class _RandomImageLoader(ImageLoader):
+    """Returns a different random image for every time point."""
+
+    _channel = _TestImageChannel()
+    _last_time_point_number: int
+
+    def __init__(self, last_time_point_number: int = 2):
+        self._last_time_point_number = last_time_point_number
+
+    def get_3d_image_array(self, time_point: TimePoint, image_channel: ImageChannel) -> Optional[ndarray]:
+        random = numpy.random.RandomState(time_point.time_point_number())
+        return random.randint(0, 255, size=self.get_image_size_zyx()).astype(numpy.uint8)
+
+    def get_2d_image_array(self, time_point: TimePoint, image_channel: ImageChannel, image_z: int) -> Optional[ndarray]:
+        return self.get_3d_image_array(time_point, image_channel)[image_z]
+
+    def get_image_size_zyx(self) -> Optional[Tuple[int, int, int]]:
+        return 10, 100, 100
+
+    def first_time_point_number(self) -> Optional[int]:
+        return 1
+
+    def last_time_point_number(self) -> Optional[int]:
+        return self._last_time_point_number
+
+    def get_channels(self) -> List[ImageChannel]:
+        return [self._channel]
+
+    def copy(self) -> "ImageLoader":
+        return _RandomImageLoader(self._last_time_point_number)
+
+    def serialize_to_config(self) -> Tuple[str, str]:
+        return "", ""
+
+
+class _ResolutionRecordingScoringSystem(MotherScoringSystem):
+    """Calculates the rational score, and adds the time resolution of the images to it."""
+
+    def calculate(self, images: Images, position_data: PositionData, family: Family) -> Score:
+        score = RationalScoringSystem().calculate(images, position_data, family)
+        score.time_resolution_m = images.resolution().time_point_interval_m
+        return score
+
+
+def _create_dividing_experiment() -> Experiment:
+    """Creates an experiment where five cells divide in each of the time points 1, 2 and 3, so 15 divisions in
+    total."""
+    experiment = Experiment()
+    experiment.images.image_loader(_RandomImageLoader(last_time_point_number=4))
+    experiment.images.set_resolution(ImageResolution(0.32, 0.32, 2, 12))
+    for time_point_number in range(1, 4):
+        for i in range(5):
+            mother = Position(15 + 17 * i, 20 + 25 * time_point_number, 5, time_point_number=time_point_number)
+            daughter_1 = Position(10 + 17 * i, 15 + 25 * time_point_number, 5, time_point_number=time_point_number + 1)
+            daughter_2 = Position(20 + 17 * i, 25 + 25 * time_point_number, 4, time_point_number=time_point_number + 1)
+            for position in [mother, daughter_1, daughter_2]:
+                experiment.positions.add(position)
+                shape = GaussianShape(Gaussian(200, 0, 0, 0, 30 + i, 25, 2, 0, 0, 0))
+                linking_markers.set_shape(experiment.position_data, position, shape)
+            experiment.links.add_link(mother, daughter_1)
+            experiment.links.add_link(mother, daughter_2)
+    return experiment
+
+
+class TestRationalScoringSystem(unittest.TestCase):
+
+    def test_cached_equals_uncached(self):
+        experiment = Experiment()
+        experiment.images.image_loader(_RandomImageLoader())
+        mother = Position(50, 50, 5, time_point_number=1)
+        daughters = [Position(40, 45, 5, time_point_number=2), Position(60, 52, 4, time_point_number=2),
+                     Position(48, 65, 6, time_point_number=2)]
+        for i, position in enumerate([mother] + daughters):
+            shape = GaussianShape(Gaussian(200, 0, 0, 0, 30 + i, 25, 2, 0, 0, 0))
+            linking_markers.set_shape(experiment.position_data, position, shape)
+        families = [Family(mother, daughters[0], daughters[1]), Family(mother, daughters[0], daughters[2]),
+                    Family(mother, daughters[1], daughters[2])]
+
+        scoring_system = RationalScoringSystem(cache_size=3)  # Small cache, so that entries are also removed
+        for family in families:
+            cached_score = scoring_system.calculate(experiment.images, experiment.position_data, family)
+            uncached_score = RationalScoringSystem().calculate(experiment.images, experiment.position_data, family)
+            self.assertEqual(uncached_score.dict(), cached_score.dict())
+            self.assertIn("mother_intensity_delta", cached_score.keys())  # So not outside the image
+
+    def test_calculate_scores_in_two_processes(self):
+        experiment = _create_dividing_experiment()
+
+        scores_one_process = cell_division_finder.calculates_scores(
+            experiment.images, experiment.position_data, experiment.links, _ResolutionRecordingScoringSystem(),
+            worker_count=1)
+        scores_two_processes = cell_division_finder.calculates_scores(
+            experiment.images, experiment.position_data, experiment.links, _ResolutionRecordingScoringSystem(),
+            worker_count=2)
+
+        scores_dict_one_process = {scored_family.family: scored_family.score.dict()
+                                   for scored_family in scores_one_process.all_scored_families()}
+        scores_dict_two_processes = {scored_family.family: scored_family.score.dict()
+                                     for scored_family in scores_two_processes.all_scored_families()}
+        self.assertEqual(15, len(scores_dict_one_process))
+        self.assertEqual(scores_dict_one_process, scores_dict_two_processes)
+        for score_dict in scores_dict_two_processes.values():
+            self.assertEqual(12, score_dict["time_resolution_m"])  # So the resolution reached the scoring system
+            self.assertIn("mother_intensity_delta", score_dict)  # So not outside the image
@@ -0,0 +1,46 @@
+import tempfile
+import unittest
+
+from organoid_tracker.core.links import Links
+from organoid_tracker.core.position import Position
+from organoid_tracker.core.score import ScoreCollection, Family, Score
+from organoid_tracker.imaging import stage_cache
+
+
+class TestStageCache(unittest.TestCase):
+
+    def test_keys(self):
+        key = stage_cache.create_key("links", {"link_weight": 20, "division_weight": 30}, 0)
+        self.assertEqual(key, stage_cache.create_key("links", {"division_weight": 30, "link_weight": 20}, 0))
+        self.assertNotEqual(key, stage_cache.create_key("links", {"link_weight": 21, "division_weight": 30}, 0))
+
+    def test_links_round_trip(self):
+        links = Links()
+        mother = Position(10, 20, 3, time_point_number=1)
+        daughter1 = Position(12, 21, 4, time_point_number=2)
+        daughter2 = Position(8, 19, 3, time_point_number=2)
+        links.add_link(mother, daughter1)
+        links.add_link(mother, daughter2)
+
+        with tempfile.TemporaryDirectory() as folder:
+            self.assertIsNone(stage_cache.load_links(folder, "links", "abc"))
+            stage_cache.save_links(folder, "links", "abc", links)
+            loaded = stage_cache.load_links(folder, "links", "abc")
+            self.assertIsNone(stage_cache.load_links(folder, "links", "def"))
+
+        self.assertEqual(set(links.find_all_links()), set(loaded.find_all_links()))
+
+    def test_scores_round_trip(self):
+        scores = ScoreCollection()
+        family = Family(Position(10, 20, 3, time_point_number=1), Position(12, 21, 4, time_point_number=2),
+                        Position(8, 19, 3, time_point_number=2))
+        scores.set_family_score(family, Score(mother_volume=-10, mother_intensity_delta=0.5))
+
+        with tempfile.TemporaryDirectory() as folder:
+            stage_cache.save_scores(folder, "scores", "abc", scores)
+            loaded = stage_cache.load_scores(folder, "scores", "abc")
+
+        loaded_families = list(loaded.all_scored_families())
+        self.assertEqual(1, len(loaded_families))
+        self.assertEqual(family, loaded_families[0].family)
+        self.assertEqual({"mother_volume": -10, "mother_intensity_delta": 0.5}, loaded_families[0].score.dict())
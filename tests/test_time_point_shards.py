@@ -0,0 +1,35 @@
+import tempfile
+import unittest
+
+from organoid_tracker.core import TimePoint
+from organoid_tracker.core.experiment import Experiment
+from organoid_tracker.core.gaussian import Gaussian
+from organoid_tracker.core.position import Position
+from organoid_tracker.core.shape import GaussianShape
+from organoid_tracker.imaging import io
+from organoid_tracker.linking_analysis import linking_markers
+
+
+class TestTimePointShards(unittest.TestCase):
+
+    def test_round_trip(self):
+        experiment = Experiment()
+        position1 = Position(10, 20, 3, time_point_number=1)
+        position2 = Position(12, 21, 4, time_point_number=2)
+        experiment.positions.add(position1)
+        experiment.positions.add(position2)
+        shape = GaussianShape(Gaussian(200, 0, 0, 0, 20, 20, 2, 1, 0, 0))
+        linking_markers.set_shape(experiment.position_data, position1, shape)
+
+        with tempfile.TemporaryDirectory() as folder:
+            io.save_time_point_shard(experiment, TimePoint(1), folder)
+            io.save_time_point_shard(experiment, TimePoint(3), folder)  # Has no positions, but is still recorded
+            self.assertEqual({TimePoint(1), TimePoint(3)}, io.find_time_points_with_shards(folder))
+
+            loaded = Experiment()
+            io.load_time_point_shards(loaded, folder)
+            self.assertEqual({position1}, set(loaded.positions))
+            self.assertEqual(shape.to_list(), linking_markers.get_shape(loaded.position_data, position1).to_list())
+
+    def test_missing_folder(self):
+        self.assertEqual(set(), io.find_time_points_with_shards("this folder does not exist"))
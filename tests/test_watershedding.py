@@ -0,0 +1,28 @@
+import unittest
+
+import numpy
+
+from organoid_tracker.core.gaussian import Gaussian
+from organoid_tracker.core.position import Position
+from organoid_tracker.position_detection import watershedding
+
+
+class TestWatershedding(unittest.TestCase):
+
+    def test_tiled_equals_untiled(self):
+        numpy.random.seed(1949)
+        image = numpy.zeros((10, 250, 250), dtype=numpy.float64)
+        positions = [None]  # First element is the background
+        for i in range(30):
+            x, y, z = numpy.random.uniform(20, 230), numpy.random.uniform(20, 230), numpy.random.uniform(3, 7)
+            Gaussian(200, x, y, z, 40, 40, 2, 0, 0, 0).draw(image)
+            positions.append(Position(x, y, z))
+        image = numpy.clip(image, 0, 255).astype(numpy.uint8)
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            untiled = watershedding.watershed_positions(image, positions, (1, 1, 1), 51)
+            tiled = watershedding.watershed_positions_tiled(image, positions, (1, 1, 1), 51, max_memory_mb=6,
+                                                            tile_margin_xy=40)
+
+        self.assertEqual(37, watershedding.get_tile_size_xy(image.shape, 40, 6))  # So multiple tiles are used
+        numpy.testing.assert_array_equal(untiled, tiled)